@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Stub ffmpeg and ffprobe executable, answering the commands of the analyzers with canned outputs
+
+Install it as "ffmpeg" and "ffprobe" (symbolic links) in a directory put first in the PATH, the program is chosen by
+its name. The "video" files are small JSON descriptors of their width, height, duration, bitrate and complexity.
+
+Environment variables:
+    FAKE_FFMPEG_DELAY: Sleep of every process (in seconds, default 0)
+    FAKE_FFMPEG_SPEED: Processed media seconds per second of every encoding, decoding or assessment (default 0 is no sleep)
+"""
+
+import os
+import re
+import sys
+import json
+import time
+
+FRAMERATE = 25
+
+# Descriptor of the files which are not descriptors
+DEFAULT_DESCRIPTOR = {'width': 1920, 'height': 1080, 'duration': 60.0, 'bit_rate': 8000000, 'complexity': 1.0}
+
+
+def get_argument(argv, name, default=None):
+    """Get the value following an option, the first one when the option is repeated"""
+    if name in argv:
+        return argv[argv.index(name) + 1]
+    return default
+
+
+def load_descriptor(file_path):
+    """Load the descriptor of a video file, from the stdin for "-" """
+    try:
+        if file_path == '-':
+            descriptor = json.loads(sys.stdin.buffer.readline())
+        else:
+            with open(file_path) as descriptor_file:
+                descriptor = json.load(descriptor_file)
+    except (IOError, ValueError):
+        descriptor = {}
+    return dict(DEFAULT_DESCRIPTOR, **descriptor)
+
+
+def write_descriptor(file_path, descriptor):
+    """Write the descriptor of an output video file, on the stdout for "-" """
+    if file_path == '-':
+        sys.stdout.write(json.dumps(descriptor) + '\n')
+        # Some encoded payload, proportional to the bitrate
+        sys.stdout.write('x'*int(descriptor['bit_rate']*descriptor['duration']/8/1000))
+    else:
+        with open(file_path, 'w') as descriptor_file:
+            json.dump(descriptor, descriptor_file)
+
+
+def get_complexity(descriptor, time_position):
+    """Get a complexity varying along the video, like successive scenes"""
+    return descriptor['complexity']*(1 + (int(time_position*7) % 5)*0.15)
+
+
+def work(duration):
+    """Sleep the processing time of a media duration"""
+    speed = float(os.environ.get('FAKE_FFMPEG_SPEED', '0'))
+    if speed > 0:
+        time.sleep(duration/speed)
+
+
+def probe(argv):
+    """Answer the stream probes and the packet probes"""
+    descriptor = load_descriptor(get_argument(argv, '-i'))
+    if '-show_entries' in argv:
+        packet_size = descriptor['bit_rate']/8/FRAMERATE
+        for n in range(int(descriptor['duration']*FRAMERATE)):
+            time_position = n/FRAMERATE
+            print('{:f},{:d}'.format(time_position, int(packet_size*get_complexity(descriptor, time_position)/descriptor['complexity'])))
+        return
+
+    stream = {'codec_type': 'video', 'codec_name': 'h264', 'r_frame_rate': '{}/1'.format(FRAMERATE),
+              'width': descriptor['width'], 'height': descriptor['height'],
+              'bit_rate': str(int(descriptor['bit_rate'])), 'duration': str(descriptor['duration'])}
+    print(json.dumps({'streams': [stream], 'format': {'duration': str(descriptor['duration'])}}))
+
+
+def assess(argv):
+    """Answer a metric assessment, the metric value grows with the bits per pixel"""
+    graph = get_argument(argv, '-lavfi')
+    descriptor = load_descriptor(argv[argv.index('-i') + 1])
+    work(descriptor['duration'])
+
+    bits_per_pixel = descriptor['bit_rate']/(descriptor['width']*descriptor['height']*FRAMERATE*descriptor['complexity'])
+    quality = 1 - 1/(1 + 20*bits_per_pixel)
+
+    # The upscaling to the reference definition caps the quality of the lower definitions
+    match = re.search(r'scale=(\d+):(\d+)', graph)
+    if match is not None:
+        quality *= 1 - 0.5*(1 - min(descriptor['width']*descriptor['height']/(int(match.group(1))*int(match.group(2))), 1))
+
+    frame_step = 1
+    match = re.search(r'not\(mod\(n\\?,(\d+)\)\)', graph)
+    if match is not None:
+        frame_step = int(match.group(1))
+
+    if 'stats_file=-' in graph:
+        for n in range(0, int(descriptor['duration']*FRAMERATE), frame_step):
+            frame_quality = quality - (0.01 if n % 50 == 0 else 0)
+            if 'ssim' in graph:
+                print('n:{} Y:{:f} U:{:f} V:{:f} All:{:f} (20.0)'.format(n + 1, frame_quality, frame_quality, frame_quality, frame_quality))
+            else:
+                print('n:{} mse_avg:1.00 mse_y:1.00 psnr_avg:{:f} psnr_y:30.00'.format(n + 1, 30 + 20*frame_quality))
+
+    if 'ssim' in graph:
+        sys.stderr.write('[Parsed_ssim_1 @ 0x1] SSIM Y:{0:f} U:{0:f} V:{0:f} All:{0:f} (20.0)\n'.format(quality))
+    else:
+        sys.stderr.write('[Parsed_psnr_1 @ 0x1] PSNR y:30.00 u:30.00 v:30.00 average:{:f} min:20.00 max:40.00\n'.format(30 + 20*quality))
+
+
+def score_scenes(argv):
+    """Answer a scene change scoring, with the per frame metadata"""
+    descriptor = load_descriptor(get_argument(argv, '-i'))
+    work(descriptor['duration']/4)
+    for n in range(int(descriptor['duration']*FRAMERATE)):
+        time_position = n/FRAMERATE
+        print('frame:{}    pts:{}    pts_time:{:g}'.format(n, n*512, time_position))
+        print('lavfi.scene_score={:f}'.format((get_complexity(descriptor, time_position) - descriptor['complexity'])/10))
+
+
+def encode(argv):
+    """Answer the CRF, CBR and multiple output encodings and the raw decodings"""
+    descriptor = load_descriptor(get_argument(argv, '-i'))
+    part_start_time = float(get_argument(argv, '-ss', 0))
+
+    if '-filter_complex' in argv:
+        scales = dict((label, (int(width), int(height))) for width, height, label in
+                      re.findall(r'scale=(\d+):(\d+)\[(out\d+)\]', get_argument(argv, '-filter_complex')))
+        for i, argument in enumerate(argv):
+            if argument == '-map':
+                width, height = scales[argv[i + 1].strip('[]')]
+                duration = float(get_argument(argv[i:], '-t'))
+                work(duration)
+                write_descriptor(get_argument(argv[i:], '-y'), dict(descriptor, width=width, height=height, duration=duration,
+                                                                    bit_rate=int(get_argument(argv[i:], '-b:v'))))
+        return
+
+    duration = float(get_argument(argv, '-t', descriptor['duration']))
+    work(duration)
+    width, height = descriptor['width'], descriptor['height']
+    if '-s' in argv:
+        width, height = [int(value) for value in get_argument(argv, '-s').split('x')]
+
+    if '-crf' in argv:
+        # 0.1 bits per pixel at CRF 23 for a complexity of 1, halved every 6 CRF steps
+        crf_value = float(get_argument(argv, '-crf'))
+        framerate = float(get_argument(argv, '-r', FRAMERATE))
+        bitrate = int(0.1*width*height*framerate*get_complexity(descriptor, part_start_time)*2**((23 - crf_value)/6))
+    elif '-b:v' in argv:
+        bitrate = int(get_argument(argv, '-b:v'))
+    else:
+        # Raw decoding
+        bitrate = int(width*height*FRAMERATE*12)
+
+    write_descriptor(argv[-1], dict(descriptor, width=width, height=height, duration=duration, bit_rate=bitrate))
+
+
+def main(argv):
+    """Run as ffmpeg or ffprobe, after the configured delay"""
+    time.sleep(float(os.environ.get('FAKE_FFMPEG_DELAY', '0')))
+
+    if '-version' in argv:
+        print('ffmpeg version fake-1.0')
+    elif os.path.basename(argv[0]).startswith('ffprobe'):
+        probe(argv)
+    elif '-lavfi' in argv:
+        assess(argv)
+    elif 'metadata=print' in (get_argument(argv, '-vf') or ''):
+        score_scenes(argv)
+    else:
+        encode(argv)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
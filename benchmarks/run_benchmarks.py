@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmarks of the CRF and Metric analyzers, on synthetic sources of controlled length and complexity
+
+With a real ffmpeg, the sources are generated with the "testsrc2" (simple) and "mandelbrot" (complex) lavfi sources.
+With --fake, the stub ffmpeg and ffprobe of fake_ffmpeg.py are used, to measure the orchestration overhead, the
+parallel scaling and the cache hit rates on machines without real encoders:
+
+    python benchmarks/run_benchmarks.py --fake --delay 0.05 --parts 4,8,16 --workers 1,2,4
+
+With --baseline, the results are compared with a baseline saved by --save-baseline, and the script exits with an error
+when a benchmark is slower than its baseline by more than --tolerance, or runs more tasks. test_benchmarks.py runs
+the stub ffmpeg benchmarks of benchmarks/baseline.json under pytest.
+"""
+
+from __future__ import division
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pertitleanalysis import per_title_analysis as pta
+from pertitleanalysis.cache_providers import ProbeCache, ResultStore
+
+# Synthetic sources: lavfi source and complexity of the fake descriptor
+SOURCES = {'testsrc2': 0.5, 'mandelbrot': 2.0}
+
+# Accepted slowdown compared to a baseline, as a fraction of the baseline time, and at least in seconds (the timer noise of the short benchmarks)
+DEFAULT_TOLERANCE = 0.5
+MIN_TOLERANCE_SECONDS = 0.05
+
+# Arguments not saved in a baseline, they do not change the benchmarks
+BASELINE_IGNORED_ARGUMENTS = ['output', 'save_baseline', 'baseline', 'tolerance']
+
+
+def install_fake_ffmpeg(directory):
+    """Install the stub ffmpeg and ffprobe first in the PATH
+
+    :param directory: Directory of the ffmpeg and ffprobe links
+    :type directory: str
+    """
+    fake_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_ffmpeg.py')
+    os.chmod(fake_file_path, 0o755)
+    for program in ['ffmpeg', 'ffprobe']:
+        os.symlink(fake_file_path, os.path.join(directory, program))
+    os.environ['PATH'] = directory + os.pathsep + os.environ['PATH']
+
+
+def generate_source(directory, source, duration, width, height, fake=False):
+    """Generate a synthetic source file
+
+    :param directory: Directory of the source file
+    :type directory: str
+    :param source: The lavfi source, "testsrc2" or "mandelbrot"
+    :type source: str
+    :param duration: Duration of the source (in seconds)
+    :type duration: float
+    :param width: Width of the source
+    :type width: int
+    :param height: Height of the source
+    :type height: int
+    :param fake: Write a descriptor of the stub ffmpeg instead of encoding the source
+    :type fake: bool
+    :return: The source file path
+    :rtype: str
+    """
+    source_file_path = os.path.join(directory, '{}_{}x{}_{}s.mp4'.format(source, width, height, duration))
+    if fake is True:
+        with open(source_file_path, 'w') as source_file:
+            json.dump({'width': width, 'height': height, 'duration': float(duration), 'bit_rate': 20000000, 'complexity': SOURCES[source]}, source_file)
+        return source_file_path
+
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error',
+               '-f', 'lavfi', '-i', '{}=size={}x{}:rate=25'.format(source, width, height),
+               '-t', str(duration),
+               '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '12', '-pix_fmt', 'yuv420p',
+               '-y', source_file_path]
+    subprocess.check_call(command)
+    return source_file_path
+
+
+def get_ladder():
+    """Get the template encoding ladder of the benchmarks
+
+    :return: The template encoding ladder
+    :rtype: per_title_analysis.EncodingLadder
+    """
+    profile_list = []
+    profile_list.append(pta.EncodingProfile(1920, 1080, 4500000, 2000000, 6000000, True))
+    profile_list.append(pta.EncodingProfile(1280, 720, 3400000, 1300000, 4500000, True))
+    profile_list.append(pta.EncodingProfile(640, 360, 1100000, 300000, 2000000, True))
+    return pta.EncodingLadder(profile_list)
+
+
+def run_benchmark(name, analyzer, process, workers, probe_cache, result_store):
+    """Time an analysis and collect its task and cache statistics
+
+    :param name: Benchmark name and parameters
+    :type name: dict
+    :param analyzer: The analyzer
+    :type analyzer: per_title_analysis.Analyzer
+    :param process: Runs the analysis
+    :type process: callable
+    :param workers: Number of workers of the analysis
+    :type workers: int
+    :param probe_cache: The probe cache of the analyzer
+    :type probe_cache: cache_providers.ProbeCache
+    :param result_store: The result store of the analyzer ('None' value is no store)
+    :type result_store: cache_providers.ResultStore
+    :return: The benchmark result
+    :rtype: dict
+    """
+    probe_hits, probe_misses = probe_cache.hits, probe_cache.misses
+    if result_store is not None:
+        result_hits, result_misses = result_store.hits, result_store.misses
+
+    start_time = time.time()
+    process()
+    seconds = time.time() - start_time
+
+    task_wall_time = sum(task_statistics['wall_time'] for task_statistics in analyzer.task_statistics)
+
+    result = dict(name)
+    result['workers'] = workers
+    result['seconds'] = seconds
+    result['tasks'] = len(analyzer.task_statistics)
+    result['task_wall_time'] = task_wall_time
+    # Share of the workers time spent running the tasks, the rest is orchestration overhead or idle workers
+    result['parallel_efficiency'] = task_wall_time/(seconds*workers) if seconds > 0 else None
+    result['probe_cache_hits'] = probe_cache.hits - probe_hits
+    result['probe_cache_misses'] = probe_cache.misses - probe_misses
+    if result_store is not None:
+        result['result_store_hits'] = result_store.hits - result_hits
+        result['result_store_misses'] = result_store.misses - result_misses
+    return result
+
+
+def get_integers(values):
+    """Parse a comma separated list of integers
+
+    :param values: The comma separated list
+    :type values: str
+    :return: The integers
+    :rtype: int[]
+    """
+    return [int(value) for value in values.split(',') if value.strip()]
+
+
+def get_benchmark_key(result):
+    """Get the key of a benchmark result in a baseline: its name and its number of workers
+
+    :param result: The benchmark result
+    :type result: dict
+    :return: The key
+    :rtype: str
+    """
+    return json.dumps([result.get(key) for key in ['benchmark', 'source', 'parts', 'steps', 'run', 'workers']])
+
+
+def load_baseline(file_path):
+    """Load a baseline written with --save-baseline
+
+    :param file_path: The baseline file path
+    :type file_path: str
+    :return: The arguments (like argparse.Namespace attributes) and the results of the baseline run
+    :rtype: dict
+    """
+    with open(file_path, 'r') as baseline_file:
+        return json.load(baseline_file)
+
+
+def check_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compare benchmark results with a baseline: a benchmark regresses when it is slower than its baseline by more than the tolerance
+    (and by more than MIN_TOLERANCE_SECONDS), or runs more tasks
+
+    :param results: The benchmark results
+    :type results: dict[]
+    :param baseline: The baseline, see load_baseline
+    :type baseline: dict
+    :param tolerance: Accepted slowdown, as a fraction of the baseline time
+    :type tolerance: float
+    :return: The regressions, human readable
+    :rtype: str[]
+    """
+    baseline_results = dict((get_benchmark_key(result), result) for result in baseline['results'])
+    regressions = []
+    for result in results:
+        key = get_benchmark_key(result)
+        if key not in baseline_results:
+            regressions.append('{}: no baseline'.format(key))
+            continue
+        reference = baseline_results[key]
+        if result['tasks'] > reference['tasks']:
+            regressions.append('{}: {} tasks, {} in the baseline'.format(key, result['tasks'], reference['tasks']))
+        if result['seconds'] > max(reference['seconds']*(1 + tolerance), reference['seconds'] + MIN_TOLERANCE_SECONDS):
+            regressions.append('{}: {:.3f}s, {:.3f}s in the baseline (tolerance {:.0%})'.format(key, result['seconds'], reference['seconds'], tolerance))
+    return regressions
+
+
+def get_parser():
+    """Get the command line parser of the benchmarks
+
+    :return: The parser
+    :rtype: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the per-title analyzers on synthetic sources')
+    parser.add_argument('--fake', action='store_true', help='use the stub ffmpeg and ffprobe of fake_ffmpeg.py')
+    parser.add_argument('--delay', type=float, default=0.0, help='sleep of every stub process (in seconds)')
+    parser.add_argument('--speed', type=float, default=0.0, help='media seconds processed per second by the stub processes (0 is no sleep)')
+    parser.add_argument('--sources', default='testsrc2,mandelbrot', help='comma separated lavfi sources')
+    parser.add_argument('--duration', type=float, default=60.0, help='duration of the sources (in seconds)')
+    parser.add_argument('--width', type=int, default=1920, help='width of the sources')
+    parser.add_argument('--height', type=int, default=1080, help='height of the sources')
+    parser.add_argument('--parts', default='4,8,16', help='comma separated CRF part counts')
+    parser.add_argument('--steps', default='1000000,500000', help='comma separated Metric bitrate steps')
+    parser.add_argument('--workers', default='1,2,4', help='comma separated worker counts')
+    parser.add_argument('--metric', default='ssim', help='metric of the Metric benchmarks')
+    parser.add_argument('--result-store', action='store_true', help='run every benchmark twice with a result store, cold then warm')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--save-baseline', help='write the arguments and the results to this baseline file')
+    parser.add_argument('--baseline', help='compare the results with this baseline file, and exit with an error on a regression')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='accepted slowdown compared to the baseline, as a fraction of its time')
+    return parser
+
+
+def run_benchmarks(arguments):
+    """Run the benchmarks
+
+    :param arguments: The parsed command line arguments
+    :type arguments: argparse.Namespace
+    :return: The benchmark results
+    :rtype: dict[]
+    """
+    sources = [source.strip() for source in arguments.sources.split(',') if source.strip()]
+    for source in sources:
+        if source not in SOURCES:
+            raise ValueError('Available sources are "testsrc2" and "mandelbrot", does not include: {}'.format(source))
+
+    path = os.environ['PATH']
+    directory = tempfile.mkdtemp(prefix='pertitle_benchmarks_')
+    try:
+        if arguments.fake is True:
+            bin_directory = os.path.join(directory, 'bin')
+            os.mkdir(bin_directory)
+            install_fake_ffmpeg(bin_directory)
+            os.environ['FAKE_FFMPEG_DELAY'] = str(arguments.delay)
+            os.environ['FAKE_FFMPEG_SPEED'] = str(arguments.speed)
+
+        ladder = get_ladder()
+        runs = ['cold', 'warm'] if arguments.result_store is True else [None]
+        results = []
+
+        for source in sources:
+            source_file_path = generate_source(directory, source, arguments.duration, arguments.width, arguments.height, arguments.fake)
+            probe_cache = ProbeCache()
+
+            for workers in get_integers(arguments.workers):
+                result_store = None
+                if arguments.result_store is True:
+                    result_store = ResultStore(os.path.join(directory, 'results_{}_{}'.format(source, workers)))
+
+                for run in runs:
+                    for number_of_parts in get_integers(arguments.parts):
+                        analyzer = pta.CrfAnalyzer(source_file_path, ladder, probe_cache, result_store)
+                        name = {'benchmark': 'crf', 'source': source, 'parts': number_of_parts, 'run': run}
+                        results.append(run_benchmark(name, analyzer, lambda: analyzer.process(number_of_parts, arguments.width, arguments.height, 23, 2,
+                                                                                               max_workers=workers),
+                                                     workers, probe_cache, result_store))
+                        print(json.dumps(results[-1], sort_keys=True))
+
+                    for bitrate_steps in get_integers(arguments.steps):
+                        analyzer = pta.MetricAnalyzer(source_file_path, ladder, probe_cache, result_store)
+                        name = {'benchmark': 'metric', 'source': source, 'steps': bitrate_steps, 'run': run}
+                        results.append(run_benchmark(name, analyzer, lambda: analyzer.process(arguments.metric, bitrate_steps, 2, max_workers=workers),
+                                                     workers, probe_cache, result_store))
+                        print(json.dumps(results[-1], sort_keys=True))
+        return results
+    finally:
+        # The stub ffmpeg is only first in the PATH during the benchmarks
+        os.environ['PATH'] = path
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = get_parser()
+    arguments = parser.parse_args(argv)
+    results = run_benchmarks(arguments)
+
+    if arguments.output is not None:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4, sort_keys=True)
+
+    if arguments.save_baseline is not None:
+        # The baseline arguments replay the same benchmarks, without the output options
+        baseline_arguments = dict((key, value) for key, value in vars(arguments).items() if key not in BASELINE_IGNORED_ARGUMENTS)
+        with open(arguments.save_baseline, 'w') as baseline_file:
+            json.dump({'arguments': baseline_arguments, 'results': results}, baseline_file, indent=4, sort_keys=True)
+
+    if arguments.baseline is not None:
+        regressions = check_baseline(results, load_baseline(arguments.baseline), arguments.tolerance)
+        for regression in regressions:
+            print('Regression: ' + regression)
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""Regression test of the benchmarks, run with the stub ffmpeg against benchmarks/baseline.json
+
+Refresh the baseline after an expected change of the timings:
+
+    python benchmarks/run_benchmarks.py --fake --delay 0.1 --sources testsrc2 --parts 4,8 --steps 1000000 --workers 1,2 --result-store --save-baseline benchmarks/baseline.json
+"""
+
+import os
+import argparse
+
+import run_benchmarks
+
+BASELINE_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def test_benchmarks_baseline():
+    baseline = run_benchmarks.load_baseline(BASELINE_FILE_PATH)
+    assert baseline['arguments']['fake'] is True
+
+    results = run_benchmarks.run_benchmarks(argparse.Namespace(**baseline['arguments']))
+    regressions = run_benchmarks.check_baseline(results, baseline)
+    assert regressions == []
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""Command line entry point: python -m pertitleanalysis worker <spool_directory>"""
+
+import sys
+
+from .spool_providers import main as worker_main
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) == 0 or argv[0] != 'worker':
+        sys.stderr.write('usage: python -m pertitleanalysis worker [-h] spool_directory\n')
+        return 2
+    return worker_main(argv[1:])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import asyncio
+
+from .storage_providers import ScratchDirectory
+from .runner_providers import TaskError, TaskTimeoutError, kill_process_group, collect_statistics, record_statistics, \
+    get_task_statistics
+from .task_providers import Probe, CrfEncode, CbrEncode, Metric
+from .per_title_analysis import CrfAnalyzer, MetricAnalyzer, CRF_ESTIMATED_BYTES_PER_PIXEL_SECOND, \
+    _get_crf_part_parameters, _get_cbr_assessment_parameters, _get_frame_statistics
+
+# Interval between two checks of the thread budget of a governor or of the in flight size of a scratch directory, which are shared with threads
+# and cannot be awaited (in seconds)
+GOVERNOR_POLL_INTERVAL = 0.05
+
+
+async def acquire_scratch(scratch, size):
+    """Reserve space in a scratch directory once its max in flight size has room, without blocking the event loop
+
+    :param scratch: The scratch directory
+    :type scratch: storage_providers.ScratchDirectory
+    :param size: Estimated size of the temporary files (in bytes)
+    :type size: int
+    :return: The directory of the reservation, to be held with ScratchDirectory.hold
+    :rtype: str
+    """
+    directory = scratch.acquire(size, wait=False)
+    while directory is None:
+        await asyncio.sleep(GOVERNOR_POLL_INTERVAL)
+        directory = scratch.acquire(size, wait=False)
+    return directory
+
+
+async def get_stored_result(result_store, input_file_path, parameters):
+    """Get a result of a result store in the default executor, its SQLite queries would block the event loop
+
+    See cache_providers.ResultStore.get for the parameters.
+    """
+    return await asyncio.get_event_loop().run_in_executor(None, result_store.get, input_file_path, parameters)
+
+
+async def set_stored_result(result_store, input_file_path, parameters, result):
+    """Store a result of a result store in the default executor, its SQLite transactions would block the event loop
+
+    See cache_providers.ResultStore.set for the parameters.
+    """
+    await asyncio.get_event_loop().run_in_executor(None, result_store.set, input_file_path, parameters, result)
+
+
+async def execute_task(task, command, stdout_line_handler=None):
+    """Launch a subprocess task without blocking the event loop, with the deadline and retries of the task runner
+
+    :param task: The task running the subprocess, its subprocess_pid, subprocess_out and subprocess_err are set
+    :type task: task_providers.Task
+    :param command: Arguments array for the subprocess task
+    :type command: str[]
+    :param stdout_line_handler: Called with every stdout line while the task runs, the stdout is then not kept ('None' value keeps the whole stdout)
+    :type stdout_line_handler: callable
+    :raises runner_providers.TaskError: the subprocess failed or timed out on every attempt
+
+    The subprocesses are reaped by the event loop, so the task statistics only have the attempts and the wall time.
+    """
+    task.statistics = get_task_statistics(task)
+    start_time = time.time()
+    try:
+        for attempt in range(task.runner.retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(task.runner.get_backoff(attempt))
+                task.prepare_retry()
+            task.statistics['attempts'] += 1
+            try:
+                return await execute_attempt(task, command, stdout_line_handler)
+            except TaskError:
+                if attempt == task.runner.retries:
+                    raise
+    finally:
+        task.statistics['wall_time'] = time.time() - start_time
+        record_statistics(task.statistics)
+
+
+async def execute_attempt(task, command, stdout_line_handler=None):
+    """Launch a subprocess task once the governor of the task runner has room for its threads
+
+    See execute_task for the parameters.
+    """
+    governor = task.runner.governor
+    threads = task.get_reserved_threads()
+    if governor is None or threads is None:
+        return await execute_task_once(task, command, stdout_line_handler)
+
+    while not governor.acquire(threads, wait=False):
+        await asyncio.sleep(GOVERNOR_POLL_INTERVAL)
+    try:
+        return await execute_task_once(task, command, stdout_line_handler)
+    finally:
+        governor.release(threads)
+
+
+async def execute_task_once(task, command, stdout_line_handler=None):
+    """Launch a subprocess task once, its process group is killed at the deadline or if the coroutine is cancelled
+
+    :raises runner_providers.TaskTimeoutError: the subprocess was killed after the deadline
+    :raises runner_providers.TaskError: the subprocess exited with an error
+
+    See execute_task for the parameters.
+    """
+    proc = await asyncio.create_subprocess_exec(*command, stderr=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                                                start_new_session=(os.name == 'posix'))
+    task.subprocess_pid = proc.pid
+
+    async def communicate():
+        if stdout_line_handler is None:
+            task.subprocess_out, task.subprocess_err = await proc.communicate()
+        else:
+            # Drain the stderr while the stdout is streamed
+            stderr_reader = asyncio.ensure_future(proc.stderr.read())
+            try:
+                while True:
+                    line = await proc.stdout.readline()
+                    if not line:
+                        break
+                    stdout_line_handler(line)
+                task.subprocess_err = await stderr_reader
+            finally:
+                stderr_reader.cancel()
+            await proc.wait()
+
+    try:
+        await asyncio.wait_for(communicate(), task.runner.timeout)
+    except asyncio.TimeoutError:
+        kill_process_group(proc)
+        await proc.wait()
+        raise TaskTimeoutError('Task timed out after {} seconds'.format(task.runner.timeout), command, proc.returncode, task.subprocess_err)
+    except BaseException:
+        # Cancelled or failing line handler: do not leave the subprocess running
+        kill_process_group(proc)
+        await proc.wait()
+        raise
+
+    if proc.returncode != 0:
+        raise TaskError('Task failed', command, proc.returncode, task.subprocess_err)
+
+
+class AsyncProbe(Probe):
+    """This class defines a Probing task for asyncio"""
+
+    async def execute(self):
+        """Using FFprobe to get input video file informations"""
+        if self.load_cached() is True:
+            return
+
+        await execute_task(self, self.get_command())
+        self.parse_output()
+
+
+class AsyncCrfEncode(CrfEncode):
+    """This class defines a CRF encoding task for asyncio"""
+
+    async def execute(self):
+        """Using FFmpeg to CRF Encode a file or part of a file"""
+        await execute_task(self, self.get_command())
+
+
+class AsyncCbrEncode(CbrEncode):
+    """This class defines a CBR encoding task for asyncio"""
+
+    async def execute(self):
+        """Using FFmpeg to CBR Encode a file or part of a file"""
+        await execute_task(self, self.get_command())
+
+
+class AsyncMetric(Metric):
+    """This class defines a metric assessment task for asyncio"""
+
+    async def execute(self):
+        """Using FFmpeg to process metric assessments, the per frame stats are parsed while they are written"""
+        await execute_task(self, self.get_command(), self.frame_metrics.add_line)
+        self.parse_output()
+
+
+async def crf_encode_part(input_file_path, width, height, crf_value, idr_interval_frames, part_start_time, part_duration,
+                          semaphore, result_store=None, scratch=None, runner=None):
+    """CRF encode a part of the input file and return the bitrate of the encoded part
+
+    :param semaphore: Bounds the number of subprocesses running at the same time
+    :type semaphore: asyncio.Semaphore
+    :return: The bitrate of the CRF encoded part
+    :rtype: int
+
+    See per_title_analysis._crf_encode_part for the other parameters.
+    """
+    parameters = _get_crf_part_parameters(width, height, crf_value, idr_interval_frames, part_start_time, part_duration)
+    if result_store is not None:
+        bitrate = await get_stored_result(result_store, input_file_path, parameters)
+        if bitrate is not None:
+            return bitrate
+
+    if scratch is None:
+        scratch = ScratchDirectory()
+
+    async with semaphore:
+        # The temporary CRF encoded file is removed with the scratch reservation, even when the coroutine is cancelled
+        size = width*height*part_duration*CRF_ESTIMATED_BYTES_PER_PIXEL_SECOND
+        with scratch.hold(await acquire_scratch(scratch, size), size) as output_directory:
+            crf_encode = AsyncCrfEncode(input_file_path, width, height, crf_value, idr_interval_frames, part_start_time, part_duration, output_directory, runner)
+            await crf_encode.execute()
+
+            crf_probe = AsyncProbe(crf_encode.output_file_path, runner=runner)
+            await crf_probe.execute()
+
+    if result_store is not None:
+        await set_stored_result(result_store, input_file_path, parameters, crf_probe.bitrate)
+
+    return crf_probe.bitrate
+
+
+async def cbr_encode_and_assess(input_file_path, width, height, bitrate, idr_interval_frames, part_start_time, part_duration, metric, ref_width, ref_height,
+                                fused=False, ref_file_path=None, ref_framerate=None, frame_step=None, framerate=None, keep_frames=False,
+                                semaphore=None, result_store=None, scratch=None, runner=None):
+    """CBR encode the input file and assess the encoded file with a quality metric
+
+    The arguments are the ones of MetricAnalyzer.get_linear_grid, fused assessments are not available.
+
+    :param semaphore: Bounds the number of subprocesses running at the same time
+    :type semaphore: asyncio.Semaphore
+    :return: The assessment of the encoded file
+    :rtype: dict
+
+    See per_title_analysis._cbr_encode_and_assess for the other parameters.
+    """
+    if fused is True:
+        raise ValueError('Fused assessments are not available for asyncio')
+
+    parameters = _get_cbr_assessment_parameters(width, height, bitrate, idr_interval_frames, part_start_time, part_duration, metric, ref_width, ref_height, frame_step)
+    if keep_frames is True:
+        parameters['keep_frames'] = True
+    if result_store is not None:
+        assessment = await get_stored_result(result_store, input_file_path, parameters)
+        if assessment is not None:
+            return assessment
+
+    if ref_file_path is None:
+        ref_file_path = input_file_path
+
+    if scratch is None:
+        scratch = ScratchDirectory()
+
+    async with semaphore:
+        # The temporary CBR encoded file is removed with the scratch reservation, even when the coroutine is cancelled
+        size = bitrate*part_duration/8
+        with scratch.hold(await acquire_scratch(scratch, size), size) as output_directory:
+            cbr_encode = AsyncCbrEncode(input_file_path, width, height, bitrate, idr_interval_frames, part_start_time, part_duration, output_directory, runner)
+            await cbr_encode.execute()
+
+            metric_assessment = AsyncMetric(metric, cbr_encode.output_file_path, ref_file_path, ref_width, ref_height, ref_framerate,
+                                            part_start_time, part_duration, frame_step, runner)
+            await metric_assessment.execute()
+
+    assessment = {}
+    assessment['metric_value'] = metric_assessment.output_value
+    assessment['frame_statistics'] = _get_frame_statistics(metric_assessment.frame_metrics, framerate, frame_step, keep_frames)
+
+    if result_store is not None:
+        await set_stored_result(result_store, input_file_path, parameters, assessment)
+
+    return assessment
+
+
+async def gather_tasks(analyzer, coroutines, result_events=None):
+    """Run coroutines concurrently, passing the events of every result to the analyzer listeners as soon as it is done
+
+    On the first exception, the other coroutines are cancelled (killing their subprocesses) before the exception is raised.
+
+    :param analyzer: The analyzer emitting the events
+    :type analyzer: per_title_analysis.Analyzer
+    :param coroutines: The coroutines
+    :type coroutines: coroutine[]
+    :param result_events: Called with the index and the result of every coroutine as soon as it is done, returns the events to emit ('None' value is no event)
+    :type result_events: callable
+    :return: The coroutine results, in the coroutines order
+    :rtype: list
+    """
+    if len(analyzer.listeners) == 0:
+        result_events = None
+
+    async def run(index, coroutine):
+        result = await coroutine
+        if result_events is not None:
+            analyzer.emit_all(result_events(index, result))
+        return result
+
+    tasks = [asyncio.ensure_future(run(index, coroutine)) for index, coroutine in enumerate(coroutines)]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        # Wait for the cancelled coroutines, so that their subprocesses are killed and their temporary files removed
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def get_semaphore(semaphore=None):
+    """Get the semaphore bounding the subprocesses of an analysis
+
+    :param semaphore: A semaphore shared by the analyses ('None' value is a semaphore of the number of CPUs for this analysis only)
+    :type semaphore: asyncio.Semaphore
+    :return: The semaphore
+    :rtype: asyncio.Semaphore
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+    return semaphore
+
+
+class AsyncCrfAnalyzer(CrfAnalyzer):
+    """This class defines a CRF Per-Title Analyzer for asyncio, many analyses can share the same event loop and semaphore"""
+
+    async def process(self, number_of_parts, width, height, crf_value, idr_interval, semaphore=None):
+        """Do the necessary crf encodings and assessments, cancelling the coroutine (or a failing part) kills the running subprocesses
+
+        :param semaphore: Bounds the number of subprocesses running at the same time, share it between analyses to bound a whole service
+        :type semaphore: asyncio.Semaphore
+
+        See CrfAnalyzer.process for the other parameters, only the "parts" mode of every part is available.
+        """
+        semaphore = get_semaphore(semaphore)
+
+        first_task_index = len(self.task_statistics)
+
+        # Start by probing the input video file
+        input_probe = AsyncProbe(self.input_file_path, self.probe_cache, self.runner)
+        with collect_statistics(self.record_task_statistics):
+            async with semaphore:
+                await input_probe.execute()
+
+        part_duration = input_probe.duration/number_of_parts
+        idr_interval_frames =  idr_interval*input_probe.framerate
+
+        parts = []
+        for i in range(0,number_of_parts):
+            part_start_time = i*part_duration
+            parts.append(crf_encode_part(self.input_file_path, width, height, crf_value, idr_interval_frames, part_start_time, part_duration,
+                                         semaphore, **self.get_task_options()))
+
+        # Encode and probe every part, bitrates are collected in part order, the part coroutines inherit the statistics collector
+        with collect_statistics(self.record_task_statistics):
+            crf_bitrate_list = await gather_tasks(self, parts, lambda index, bitrate: [self.get_part_event(index*part_duration, part_duration, bitrate)])
+
+        result = self.get_result(crf_bitrate_list, number_of_parts, part_duration, width, height, crf_value, idr_interval)
+        result['parameters']['mode'] = 'parts'
+        result['instrumentation'] = self.get_instrumentation(first_task_index)
+        self.json['analyses'].append(result)
+
+        if len(self.listeners) > 0:
+            for profile_index, profile in enumerate(result['optimized_encoding_ladder']['encoding_profiles']):
+                self.emit({'event': 'profile', 'profile_index': profile_index, 'profile': profile})
+            self.emit({'event': 'analysis', 'analysis': result})
+
+
+class AsyncMetricAnalyzer(MetricAnalyzer):
+    """This class defines a VQ Metric Per-Title Analyzer for asyncio, many analyses can share the same event loop and semaphore"""
+
+    async def process(self, metric, bitrate_steps, idr_interval, semaphore=None, sample_windows=None, window_duration=None, frame_step=None, keep_frames=False):
+        """Do the necessary encodings and quality metric assessments, cancelling the coroutine (or a failing point) kills the running subprocesses
+
+        :param semaphore: Bounds the number of subprocesses running at the same time, share it between analyses to bound a whole service
+        :type semaphore: asyncio.Semaphore
+
+        See MetricAnalyzer.process for the other parameters, only the "linear" search of unbatched and unfused encodings is available.
+        """
+        if sample_windows is not None and (int(sample_windows) < 1 or window_duration is None or window_duration <= 0):
+            raise ValueError('Sampled windows need a positive number of windows and window duration')
+
+        semaphore = get_semaphore(semaphore)
+
+        first_task_index = len(self.task_statistics)
+
+        # Start by probing the input video file
+        input_probe = AsyncProbe(self.input_file_path, self.probe_cache, self.runner)
+        with collect_statistics(self.record_task_statistics):
+            async with semaphore:
+                await input_probe.execute()
+
+        idr_interval_frames =  idr_interval*input_probe.framerate
+        metric = str(metric).strip().lower()
+        windows = self.get_windows(input_probe, sample_windows, window_duration)
+
+        json_ouput = self.get_result(metric, bitrate_steps, idr_interval, input_probe, windows, frame_step, 'linear', None, False, False)
+        profile_grids = self.get_profile_grids(bitrate_steps)
+
+        # Schedule the whole profile x bitrate x window grid as independent encodings and assessments
+        grid = self.get_linear_grid(profile_grids, input_probe, metric, idr_interval_frames, windows, frame_step, keep_frames, False, None, None)
+        add_point = self.get_grid_events(profile_grids, windows)
+        points = [(profile_index, bitrate_index, window_index) for profile_index, bitrates in enumerate(profile_grids)
+                  for bitrate_index in range(len(bitrates)) for window_index in range(len(windows))]
+        with collect_statistics(self.record_task_statistics):
+            window_assessments = await gather_tasks(self, [cbr_encode_and_assess(*point, semaphore=semaphore, **self.get_task_options()) for point in grid],
+                                                    lambda index, assessment: add_point(*(points[index] + (assessment,))))
+        profile_results = self.get_linear_profile_results(profile_grids, windows, window_assessments)
+
+        self.add_profile_results(json_ouput, profile_grids, profile_results, 'linear')
+        json_ouput['instrumentation'] = self.get_instrumentation(first_task_index)
+        self.json['analyses'].append(json_ouput)
+        self.emit({'event': 'analysis', 'analysis': json_ouput})
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed
+
+from .cache_providers import ProbeCache
+from .storage_providers import ScratchDirectory
+from .runner_providers import TaskRunner
+
+
+def load_titles(manifest_file_path):
+    """Load the input video file paths of a titles manifest
+
+    :param manifest_file_path: A text file with one input video file path per line, blank lines and lines starting with "#" are skipped
+    :type manifest_file_path: str
+    :return: The input video file paths
+    :rtype: str[]
+    """
+    titles = []
+    with open(manifest_file_path, 'r') as manifest_file:
+        for line in manifest_file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                titles.append(line)
+    return titles
+
+
+class SharedScheduler(object):
+    """This class defines a pool of worker threads shared by many analyses, taking turns between the analyses task queues"""
+
+    def __init__(self, max_workers=None):
+        """SharedScheduler initialization
+
+        :param max_workers: Number of task functions run at the same time ('None' value is the number of CPUs)
+        :type max_workers: int
+        """
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if int(max_workers) < 1:
+            raise ValueError('The SharedScheduler.max_workers value must be positive')
+
+        self.max_workers = int(max_workers)
+
+        # Pending tasks by analysis, the analysis of the next task is moved to the end
+        self.queues = OrderedDict()
+        self.condition = threading.Condition()
+        self.workers = []
+        self.is_shutdown = False
+
+    def __str__(self):
+        """Display the scheduler informations
+
+        :return: human readable string describing the scheduler usage
+        :rtype: str
+        """
+        with self.condition:
+            return "{} workers, {} analyses with pending tasks".format(self.max_workers, len(self.queues))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def get_executor(self, key):
+        """Get the executor of an analysis, to be passed to the analyzer process
+
+        :param key: Identifies the analysis task queue
+        :type key: str
+        :return: The executor submitting to the analysis task queue
+        :rtype: batch_providers.ScheduledExecutor
+        """
+        return ScheduledExecutor(self, key)
+
+    def submit(self, key, function, *args, **kwargs):
+        """Add a task function to an analysis task queue
+
+        :param key: Identifies the analysis task queue
+        :type key: str
+        :param function: The task function
+        :type function: callable
+        :return: The future of the task function result
+        :rtype: concurrent.futures.Future
+        """
+        future = Future()
+        with self.condition:
+            if self.is_shutdown is True:
+                raise RuntimeError('Cannot submit a task after the scheduler shutdown')
+            if key not in self.queues:
+                self.queues[key] = deque()
+            self.queues[key].append((future, function, args, kwargs))
+            if len(self.workers) < self.max_workers:
+                worker = threading.Thread(target=self.work)
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+            self.condition.notify()
+        return future
+
+    def work(self):
+        """Run the pending tasks, one analysis after the other, until the scheduler shutdown"""
+        while True:
+            with self.condition:
+                while len(self.queues) == 0 and self.is_shutdown is False:
+                    self.condition.wait()
+                if len(self.queues) == 0:
+                    return
+                key, queue = self.queues.popitem(last=False)
+                future, function, args, kwargs = queue.popleft()
+                if len(queue) > 0:
+                    self.queues[key] = queue
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = function(*args, **kwargs)
+            except BaseException as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=True):
+        """Stop the workers once the pending tasks are done
+
+        :param wait: Wait for the workers to exit
+        :type wait: bool
+        """
+        with self.condition:
+            self.is_shutdown = True
+            self.condition.notify_all()
+        if wait is True:
+            for worker in self.workers:
+                worker.join()
+
+
+class ScheduledExecutor(Executor):
+    """This class defines the executor of an analysis, submitting to its task queue in a shared scheduler"""
+
+    def __init__(self, scheduler, key):
+        """ScheduledExecutor initialization
+
+        :param scheduler: The shared scheduler
+        :type scheduler: batch_providers.SharedScheduler
+        :param key: Identifies the analysis task queue
+        :type key: str
+        """
+        self.scheduler = scheduler
+        self.key = key
+
+    def submit(self, function, *args, **kwargs):
+        return self.scheduler.submit(self.key, function, *args, **kwargs)
+
+
+class CatalogAnalyzer(object):
+    """This class defines a batch analyzer of many titles, with one scheduler for the tasks of all the titles"""
+
+    def __init__(self, analyzer_class, encoding_ladder, output_directory, max_workers=None, max_titles=None, probe_cache=None, result_store=None,
+                 scratch=None, runner=None, hooks=None):
+        """CatalogAnalyzer initialization
+
+        :param analyzer_class: The analyzer of every title, like per_title_analysis.CrfAnalyzer or per_title_analysis.MetricAnalyzer
+        :type analyzer_class: type
+        :param encoding_ladder: An EncodingLadder object
+        :type encoding_ladder: per_title.EncodingLadder
+        :param output_directory: Directory of the per title result files and of the manifest of the finished titles
+        :type output_directory: str
+        :param max_workers: Number of task functions run at the same time, for all the titles ('None' value is the number of CPUs)
+        :type max_workers: int
+        :param max_titles: Number of titles analyzed at the same time, so that short titles fill the workers while long titles run ('None' value is twice the workers)
+        :type max_titles: int
+        :param probe_cache: A probe cache shared by the titles ('None' value is a memory cache for this batch only)
+        :type probe_cache: cache_providers.ProbeCache
+        :param result_store: A persistent store of encoding and assessment results ('None' value is no store)
+        :type result_store: cache_providers.ResultStore
+        :param scratch: The scratch directory of the temporary files ('None' value is /dev/shm when it has enough free space, else the system temporary directory)
+        :type scratch: storage_providers.ScratchDirectory
+        :param runner: Runs the task subprocesses, with a deadline and retries ('None' value is no deadline and no retry)
+        :type runner: runner_providers.TaskRunner
+        :param hooks: Called with the statistics of every task when it ends, failed or not
+        :type hooks: callable[]
+        """
+        if max_titles is not None and int(max_titles) < 1:
+            raise ValueError('The CatalogAnalyzer.max_titles value must be positive')
+
+        self.analyzer_class = analyzer_class
+        self.encoding_ladder = encoding_ladder
+        self.output_directory = output_directory
+        self.scheduler = SharedScheduler(max_workers)
+
+        if max_titles is None:
+            max_titles = 2*self.scheduler.max_workers
+        self.max_titles = int(max_titles)
+
+        if probe_cache is None:
+            probe_cache = ProbeCache()
+        self.probe_cache = probe_cache
+        self.result_store = result_store
+
+        if scratch is None:
+            scratch = ScratchDirectory()
+        self.scratch = scratch
+
+        if runner is None:
+            runner = TaskRunner()
+        self.runner = runner
+        self.hooks = hooks
+
+        if not os.path.isdir(output_directory):
+            os.makedirs(output_directory)
+        self.manifest_file_path = os.path.join(output_directory, 'manifest.jsonl')
+
+    def __str__(self):
+        """Display the catalog analyzer informations
+
+        :return: human readable string describing the catalog analyzer configuration
+        :rtype: str
+        """
+        return "Catalog {} to {}, {}, {} titles at the same time".format(self.analyzer_class.__name__, self.output_directory, self.scheduler, self.max_titles)
+
+    def get_result_file_path(self, input_file_path):
+        """Get the result file path of a title, unique per input file path
+
+        :param input_file_path: The input video file path
+        :type input_file_path: str
+        :return: The result file path
+        :rtype: str
+        """
+        name = os.path.splitext(os.path.basename(input_file_path))[0]
+        path_hash = hashlib.sha1(os.path.abspath(input_file_path).encode('utf-8')).hexdigest()[:10]
+        return os.path.join(self.output_directory, '{}_{}.json'.format(name, path_hash))
+
+    def get_finished_titles(self):
+        """Read the manifest of the finished titles
+
+        :return: The last manifest entry of every title, by input file path
+        :rtype: dict
+        """
+        finished_titles = {}
+        if os.path.isfile(self.manifest_file_path):
+            with open(self.manifest_file_path, 'r') as manifest_file:
+                for line in manifest_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Line cut by an interrupted run
+                        continue
+                    finished_titles[entry['input_file_path']] = entry
+        return finished_titles
+
+    def add_manifest_entry(self, entry):
+        """Append a finished title to the manifest, synced to the disk
+
+        :param entry: The manifest entry
+        :type entry: dict
+        """
+        with open(self.manifest_file_path, 'a') as manifest_file:
+            manifest_file.write(json.dumps(entry, sort_keys=True) + '\n')
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+
+    def analyze_title(self, input_file_path, analyses):
+        """Run the analyses of a title, its tasks are submitted to the shared scheduler, then write its result file
+
+        :param input_file_path: The input video file path
+        :type input_file_path: str
+        :param analyses: The keyword arguments of every analyzer process call
+        :type analyses: dict[]
+        :return: The result file path
+        :rtype: str
+        """
+        analyzer = self.analyzer_class(input_file_path, self.encoding_ladder, self.probe_cache, self.result_store, self.scratch, self.runner, self.hooks)
+        executor = self.scheduler.get_executor(input_file_path)
+        for analysis in analyses:
+            analyzer.process(executor=executor, **analysis)
+
+        result_file_path = self.get_result_file_path(input_file_path)
+        temporary_file_path = result_file_path + '.tmp'
+        with open(temporary_file_path, 'w') as result_file:
+            result_file.write(analyzer.get_json())
+        os.replace(temporary_file_path, result_file_path)
+        return result_file_path
+
+    def process(self, titles, analyses):
+        """Analyze the titles which are not finished in the manifest, a failed title does not stop the others
+
+        :param titles: The input video file paths
+        :type titles: str[]
+        :param analyses: The keyword arguments of every analyzer process call, like [{'number_of_parts': 10, 'width': 1920, 'height': 1080, 'crf_value': 23, 'idr_interval': 2}]
+        :type analyses: dict[]
+        :return: The number of "done", "failed" and "skipped" (finished by a previous run) titles
+        :rtype: dict
+        """
+        finished_titles = self.get_finished_titles()
+        summary = {'done': 0, 'failed': 0, 'skipped': 0}
+
+        pending_titles = []
+        for input_file_path in OrderedDict.fromkeys(titles):
+            entry = finished_titles.get(input_file_path)
+            if entry is not None and entry['status'] == 'done' and os.path.isfile(entry['result_file_path']):
+                summary['skipped'] += 1
+            else:
+                pending_titles.append(input_file_path)
+
+        # The title threads only drive their analyses, the tasks of all the titles are run by the shared scheduler workers
+        with ThreadPoolExecutor(max_workers=self.max_titles) as title_pool:
+            futures = dict((title_pool.submit(self.analyze_title, input_file_path, analyses), input_file_path) for input_file_path in pending_titles)
+            for future in as_completed(futures):
+                entry = {'input_file_path': futures[future], 'finished_at': time.time()}
+                try:
+                    entry['result_file_path'] = future.result()
+                    entry['status'] = 'done'
+                except Exception as error:
+                    entry['status'] = 'failed'
+                    entry['error'] = str(error)
+                self.add_manifest_entry(entry)
+                summary[entry['status']] += 1
+
+        return summary
+
+    def close(self):
+        """Stop the workers of the shared scheduler"""
+        self.scheduler.shutdown()
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .task_providers import get_encoder_version
+
+
+# Content digests already computed in this process, by (absolute path, size, modification time in nanoseconds)
+_content_digests = {}
+_content_digests_lock = threading.Lock()
+
+
+def get_file_fingerprint(file_path, content_hash=False):
+    """Get a cheap fingerprint identifying a file and its content
+
+    The content digest of a file is only computed once per process, until the file size or modification time changes.
+
+    :param file_path: The file path
+    :type file_path: str
+    :param content_hash: Fingerprint the file content (size + sha256) instead of its path, size and modification time
+    :type content_hash: bool
+    :return: The hexadecimal fingerprint of the file
+    :rtype: str
+    """
+    stat = os.stat(file_path)
+
+    if content_hash is True:
+        digest_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        with _content_digests_lock:
+            digest = _content_digests.get(digest_key)
+        if digest is None:
+            content = hashlib.sha256()
+            with open(file_path, 'rb') as file_object:
+                for chunk in iter(lambda: file_object.read(1024*1024), b''):
+                    content.update(chunk)
+            digest = content.hexdigest()
+            with _content_digests_lock:
+                _content_digests[digest_key] = digest
+        fingerprint = [stat.st_size, digest]
+    else:
+        fingerprint = [os.path.abspath(file_path), stat.st_size, stat.st_mtime]
+
+    return hashlib.sha1(json.dumps(fingerprint).encode('utf-8')).hexdigest()
+
+
+class ProbeCache(object):
+    """This class defines a bounded LRU cache of probing results, keyed by file fingerprint"""
+
+    def __init__(self, directory=None, max_entries=1024, content_hash=False):
+        """ProbeCache initialization
+
+        :param directory: Directory of the on-disk backing store ('None' value is a memory only cache)
+        :type directory: str
+        :param max_entries: Maximum number of cached probing results, the least recently used are evicted first
+        :type max_entries: int
+        :param content_hash: Fingerprint the files with a content hash instead of their path, size and modification time
+        :type content_hash: bool
+        """
+        if int(max_entries) < 1:
+            raise ValueError('The ProbeCache.max_entries value must be positive')
+
+        self.directory = directory
+        self.max_entries = int(max_entries)
+        self.content_hash = content_hash
+
+        self.hits = 0
+        self.misses = 0
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        if self.directory is not None:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            self.store_file_path = os.path.join(self.directory, 'probe_cache.json')
+            self.load()
+
+    def __str__(self):
+        """Display the probe cache informations
+
+        :return: human readable string describing the probe cache usage
+        :rtype: str
+        """
+        return "{} cached probes (max {}), hits={}, misses={}".format(len(self.entries), self.max_entries, self.hits, self.misses)
+
+    def get(self, file_path):
+        """Get the cached probing result of a file
+
+        :param file_path: The probed file path
+        :type file_path: str
+        :return: The probing result, 'None' if the file is not in the cache
+        :rtype: dict
+        """
+        key = get_file_fingerprint(file_path, self.content_hash)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return dict(self.entries[key])
+            self.misses += 1
+            return None
+
+    def set(self, file_path, values):
+        """Cache the probing result of a file
+
+        :param file_path: The probed file path
+        :type file_path: str
+        :param values: The probing result
+        :type values: dict
+        """
+        key = get_file_fingerprint(file_path, self.content_hash)
+        with self.lock:
+            self.entries[key] = dict(values)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            if self.directory is not None:
+                self.save()
+
+    def load(self):
+        """Load the cached probing results from the on-disk backing store"""
+        if os.path.isfile(self.store_file_path):
+            try:
+                with open(self.store_file_path, 'r') as store_file:
+                    entries = json.load(store_file)
+            except ValueError:
+                # Unreadable store, the probes are run again
+                entries = []
+            for key, values in entries:
+                self.entries[key] = values
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def save(self):
+        """Save the cached probing results to the on-disk backing store, least recently used first
+
+        The store is written to a temporary file of its own, then renamed into place, so that the processes sharing the directory do not mix their writes.
+        """
+        file_descriptor, temporary_file_path = tempfile.mkstemp(prefix='.probe_cache_', suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(file_descriptor, 'w') as store_file:
+                json.dump(list(self.entries.items()), store_file)
+            os.replace(temporary_file_path, self.store_file_path)
+        except BaseException:
+            os.remove(temporary_file_path)
+            raise
+
+
+class ResultStore(object):
+    """This class defines a persistent store of encoding and assessment results, keyed by source fingerprint and task parameters"""
+
+    def __init__(self, directory, max_size=256*1024*1024, encoder_version=None, content_hash=False):
+        """ResultStore initialization
+
+        :param directory: Directory of the SQLite database
+        :type directory: str
+        :param max_size: Maximum size of the stored results (in bytes), the least recently used are evicted first
+        :type max_size: int
+        :param encoder_version: Version of the encoder producing the results ('None' value is the installed ffmpeg version)
+        :type encoder_version: str
+        :param content_hash: Fingerprint the source files with a content hash instead of their path, size and modification time
+        :type content_hash: bool
+        """
+        if int(max_size) < 1:
+            raise ValueError('The ResultStore.max_size value must be positive')
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.database_file_path = os.path.join(directory, 'results.sqlite')
+        self.max_size = int(max_size)
+        self.content_hash = content_hash
+
+        if encoder_version is None:
+            encoder_version = get_encoder_version()
+        self.encoder_version = encoder_version
+
+        self.hits = 0
+        self.misses = 0
+
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, encoder_version TEXT, size INTEGER, last_access REAL)')
+                connection.execute('CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)')
+        finally:
+            connection.close()
+
+    def __str__(self):
+        """Display the result store informations
+
+        :return: human readable string describing the result store usage
+        :rtype: str
+        """
+        return "{} (encoder: {}), hits={}, misses={}".format(self.database_file_path, self.encoder_version, self.hits, self.misses)
+
+    def connect(self):
+        """Open a connection to the SQLite database (one per operation, so that the store can be shared by threads and processes)
+
+        :return: The database connection, to be used as a transaction context manager
+        :rtype: sqlite3.Connection
+        """
+        return sqlite3.connect(self.database_file_path, timeout=60)
+
+    def get_key(self, file_path, parameters):
+        """Get the key of a result
+
+        :param file_path: The source file path
+        :type file_path: str
+        :param parameters: The full task parameters
+        :type parameters: dict
+        :return: The hexadecimal key of the result
+        :rtype: str
+        """
+        key = [get_file_fingerprint(file_path, self.content_hash), parameters]
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, file_path, parameters):
+        """Get a stored result
+
+        :param file_path: The source file path
+        :type file_path: str
+        :param parameters: The full task parameters
+        :type parameters: dict
+        :return: The stored result, 'None' if there is no result for the current encoder version
+        :rtype: object
+        """
+        key = self.get_key(file_path, parameters)
+        connection = self.connect()
+        try:
+            with connection:
+                row = connection.execute('SELECT value FROM results WHERE key = ? AND encoder_version = ?', (key, self.encoder_version)).fetchone()
+                if row is not None:
+                    connection.execute('UPDATE results SET last_access = ? WHERE key = ?', (time.time(), key))
+        finally:
+            connection.close()
+
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, file_path, parameters, value):
+        """Store a result, then evict the least recently used results over the max size
+
+        :param file_path: The source file path
+        :type file_path: str
+        :param parameters: The full task parameters
+        :type parameters: dict
+        :param value: The result, it must be serializable in json
+        :type value: object
+        """
+        key = self.get_key(file_path, parameters)
+        value = json.dumps(value)
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                                   (key, value, self.encoder_version, len(key) + len(value), time.time()))
+                total_size = connection.execute('SELECT SUM(size) FROM results').fetchone()[0]
+                if total_size > self.max_size:
+                    evicted_keys = []
+                    for row_key, row_size in connection.execute('SELECT key, size FROM results ORDER BY last_access ASC'):
+                        if total_size <= self.max_size:
+                            break
+                        evicted_keys.append((row_key,))
+                        total_size -= row_size
+                    connection.executemany('DELETE FROM results WHERE key = ?', evicted_keys)
+        finally:
+            connection.close()
+
+    def invalidate(self, encoder_version=None):
+        """Remove the results of other encoder versions
+
+        :param encoder_version: The encoder version to keep ('None' value is the store encoder version)
+        :type encoder_version: str
+        :return: The number of removed results
+        :rtype: int
+        """
+        if encoder_version is None:
+            encoder_version = self.encoder_version
+        connection = self.connect()
+        try:
+            with connection:
+                return connection.execute('DELETE FROM results WHERE encoder_version != ?', (encoder_version,)).rowcount
+        finally:
+            connection.close()
+
+
+class ResultCheckpoint(object):
+    """This class defines a durable checkpoint of the results of an analysis, appended to a JSON Lines file as soon as every result is done"""
+
+    def __init__(self, file_path, result_store=None, content_hash=False):
+        """ResultCheckpoint initialization
+
+        :param file_path: The JSON Lines checkpoint file, the results of a previous run are loaded
+        :type file_path: str
+        :param result_store: A persistent store looked up after the checkpoint, and updated with the new results ('None' value is no store)
+        :type result_store: cache_providers.ResultStore
+        :param content_hash: Fingerprint the source files with a content hash instead of their path, size and modification time
+        :type content_hash: bool
+        """
+        directory = os.path.dirname(os.path.abspath(file_path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.file_path = file_path
+        self.result_store = result_store
+        self.content_hash = content_hash
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        self.load()
+
+    def __str__(self):
+        """Display the checkpoint informations
+
+        :return: human readable string describing the checkpoint usage
+        :rtype: str
+        """
+        return "{} ({} results), hits={}, misses={}".format(self.file_path, len(self.entries), self.hits, self.misses)
+
+    def __getstate__(self):
+        """Pickle the checkpoint for process pools, the processes append to the same file"""
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        """Unpickle the checkpoint"""
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Load the results of the checkpoint file"""
+        if os.path.isfile(self.file_path):
+            with open(self.file_path, 'r') as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Line cut by an interrupted run
+                        continue
+                    self.entries[entry['key']] = entry['value']
+
+    def get_key(self, file_path, parameters):
+        """Get the key of a result
+
+        :param file_path: The source file path
+        :type file_path: str
+        :param parameters: The full task parameters
+        :type parameters: dict
+        :return: The hexadecimal key of the result
+        :rtype: str
+        """
+        key = [get_file_fingerprint(file_path, self.content_hash), parameters]
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, file_path, parameters):
+        """Get a checkpointed result, else a stored result
+
+        :param file_path: The source file path
+        :type file_path: str
+        :param parameters: The full task parameters
+        :type parameters: dict
+        :return: The result, 'None' if it is not done yet
+        :rtype: object
+        """
+        key = self.get_key(file_path, parameters)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        if self.result_store is not None:
+            return self.result_store.get(file_path, parameters)
+        return None
+
+    def set(self, file_path, parameters, value):
+        """Append a done result to the checkpoint file, synced to the disk, and to the result store
+
+        :param file_path: The source file path
+        :type file_path: str
+        :param parameters: The full task parameters
+        :type parameters: dict
+        :param value: The result, it must be serializable in json
+        :type value: object
+        """
+        key = self.get_key(file_path, parameters)
+        # A single write per line, so that the lines of concurrent processes are not interleaved
+        line = (json.dumps({'key': key, 'parameters': parameters, 'value': value}, sort_keys=True) + '\n').encode('utf-8')
+        with self.lock:
+            self.entries[key] = value
+            checkpoint_file = os.open(self.file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(checkpoint_file, line)
+                os.fsync(checkpoint_file)
+            finally:
+                os.close(checkpoint_file)
+
+        if self.result_store is not None:
+            self.result_store.set(file_path, parameters, value)
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+import os
+import json
+import math
+
+# Student t values of a two-sided 95% confidence interval, by degrees of freedom (1.96 above)
+STUDENT_T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131,
+                2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+# Minimum number of calibration samples to fit a proxy model
+PROXY_MIN_SAMPLES = 3
+
+
+def get_student_t_95(degrees_of_freedom):
+    """Get the Student t value of a two-sided 95% confidence interval
+
+    :param degrees_of_freedom: The degrees of freedom, at least 1
+    :type degrees_of_freedom: int
+    :return: The Student t value
+    :rtype: float
+    """
+    return STUDENT_T_95[degrees_of_freedom - 1] if degrees_of_freedom <= len(STUDENT_T_95) else 1.96
+
+
+class ProxyModel(object):
+    """This class defines a calibration model mapping the bitrates of reduced resolution and frame rate CRF encodes (proxy encodes) to full resolution estimates
+
+    The model is a power law (a linear regression of the log bitrates), fitted on the parts of training titles CRF encoded at both resolutions.
+    """
+
+    def __init__(self, file_path=None, scale=0.25, framerate_divisor=2):
+        """ProxyModel initialization
+
+        :param file_path: The JSON file of the model, loaded when it exists ('None' value is a memory only model)
+        :type file_path: str
+        :param scale: Width and height factor of the proxy encodes
+        :type scale: float
+        :param framerate_divisor: Frame rate divisor of the proxy encodes
+        :type framerate_divisor: int
+        """
+        if not 0 < scale <= 1:
+            raise ValueError('The ProxyModel.scale value must be between 0 and 1: {}'.format(scale))
+        if int(framerate_divisor) < 1:
+            raise ValueError('The ProxyModel.framerate_divisor value must be positive')
+
+        self.file_path = file_path
+        self.scale = scale
+        self.framerate_divisor = int(framerate_divisor)
+
+        # Encoding parameters of the calibration, the model only maps the encodes with the same parameters
+        self.parameters = None
+
+        # The (proxy bitrate, full resolution bitrate) of every calibration part
+        self.samples = []
+
+        # Regression of the log full resolution bitrate on the log proxy bitrate, 'None' values until fitted
+        self.intercept = None
+        self.slope = None
+        self.residual_error = None
+        self.mean_log_proxy_bitrate = None
+        self.log_proxy_bitrate_sum_squares = None
+
+        if self.file_path is not None and os.path.isfile(self.file_path):
+            self.load()
+
+    def __str__(self):
+        """Display the proxy model informations
+
+        :return: human readable string describing the proxy model calibration
+        :rtype: str
+        """
+        string = "Proxy model x{} at 1/{} frame rate, {} samples".format(self.scale, self.framerate_divisor, len(self.samples))
+        if self.is_fitted():
+            string += ", bitrate = {:.4g}*proxy_bitrate^{:.4f}, residual log error={:.4f}".format(math.exp(self.intercept), self.slope, self.residual_error)
+        return string
+
+    def get_json(self):
+        """Return object details in json
+
+        :return: json object describing the proxy model
+        :rtype: dict
+        """
+        model = {}
+        model['scale'] = self.scale
+        model['framerate_divisor'] = self.framerate_divisor
+        model['parameters'] = self.parameters
+        model['samples'] = len(self.samples)
+        model['intercept'] = self.intercept
+        model['slope'] = self.slope
+        model['residual_error'] = self.residual_error
+        return model
+
+    def load(self):
+        """Load the model from its JSON file"""
+        with open(self.file_path, 'r') as model_file:
+            model = json.load(model_file)
+        self.scale = model['scale']
+        self.framerate_divisor = model['framerate_divisor']
+        self.parameters = model['parameters']
+        self.samples = [tuple(sample) for sample in model['samples']]
+        if len(self.samples) >= PROXY_MIN_SAMPLES:
+            self.fit()
+
+    def save(self):
+        """Save the model and its calibration samples to its JSON file"""
+        if self.file_path is None:
+            raise ValueError('The proxy model has no file path')
+
+        model = {}
+        model['scale'] = self.scale
+        model['framerate_divisor'] = self.framerate_divisor
+        model['parameters'] = self.parameters
+        model['samples'] = self.samples
+        temporary_file_path = self.file_path + '.tmp'
+        with open(temporary_file_path, 'w') as model_file:
+            json.dump(model, model_file, indent=4, sort_keys=True)
+        os.replace(temporary_file_path, self.file_path)
+
+    def is_fitted(self):
+        """Check if the model can map proxy bitrates
+
+        :rtype: bool
+        """
+        return self.slope is not None
+
+    def get_proxy_definition(self, width, height):
+        """Get the definition of the proxy encodes, rounded down to even sizes for yuv420p
+
+        :param width: Width of the full resolution encode
+        :type width: int
+        :param height: Height of the full resolution encode
+        :type height: int
+        :return: The proxy width and height
+        :rtype: tuple
+        """
+        proxy_width = max(int(width*self.scale)//2*2, 2)
+        proxy_height = max(int(height*self.scale)//2*2, 2)
+        return proxy_width, proxy_height
+
+    def get_proxy_framerate(self, framerate):
+        """Get the frame rate of the proxy encodes
+
+        :param framerate: Frame rate of the input video
+        :type framerate: int
+        :return: The proxy frame rate
+        :rtype: float
+        """
+        return framerate/self.framerate_divisor
+
+    def check_parameters(self, parameters):
+        """Check that encodes can be added to the calibration, or mapped by the model
+
+        :param parameters: The full resolution encoding parameters, like {'width': 1920, 'height': 1080, 'crf_value': 23}
+        :type parameters: dict
+        :raises ValueError: the model is calibrated with other encoding parameters
+        """
+        if self.parameters is not None and self.parameters != parameters:
+            raise ValueError('The proxy model is calibrated for {}, not for {}'.format(self.parameters, parameters))
+
+    def add_samples(self, parameters, proxy_bitrates, bitrates):
+        """Add the calibration samples of the parts of a training title, encoded at both resolutions
+
+        :param parameters: The full resolution encoding parameters, like {'width': 1920, 'height': 1080, 'crf_value': 23}
+        :type parameters: dict
+        :param proxy_bitrates: The bitrate of every part proxy encode
+        :type proxy_bitrates: float[]
+        :param bitrates: The bitrate of every part full resolution encode
+        :type bitrates: float[]
+        """
+        self.check_parameters(parameters)
+        self.parameters = dict(parameters)
+        for proxy_bitrate, bitrate in zip(proxy_bitrates, bitrates):
+            if proxy_bitrate > 0 and bitrate > 0:
+                self.samples.append((proxy_bitrate, bitrate))
+
+    def fit(self):
+        """Fit the model on its calibration samples (least squares of the log bitrates)
+
+        :raises ValueError: not enough calibration samples, or all at the same proxy bitrate
+        """
+        if len(self.samples) < PROXY_MIN_SAMPLES:
+            raise ValueError('The proxy model needs at least {} calibration samples, has {}'.format(PROXY_MIN_SAMPLES, len(self.samples)))
+
+        log_proxy_bitrates = [math.log(proxy_bitrate) for proxy_bitrate, bitrate in self.samples]
+        log_bitrates = [math.log(bitrate) for proxy_bitrate, bitrate in self.samples]
+        mean_log_proxy_bitrate = sum(log_proxy_bitrates)/len(log_proxy_bitrates)
+        mean_log_bitrate = sum(log_bitrates)/len(log_bitrates)
+
+        sum_squares = sum((x - mean_log_proxy_bitrate)**2 for x in log_proxy_bitrates)
+        if sum_squares == 0:
+            raise ValueError('The proxy model calibration samples all have the same proxy bitrate')
+
+        slope = sum((x - mean_log_proxy_bitrate)*(y - mean_log_bitrate) for x, y in zip(log_proxy_bitrates, log_bitrates))/sum_squares
+        intercept = mean_log_bitrate - slope*mean_log_proxy_bitrate
+        residuals = [y - (intercept + slope*x) for x, y in zip(log_proxy_bitrates, log_bitrates)]
+
+        self.intercept = intercept
+        self.slope = slope
+        self.residual_error = math.sqrt(sum(residual**2 for residual in residuals)/(len(self.samples) - 2))
+        self.mean_log_proxy_bitrate = mean_log_proxy_bitrate
+        self.log_proxy_bitrate_sum_squares = sum_squares
+
+    def get_bitrate(self, proxy_bitrate):
+        """Map a proxy bitrate to its full resolution estimate
+
+        :param proxy_bitrate: The bitrate of a proxy encode
+        :type proxy_bitrate: float
+        :return: The full resolution bitrate estimate
+        :rtype: float
+        """
+        if not self.is_fitted():
+            raise ValueError('The proxy model is not fitted')
+        return math.exp(self.intercept + self.slope*math.log(max(proxy_bitrate, 1)))
+
+    def get_bounds(self, bitrate):
+        """Get the 95% prediction interval of a full resolution estimate
+
+        :param bitrate: A full resolution bitrate estimate of the model
+        :type bitrate: float
+        :return: The lower and upper bounds of the full resolution bitrate
+        :rtype: float[]
+        """
+        if not self.is_fitted():
+            raise ValueError('The proxy model is not fitted')
+
+        log_bitrate = math.log(max(bitrate, 1))
+        log_proxy_bitrate = (log_bitrate - self.intercept)/self.slope if self.slope != 0 else self.mean_log_proxy_bitrate
+        margin = get_student_t_95(len(self.samples) - 2)*self.residual_error \
+            * math.sqrt(1 + 1/len(self.samples) + (log_proxy_bitrate - self.mean_log_proxy_bitrate)**2/self.log_proxy_bitrate_sum_squares)
+        return [math.exp(log_bitrate - margin), math.exp(log_bitrate + margin)]
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Identical frames have an infinite PSNR, capped to keep the aggregates finite (in dB)
+PSNR_MAX = 100.0
+
+
+class FrameMetrics(object):
+    """This class defines the per frame values of a metric assessment, parsed from the FFmpeg stats file while it is written"""
+
+    def __init__(self, metric):
+        """FrameMetrics initialization
+
+        :param metric: Supporting "ssim" or "psnr"
+        :type metric: string
+        """
+        self.metric = str(metric).strip().lower()
+        if self.metric == 'ssim':
+            self.value_prefix = b'All:'
+        elif self.metric == 'psnr':
+            self.value_prefix = b'psnr_avg:'
+        else:
+            raise ValueError('Available metrics are "ssim" and "psnr", does not include: {}'.format(metric))
+
+        # Compact double array, appended frame by frame
+        self.values = array('d')
+
+    def __len__(self):
+        """Get the number of parsed frames
+
+        :return: The number of frames
+        :rtype: int
+        """
+        return len(self.values)
+
+    def add_line(self, line):
+        """Parse a line of the FFmpeg ssim or psnr stats file
+
+        :param line: A stats file line, like b"n:1 Y:0.99 U:0.99 V:0.99 All:0.99 (20.0)" or b"n:1 mse_avg:0.51 ... psnr_avg:51.05 ..."
+        :type line: bytes
+        """
+        position = line.find(self.value_prefix)
+        if position < 0:
+            return
+        field = line[position + len(self.value_prefix):].split(None, 1)[0]
+        value = float(field)
+        if self.metric == 'psnr' and value > PSNR_MAX:
+            value = PSNR_MAX
+        self.values.append(value)
+
+    def get_array(self):
+        """Get the per frame values as an array, without copy
+
+        :return: A NumPy array, or the double array when NumPy is not installed
+        :rtype: numpy.ndarray
+        """
+        if numpy is not None:
+            return numpy.frombuffer(self.values, dtype=numpy.float64)
+        return self.values
+
+    def get_aggregates(self, frames_per_second=None):
+        """Calculate the pooled statistics of the per frame values
+
+        :param frames_per_second: Number of assessed frames per second, for the worst second ('None' value is no worst second)
+        :type frames_per_second: float
+        :return: The frame count, mean, harmonic mean, 1st and 5th percentiles and worst second average of the values
+        :rtype: dict
+        """
+        aggregates = {}
+        aggregates['frames'] = len(self.values)
+        if len(self.values) == 0:
+            return aggregates
+
+        window = None
+        if frames_per_second is not None:
+            window = min(max(int(round(frames_per_second)), 1), len(self.values))
+
+        if numpy is not None:
+            values = self.get_array()
+            aggregates['mean'] = float(values.mean())
+            aggregates['harmonic_mean'] = float(len(values)/numpy.sum(1/numpy.maximum(values, 1e-9)))
+            aggregates['percentile_1'] = float(numpy.percentile(values, 1))
+            aggregates['percentile_5'] = float(numpy.percentile(values, 5))
+            if window is not None:
+                cumulated = numpy.concatenate(([0.0], numpy.cumsum(values)))
+                aggregates['worst_second'] = float(((cumulated[window:] - cumulated[:-window])/window).min())
+        else:
+            values = self.values
+            aggregates['mean'] = math.fsum(values)/len(values)
+            aggregates['harmonic_mean'] = len(values)/math.fsum(1/max(value, 1e-9) for value in values)
+            sorted_values = sorted(values)
+            aggregates['percentile_1'] = get_percentile(sorted_values, 1)
+            aggregates['percentile_5'] = get_percentile(sorted_values, 5)
+            if window is not None:
+                window_sum = math.fsum(values[:window])
+                worst_sum = window_sum
+                for i in range(window, len(values)):
+                    window_sum += values[i] - values[i - window]
+                    worst_sum = min(worst_sum, window_sum)
+                aggregates['worst_second'] = worst_sum/window
+
+        return aggregates
+
+
+def get_percentile(sorted_values, percent):
+    """Get a percentile of sorted values, with a linear interpolation (like numpy.percentile)
+
+    :param sorted_values: The sorted values
+    :type sorted_values: float[]
+    :param percent: The percentile, between 0 and 100
+    :type percent: float
+    :return: The percentile value
+    :rtype: float
+    """
+    rank = (len(sorted_values) - 1)*percent/100
+    lower = int(math.floor(rank))
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower])*(rank - lower)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+
+class JsonLinesWriter(object):
+    """This class defines a writer of the analysis result events as JSON Lines (NDJSON), one flushed line per event"""
+
+    def __init__(self, output):
+        """JsonLinesWriter initialization
+
+        :param output: The output file path (appended), or a text file object like sys.stdout
+        :type output: str or file
+        """
+        if isinstance(output, str):
+            self.output_file = open(output, 'a')
+            self.is_owner = True
+        else:
+            self.output_file = output
+            self.is_owner = False
+
+        self.written_events = 0
+
+    def __str__(self):
+        """Display the writer informations
+
+        :return: human readable string describing the writer output
+        :rtype: str
+        """
+        return "{}, written events={}".format(getattr(self.output_file, 'name', self.output_file), self.written_events)
+
+    def __call__(self, event):
+        """Write an event, so that the writer can be added to the listeners of an analyzer
+
+        :param event: The result event
+        :type event: dict
+        """
+        self.write(event)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, event):
+        """Write an event on its own line, then flush it for the readers of the output
+
+        :param event: The result event
+        :type event: dict
+        """
+        self.output_file.write(json.dumps(event, sort_keys=True) + '\n')
+        self.output_file.flush()
+        self.written_events += 1
+
+    def write_all(self, events):
+        """Write the events of an iterator as they come, like the events of Analyzer.iter_process
+
+        :param events: The result events
+        :type events: iterator
+        :return: The number of written events
+        :rtype: int
+        """
+        written_events = 0
+        for event in events:
+            self.write(event)
+            written_events += 1
+        return written_events
+
+    def close(self):
+        """Close the output file, if it was opened by the writer"""
+        if self.is_owner is True:
+            self.output_file.close()
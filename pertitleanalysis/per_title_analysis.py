@@ -1,12 +1,613 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import division
-import os
 import json
+import math
+import queue
 import datetime
+import threading
 import statistics
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .cache_providers import ProbeCache
+from .storage_providers import ScratchDirectory
+from .runner_providers import TaskRunner, collect_statistics
+from .calibration_providers import get_student_t_95
+from .rd_providers import fit_log_curves, get_hull_grid, get_convex_hull, get_hull_ladder
+from .plan_providers import Plan
+from .spool_providers import SpoolExecutor
+from .task_providers import Probe, PacketProbe, SceneScore, CrfEncode, CbrEncode, MultiCbrEncode, Metric, CbrEncodeMetric, RawDecode
+
+GOLDEN_RATIO = (1 + math.sqrt(5))/2
+
+# Upper estimate of a CRF encode size, to reserve scratch space (in bytes per pixel and per second)
+CRF_ESTIMATED_BYTES_PER_PIXEL_SECOND = 0.5
+
+# Number of result events waiting for the consumer of Analyzer.iter_process, the analysis waits beyond
+EVENT_QUEUE_SIZE = 1024
+
+# Number of encodings per profile of a "sparse" search, when no max_encodes is given
+SPARSE_ENCODES = 4
+
+
+def _get_crf_part_parameters(width, height, crf_value, idr_interval_frames, part_start_time, part_duration, framerate=None):
+    """Get the full parameters of a CRF encoded part, used as a result store key
+
+    :return: The CRF encode parameters
+    :rtype: dict
+    """
+    parameters = {'task': 'crf_part', 'width': width, 'height': height, 'crf_value': crf_value, 'idr_interval': idr_interval_frames,
+                  'part_start_time': part_start_time, 'part_duration': part_duration}
+    if framerate is not None:
+        parameters['framerate'] = framerate
+    return parameters
+
+
+def _get_proxy_parameters(width, height, crf_value, idr_interval):
+    """Get the full resolution encoding parameters calibrated by a proxy model
+
+    :return: The calibrated encoding parameters
+    :rtype: dict
+    """
+    return {'width': width, 'height': height, 'crf_value': crf_value, 'idr_interval': idr_interval}
+
+
+def _crf_encode_part(input_file_path, width, height, crf_value, idr_interval_frames, part_start_time, part_duration, framerate=None, result_store=None, scratch=None,
+                     runner=None):
+    """CRF encode a part of the input file and return the bitrate of the encoded part
+
+    This is a module level function so that it can be scheduled in a thread or a process pool.
+
+    :param input_file_path: The input video file path
+    :type input_file_path: str
+    :param width: Width of the CRF encode
+    :type width: int
+    :param height: Height of the CRF encode
+    :type height: int
+    :param crf_value: The CRF Encoding value for ffmpeg
+    :type crf_value: int
+    :param idr_interval_frames: IDR interval in frames
+    :type idr_interval_frames: int
+    :param part_start_time: Encode seek start time (in seconds)
+    :type part_start_time: float
+    :param part_duration: Encode duration (in seconds)
+    :type part_duration: float
+    :param framerate: Frame rate of the CRF encode ('None' value is the input frame rate)
+    :type framerate: float
+    :param result_store: A result store looked up before encoding ('None' value is no store)
+    :type result_store: cache_providers.ResultStore
+    :param scratch: The scratch directory of the temporary files ('None' value is a default scratch directory)
+    :type scratch: storage_providers.ScratchDirectory
+    :param runner: Runs the task subprocesses ('None' value is no deadline and no retry)
+    :type runner: runner_providers.TaskRunner
+    :return: The bitrate of the CRF encoded part
+    :rtype: int
+    """
+    parameters = _get_crf_part_parameters(width, height, crf_value, idr_interval_frames, part_start_time, part_duration, framerate)
+    if result_store is not None:
+        bitrate = result_store.get(input_file_path, parameters)
+        if bitrate is not None:
+            return bitrate
+
+    if scratch is None:
+        scratch = ScratchDirectory()
+
+    # The temporary CRF encoded file is removed with the scratch reservation
+    with scratch.reserve(width*height*part_duration*CRF_ESTIMATED_BYTES_PER_PIXEL_SECOND) as output_directory:
+        # Do a CRF encode for the input file
+        crf_encode = CrfEncode(input_file_path, width, height, crf_value, idr_interval_frames, part_start_time, part_duration, output_directory, runner, framerate)
+        crf_encode.execute()
+
+        # Get the Bitrate from the CRF encoded file
+        crf_probe = Probe(crf_encode.output_file_path, runner=runner)
+        crf_probe.execute()
+
+    if result_store is not None:
+        result_store.set(input_file_path, parameters, crf_probe.bitrate)
+
+    return crf_probe.bitrate
+
+
+def _crf_encode_packets(input_file_path, width, height, crf_value, idr_interval_frames, duration, framerate=None, result_store=None, scratch=None, runner=None):
+    """CRF encode the whole input file and return the timestamp and size of every encoded video packet
+
+    This is a module level function so that it can be scheduled in a thread or a process pool.
+
+    :param input_file_path: The input video file path
+    :type input_file_path: str
+    :param width: Width of the CRF encode
+    :type width: int
+    :param height: Height of the CRF encode
+    :type height: int
+    :param crf_value: The CRF Encoding value for ffmpeg
+    :type crf_value: int
+    :param idr_interval_frames: IDR interval in frames
+    :type idr_interval_frames: int
+    :param duration: Encode duration (in seconds)
+    :type duration: float
+    :param framerate: Frame rate of the CRF encode ('None' value is the input frame rate)
+    :type framerate: float
+    :param result_store: A result store looked up before encoding ('None' value is no store)
+    :type result_store: cache_providers.ResultStore
+    :param scratch: The scratch directory of the temporary files ('None' value is a default scratch directory)
+    :type scratch: storage_providers.ScratchDirectory
+    :param runner: Runs the task subprocesses ('None' value is no deadline and no retry)
+    :type runner: runner_providers.TaskRunner
+    :return: The (pts_time, size) of every packet, sorted by presentation time
+    :rtype: tuple[]
+    """
+    parameters = {'task': 'crf_packets', 'width': width, 'height': height, 'crf_value': crf_value, 'idr_interval': idr_interval_frames,
+                  'duration': duration}
+    if framerate is not None:
+        parameters['framerate'] = framerate
+    if result_store is not None:
+        packets = result_store.get(input_file_path, parameters)
+        if packets is not None:
+            return [tuple(packet) for packet in packets]
+
+    if scratch is None:
+        scratch = ScratchDirectory()
+
+    # The temporary CRF encoded file is removed with the scratch reservation
+    with scratch.reserve(width*height*duration*CRF_ESTIMATED_BYTES_PER_PIXEL_SECOND) as output_directory:
+        # Do a single continuous CRF encode for the input file
+        crf_encode = CrfEncode(input_file_path, width, height, crf_value, idr_interval_frames, 0, duration, output_directory, runner, framerate)
+        crf_encode.execute()
+
+        # Get the packets from the CRF encoded file
+        packet_probe = PacketProbe(crf_encode.output_file_path, runner)
+        packet_probe.execute()
+
+    packets = sorted(packet_probe.packets)
+    if result_store is not None:
+        result_store.set(input_file_path, parameters, packets)
+
+    return packets
+
+
+def _score_parts(input_file_path, number_of_parts, part_duration, analysis_width=320, result_store=None, runner=None):
+    """Estimate the complexity of every part of the input file with the average scene change score of its frames
+
+    This is a module level function so that it can be scheduled in a thread or a process pool.
+
+    :param input_file_path: The input video file path
+    :type input_file_path: str
+    :param number_of_parts: Number of part/segment for the analysis
+    :type number_of_parts: int
+    :param part_duration: Duration of every part (in seconds)
+    :type part_duration: float
+    :param analysis_width: Width of the downscaled frames compared by the scene detection
+    :type analysis_width: int
+    :param result_store: A result store looked up before scoring ('None' value is no store)
+    :type result_store: cache_providers.ResultStore
+    :param runner: Runs the task subprocesses ('None' value is no deadline and no retry)
+    :type runner: runner_providers.TaskRunner
+    :return: The complexity of every part, in part order
+    :rtype: float[]
+    """
+    parameters = {'task': 'part_complexities', 'number_of_parts': number_of_parts, 'part_duration': part_duration, 'analysis_width': analysis_width}
+    if result_store is not None:
+        complexities = result_store.get(input_file_path, parameters)
+        if complexities is not None:
+            return complexities
+
+    scene_score = SceneScore(input_file_path, analysis_width, runner)
+    scene_score.execute()
+
+    part_scores = [0] * number_of_parts
+    part_frames = [0] * number_of_parts
+    start_time = scene_score.scores[0][0] if len(scene_score.scores) > 0 else 0
+    for pts_time, score in scene_score.scores:
+        part_index = min(int((pts_time - start_time)/part_duration), number_of_parts - 1)
+        part_scores[part_index] += score
+        part_frames[part_index] += 1
+    complexities = [part_score/max(frames, 1) for part_score, frames in zip(part_scores, part_frames)]
+
+    if result_store is not None:
+        result_store.set(input_file_path, parameters, complexities)
+
+    return complexities
+
+
+def _select_representative_parts(complexities, number_of_selected_parts):
+    """Select representative parts: the parts are ranked by complexity, split in strata of consecutive ranks, and the median part of every stratum is selected
+
+    :param complexities: The complexity of every part, in part order
+    :type complexities: float[]
+    :param number_of_selected_parts: Number of selected parts (and strata)
+    :type number_of_selected_parts: int
+    :return: The (part index, number of represented parts) of every selected part, in part order
+    :rtype: tuple[]
+    """
+    ranked_parts = sorted(range(len(complexities)), key=lambda part_index: complexities[part_index])
+
+    selected_parts = []
+    for i in range(number_of_selected_parts):
+        stratum = ranked_parts[int(round(i*len(ranked_parts)/number_of_selected_parts)):int(round((i + 1)*len(ranked_parts)/number_of_selected_parts))]
+        if len(stratum) > 0:
+            selected_parts.append((stratum[len(stratum)//2], len(stratum)))
+
+    return sorted(selected_parts)
+
+
+def _get_frame_statistics(frame_metrics, framerate=None, frame_step=None, keep_frames=False):
+    """Get the pooled statistics of the per frame metric values of an assessment
+
+    :param frame_metrics: The per frame values of the assessment
+    :type frame_metrics: metric_providers.FrameMetrics
+    :param framerate: Frame rate of the assessed video, for the worst second ('None' value is no worst second)
+    :type framerate: int
+    :param frame_step: Only every Nth frame was assessed ('None' value is every frame)
+    :type frame_step: int
+    :param keep_frames: Add the list of the per frame values
+    :type keep_frames: bool
+    :return: The frame statistics
+    :rtype: dict
+    """
+    frames_per_second = None
+    if framerate is not None:
+        frames_per_second = framerate/max(frame_step or 1, 1)
+
+    frame_statistics = frame_metrics.get_aggregates(frames_per_second)
+    if keep_frames is True:
+        frame_statistics['frame_values'] = list(frame_metrics.values)
+    return frame_statistics
+
+
+def _get_cbr_assessment_parameters(width, height, bitrate, idr_interval_frames, part_start_time, part_duration, metric, ref_width, ref_height, frame_step=None):
+    """Get the full parameters of a CBR encode and assessment, used as a result store key
+
+    :return: The CBR encode and assessment parameters
+    :rtype: dict
+    """
+    parameters = {'task': 'cbr_assessment', 'width': width, 'height': height, 'bitrate': bitrate, 'idr_interval': idr_interval_frames,
+                  'part_start_time': part_start_time, 'part_duration': part_duration, 'metric': metric, 'ref_width': ref_width, 'ref_height': ref_height}
+    if frame_step is not None and frame_step > 1:
+        parameters['frame_step'] = frame_step
+    return parameters
+
+
+def _cbr_encode_and_assess(input_file_path, width, height, bitrate, idr_interval_frames, part_start_time, part_duration, metric, ref_width, ref_height, fused=False,
+                           ref_file_path=None, ref_framerate=None, frame_step=None, framerate=None, keep_frames=False, result_store=None, scratch=None, runner=None):
+    """CBR encode the input file and assess the quality of the encoded file against the input file
+
+    This is a module level function so that it can be scheduled in a thread or a process pool.
+
+    :param input_file_path: The input video file path, also used as the metric reference
+    :type input_file_path: str
+    :param width: Width of the CBR encode
+    :type width: int
+    :param height: Height of the CBR encode
+    :type height: int
+    :param bitrate: The CBR Encoding value for ffmpeg
+    :type bitrate: int
+    :param idr_interval_frames: IDR interval in frames
+    :type idr_interval_frames: int
+    :param part_start_time: Encode seek start time (in seconds)
+    :type part_start_time: float
+    :param part_duration: Encode duration (in seconds)
+    :type part_duration: float
+    :param metric: Supporting "ssim" or "psnr"
+    :type metric: string
+    :param ref_width: Width of the reference video
+    :type ref_width: int
+    :param ref_height: Height of the reference video
+    :type ref_height: int
+    :param fused: Pipe the encoded stream into the metric assessment instead of writing a temporary file
+    :type fused: bool
+    :param ref_file_path: The metric reference video file path ('None' value is the input file)
+    :type ref_file_path: str
+    :param ref_framerate: Frame rate of a raw yuv420p reference video ('None' value is a reference video in any container format)
+    :type ref_framerate: int
+    :param frame_step: Only assess every Nth frame ('None' value assesses every frame)
+    :type frame_step: int
+    :param framerate: Frame rate of the input video, for the worst second of the frame statistics ('None' value is no worst second)
+    :type framerate: int
+    :param keep_frames: Add the list of the per frame metric values to the frame statistics
+    :type keep_frames: bool
+    :param result_store: A result store looked up before encoding ('None' value is no store)
+    :type result_store: cache_providers.ResultStore
+    :param scratch: The scratch directory of the temporary files ('None' value is a default scratch directory)
+    :type scratch: storage_providers.ScratchDirectory
+    :param runner: Runs the task subprocesses ('None' value is no deadline and no retry)
+    :type runner: runner_providers.TaskRunner
+    :return: The assessment of the encoded file
+    :rtype: dict
+    """
+    parameters = _get_cbr_assessment_parameters(width, height, bitrate, idr_interval_frames, part_start_time, part_duration, metric, ref_width, ref_height, frame_step)
+    if fused is True:
+        parameters['fused'] = True
+    if keep_frames is True:
+        parameters['keep_frames'] = True
+    if result_store is not None:
+        assessment = result_store.get(input_file_path, parameters)
+        if assessment is not None:
+            return assessment
+
+    if fused is True:
+        # Do a CBR encode piped into the metric assessment
+        cbr_encode_metric = CbrEncodeMetric(metric, input_file_path, width, height, bitrate, idr_interval_frames, part_start_time, part_duration, ref_width, ref_height,
+                                            ref_file_path, ref_framerate, frame_step, runner)
+        cbr_encode_metric.execute()
+
+        assessment = {}
+        assessment['metric_value'] = cbr_encode_metric.output_value
+        assessment['frame_statistics'] = _get_frame_statistics(cbr_encode_metric.frame_metrics, framerate, frame_step, keep_frames)
+        assessment['encoded_size'] = cbr_encode_metric.encoded_size
+        assessment['encoded_bitrate'] = cbr_encode_metric.encoded_bitrate
+
+        if result_store is not None:
+            result_store.set(input_file_path, parameters, assessment)
+
+        return assessment
+
+    if ref_file_path is None:
+        ref_file_path = input_file_path
+
+    if scratch is None:
+        scratch = ScratchDirectory()
+
+    # The temporary CBR encoded file is removed with the scratch reservation
+    with scratch.reserve(bitrate*part_duration/8) as output_directory:
+        # Do a CBR encode for the input file
+        cbr_encode = CbrEncode(input_file_path, width, height, bitrate, idr_interval_frames, part_start_time, part_duration, output_directory, runner)
+        cbr_encode.execute()
+
+        # Get the metric value from the CBR encoded file
+        metric_assessment = Metric(metric, cbr_encode.output_file_path, ref_file_path, ref_width, ref_height, ref_framerate,
+                                   part_start_time, part_duration, frame_step, runner)
+        metric_assessment.execute()
+
+    assessment = {}
+    assessment['metric_value'] = metric_assessment.output_value
+    assessment['frame_statistics'] = _get_frame_statistics(metric_assessment.frame_metrics, framerate, frame_step, keep_frames)
+
+    if result_store is not None:
+        result_store.set(input_file_path, parameters, assessment)
+
+    return assessment
+
+
+def _multi_cbr_encode_and_assess(input_file_path, renditions, idr_interval_frames, part_start_time, part_duration, metric, ref_width, ref_height,
+                                 ref_file_path=None, ref_framerate=None, frame_step=None, framerate=None, keep_frames=False, result_store=None, scratch=None, runner=None):
+    """CBR encode multiple renditions of the input file with a single decode, then assess the quality of each of them
+
+    This is a module level function so that it can be scheduled in a thread or a process pool.
+
+    :param input_file_path: The input video file path, also used as the metric reference
+    :type input_file_path: str
+    :param renditions: The (width, height, bitrate) of every rendition to encode
+    :type renditions: tuple[]
+    :param ref_file_path: The metric reference video file path ('None' value is the input file)
+    :type ref_file_path: str
+    :param ref_framerate: Frame rate of a raw yuv420p reference video ('None' value is a reference video in any container format)
+    :type ref_framerate: int
+    :param frame_step: Only assess every Nth frame ('None' value assesses every frame)
+    :type frame_step: int
+    :param framerate: Frame rate of the input video, for the worst second of the frame statistics ('None' value is no worst second)
+    :type framerate: int
+    :param keep_frames: Add the list of the per frame metric values to the frame statistics
+    :type keep_frames: bool
+    :param result_store: A result store looked up before encoding, only the missing renditions are encoded ('None' value is no store)
+    :type result_store: cache_providers.ResultStore
+    :param scratch: The scratch directory of the temporary files ('None' value is a default scratch directory)
+    :type scratch: storage_providers.ScratchDirectory
+    :param runner: Runs the task subprocesses ('None' value is no deadline and no retry)
+    :type runner: runner_providers.TaskRunner
+    :return: The assessments of the encoded renditions, in the renditions order
+    :rtype: dict[]
+    """
+    assessments = [None] * len(renditions)
+    parameters = []
+    for i, (width, height, bitrate) in enumerate(renditions):
+        parameters.append(_get_cbr_assessment_parameters(width, height, bitrate, idr_interval_frames, part_start_time, part_duration, metric, ref_width, ref_height, frame_step))
+        # The batched renditions go through a yadif/split/scale filter graph, their results are not interchangeable with the CbrEncode ones
+        parameters[i]['batched'] = True
+        if keep_frames is True:
+            parameters[i]['keep_frames'] = True
+        if result_store is not None:
+            assessments[i] = result_store.get(input_file_path, parameters[i])
+
+    missing = [i for i in range(len(renditions)) if assessments[i] is None]
+    if len(missing) == 0:
+        return assessments
+
+    if ref_file_path is None:
+        ref_file_path = input_file_path
+
+    if scratch is None:
+        scratch = ScratchDirectory()
+
+    # The temporary CBR encoded files are removed with the scratch reservation
+    with scratch.reserve(sum(renditions[i][2] for i in missing)*part_duration/8) as output_directory:
+        # Do a single CBR encode process for all the missing renditions
+        multi_cbr_encode = MultiCbrEncode(input_file_path, [renditions[i] for i in missing], idr_interval_frames, part_start_time, part_duration, output_directory, runner)
+        multi_cbr_encode.execute()
+
+        for i, output_file_path in zip(missing, multi_cbr_encode.output_file_paths):
+            # Get the metric value from the CBR encoded rendition
+            metric_assessment = Metric(metric, output_file_path, ref_file_path, ref_width, ref_height, ref_framerate,
+                                       part_start_time, part_duration, frame_step, runner)
+            metric_assessment.execute()
+
+            assessment = {}
+            assessment['metric_value'] = metric_assessment.output_value
+            assessment['frame_statistics'] = _get_frame_statistics(metric_assessment.frame_metrics, framerate, frame_step, keep_frames)
+            assessments[i] = assessment
+
+            if result_store is not None:
+                result_store.set(input_file_path, parameters[i], assessment)
+
+    return assessments
+
+
+def _aggregate_window_frame_statistics(window_statistics):
+    """Aggregate the frame statistics of sampled windows
+
+    Frame counts, means, harmonic means and worst seconds are pooled exactly, percentiles are the lowest window percentiles.
+
+    :param window_statistics: The frame statistics of every sampled window
+    :type window_statistics: dict[]
+    :return: The frame statistics of all the windows
+    :rtype: dict
+    """
+    window_statistics = [statistics_ for statistics_ in window_statistics if statistics_['frames'] > 0]
+
+    frame_statistics = {}
+    frame_statistics['frames'] = sum(statistics_['frames'] for statistics_ in window_statistics)
+    if len(window_statistics) == 0:
+        return frame_statistics
+
+    frame_statistics['mean'] = sum(statistics_['mean']*statistics_['frames'] for statistics_ in window_statistics)/frame_statistics['frames']
+    frame_statistics['harmonic_mean'] = frame_statistics['frames']/sum(statistics_['frames']/statistics_['harmonic_mean'] for statistics_ in window_statistics)
+    frame_statistics['percentile_1'] = min(statistics_['percentile_1'] for statistics_ in window_statistics)
+    frame_statistics['percentile_5'] = min(statistics_['percentile_5'] for statistics_ in window_statistics)
+    if all('worst_second' in statistics_ for statistics_ in window_statistics):
+        frame_statistics['worst_second'] = min(statistics_['worst_second'] for statistics_ in window_statistics)
+    if all('frame_values' in statistics_ for statistics_ in window_statistics):
+        frame_statistics['frame_values'] = [value for statistics_ in window_statistics for value in statistics_['frame_values']]
+    return frame_statistics
+
+
+def _aggregate_window_assessments(window_assessments):
+    """Aggregate the assessments of sampled windows of equal duration into one assessment
+
+    :param window_assessments: The assessment of every sampled window
+    :type window_assessments: dict[]
+    :return: The mean metric value with its 95% confidence interval, and the value of every window
+    :rtype: dict
+    """
+    window_values = [window_assessment['metric_value'] for window_assessment in window_assessments]
+    if len(window_values) == 1:
+        return dict(window_assessments[0])
+
+    assessment = {}
+    assessment['metric_value'] = statistics.mean(window_values)
+    assessment['window_values'] = window_values
+
+    degrees_of_freedom = len(window_values) - 1
+    margin = get_student_t_95(degrees_of_freedom)*statistics.stdev(window_values)/math.sqrt(len(window_values))
+    assessment['confidence_interval'] = [assessment['metric_value'] - margin, assessment['metric_value'] + margin]
+
+    if all('frame_statistics' in window_assessment for window_assessment in window_assessments):
+        assessment['frame_statistics'] = _aggregate_window_frame_statistics([window_assessment['frame_statistics'] for window_assessment in window_assessments])
+
+    if all('encoded_size' in window_assessment for window_assessment in window_assessments):
+        assessment['encoded_size'] = sum(window_assessment['encoded_size'] for window_assessment in window_assessments)
+        assessment['encoded_bitrate'] = statistics.mean(window_assessment['encoded_bitrate'] for window_assessment in window_assessments)
+
+    return assessment
+
+
+def _get_knee_bitrate(sampled):
+    """Get the knee of a profile quality curve: the assessed bitrate the furthest above the chord joining the first and last assessments
+
+    :param sampled: The (bitrate, assessment) pairs of the profile, sorted by bitrate
+    :type sampled: tuple[]
+    :return: The knee bitrate
+    :rtype: int
+    """
+    first_bitrate, first_value = sampled[0][0], sampled[0][1]['metric_value']
+    last_bitrate, last_value = sampled[-1][0], sampled[-1][1]['metric_value']
+
+    def chord_distance(point):
+        if last_bitrate == first_bitrate:
+            return 0
+        bitrate, assessment = point
+        return assessment['metric_value'] - (first_value + (last_value - first_value)*(bitrate - first_bitrate)/(last_bitrate - first_bitrate))
+
+    return max(sampled, key=chord_distance)[0]
+
+
+def _golden_section_search(bitrates, max_encodes, input_file_path, width, height, idr_interval_frames, windows, metric, ref_width, ref_height, fused=False,
+                           ref_file_path=None, ref_framerate=None, frame_step=None, framerate=None, keep_frames=False, **task_options):
+    """Search the knee of a profile quality curve with a bounded number of encodings
+
+    The knee is the bitrate where the quality per bit slope falls under the average slope of the whole bitrate range,
+    which is where the quality curve is the furthest above the chord joining the bitrate min and max assessments.
+    For a concave quality curve this distance is unimodal, so a golden-section search over the bitrate grid finds it.
+
+    :param bitrates: The sorted bitrate grid of the profile
+    :type bitrates: int[]
+    :param max_encodes: Maximum number of encodings for the search
+    :type max_encodes: int
+    :param windows: The (start time, duration) of the sampled windows of every encoding (in seconds)
+    :type windows: tuple[]
+    :param fused: Pipe the encoded streams into the metric assessments instead of writing temporary files
+    :type fused: bool
+    :param ref_file_path: The metric reference video file path ('None' value is the input file)
+    :type ref_file_path: str
+    :param ref_framerate: Frame rate of a raw yuv420p reference video ('None' value is a reference video in any container format)
+    :type ref_framerate: int
+    :param frame_step: Only assess every Nth frame ('None' value assesses every frame)
+    :type frame_step: int
+    :param framerate: Frame rate of the input video, for the worst second of the frame statistics ('None' value is no worst second)
+    :type framerate: int
+    :param keep_frames: Add the list of the per frame metric values to the frame statistics
+    :type keep_frames: bool
+    :param task_options: Options of every encoding and assessment, see _cbr_encode_and_assess
+    :type task_options: dict
+    :return: The assessments of the sampled bitrates (sorted by bitrate) and the knee bitrate
+    :rtype: tuple
+    """
+    assessments = {}
+
+    def assess(index):
+        if index not in assessments:
+            window_assessments = []
+            for part_start_time, part_duration in windows:
+                window_assessments.append(_cbr_encode_and_assess(input_file_path, width, height, bitrates[index], idr_interval_frames,
+                                                                 part_start_time, part_duration, metric, ref_width, ref_height, fused,
+                                                                 ref_file_path, ref_framerate, frame_step, framerate, keep_frames, **task_options))
+            assessments[index] = _aggregate_window_assessments(window_assessments)
+        return assessments[index]['metric_value']
+
+    low = 0
+    high = len(bitrates) - 1
+    first_value = assess(low)
+    last_value = assess(high)
+
+    def chord_distance(index):
+        if len(bitrates) == 1:
+            return 0
+        chord_value = first_value + (last_value - first_value)*(bitrates[index] - bitrates[0])/(bitrates[-1] - bitrates[0])
+        return assess(index) - chord_value
+
+    while high - low > 2 and len(assessments) + 2 <= max_encodes:
+        step = int(round((high - low)/GOLDEN_RATIO))
+        right = low + step
+        left = min(high - step, right - 1)
+        if chord_distance(left) < chord_distance(right):
+            low = left
+        else:
+            high = right
+
+    # Finish with the remaining budget inside the bracket
+    for index in range(low, high + 1):
+        if len(assessments) >= max_encodes:
+            break
+        assess(index)
+
+    sampled = [(bitrates[index], assessments[index]) for index in sorted(assessments)]
+    return sampled, _get_knee_bitrate(sampled)
+
+
+def _run_instrumented(function, arguments, task_options):
+    """Run a task function and collect the statistics of its tasks, in the worker thread or process
 
-from .task_providers import Probe, CrfEncode, CbrEncode, Metric
+    :param function: A picklable task function
+    :type function: callable
+    :param arguments: The positional arguments
+    :type arguments: tuple
+    :param task_options: The task options keyword arguments
+    :type task_options: dict
+    :return: The function result and the statistics of its tasks
+    :rtype: tuple
+    """
+    statistics_list = []
+    with collect_statistics(statistics_list.append):
+        result = function(*arguments, **task_options)
+    return result, statistics_list
 
 
 class EncodingProfile(object):
@@ -160,17 +761,47 @@ class EncodingLadder(object):
 class Analyzer(object):
     """This class defines a Per-Title Analyzer"""
 
-    def __init__(self, input_file_path, encoding_ladder):
+    def __init__(self, input_file_path, encoding_ladder, probe_cache=None, result_store=None, scratch=None, runner=None, hooks=None):
         """Analyzer initialization
 
         :param input_file_path: The input video file path
         :type input_file_path: str
         :param encoding_ladder: An EncodingLadder object
         :type encoding_ladder: per_title.EncodingLadder
+        :param probe_cache: A probe cache shared by the analyses ('None' value is a memory cache for this analyzer only)
+        :type probe_cache: cache_providers.ProbeCache
+        :param result_store: A persistent store of encoding and assessment results ('None' value is no store)
+        :type result_store: cache_providers.ResultStore
+        :param scratch: The scratch directory of the temporary files ('None' value is /dev/shm when it has enough free space, else the system temporary directory)
+        :type scratch: storage_providers.ScratchDirectory
+        :param runner: Runs the task subprocesses, with a deadline and retries ('None' value is no deadline and no retry)
+        :type runner: runner_providers.TaskRunner
+        :param hooks: Called in the analyzer process with the statistics of every task when it ends, failed or not
+        :type hooks: callable[]
         """
         self.input_file_path = input_file_path
         self.encoding_ladder = encoding_ladder
 
+        if probe_cache is None:
+            probe_cache = ProbeCache()
+        self.probe_cache = probe_cache
+        self.result_store = result_store
+
+        if scratch is None:
+            scratch = ScratchDirectory()
+        self.scratch = scratch
+
+        if runner is None:
+            runner = TaskRunner()
+        self.runner = runner
+
+        # Statistics of every task run by the analyzer, in end order
+        self.hooks = list(hooks or [])
+        self.task_statistics = []
+
+        # Called with every result event of the analyses, in the analyzer process
+        self.listeners = []
+
         self.average_bitrate = None
         self.standard_deviation = None
         self.optimal_bitrate = None
@@ -200,11 +831,227 @@ class Analyzer(object):
         """
         return json.dumps(self.json, indent=4, sort_keys=True)
 
+    def get_task_options(self, scratch=True):
+        """Get the options passed to every encoding and assessment task function
+
+        :param scratch: Pass the scratch directory, 'False' value for a task function writing no temporary file
+        :type scratch: bool
+        :return: The task options keyword arguments
+        :rtype: dict
+        """
+        task_options = {}
+        task_options['result_store'] = self.result_store
+        if scratch is True:
+            task_options['scratch'] = self.scratch
+        task_options['runner'] = self.runner
+        return task_options
+
+    def map_tasks(self, function, arguments_list, max_workers=None, executor=None, result_events=None, scratch=True):
+        """Run a task function for each arguments tuple, concurrently when a pool is available
+
+        :param function: A picklable task function (module level for process pools), called with the task options as keyword arguments
+        :type function: callable
+        :param arguments_list: A list of positional arguments tuples
+        :type arguments_list: tuple[]
+        :param max_workers: Size of the thread pool created when no executor is given ('None' or 1 runs in series)
+        :type max_workers: int
+        :param executor: A concurrent.futures executor (thread or process pool) to use instead of creating one
+        :type executor: concurrent.futures.Executor
+        :param result_events: Called with the index and the result of every function call as soon as it is done, returns the events to emit ('None' value is no event)
+        :type result_events: callable
+        :param scratch: Pass the scratch directory option to the function, 'False' value for a function writing no temporary file
+        :type scratch: bool
+        :return: The function results, in the same order as the arguments list
+        :rtype: list
+        """
+        task_options = self.get_task_options(scratch)
+        if len(self.listeners) == 0:
+            result_events = None
+
+        if executor is not None:
+            return self.collect_results(executor, function, arguments_list, task_options, result_events)
+
+        if max_workers is None or max_workers <= 1:
+            results = []
+            for index, arguments in enumerate(arguments_list):
+                results.append(self.get_instrumented_result(_run_instrumented(function, arguments, task_options)))
+                if result_events is not None:
+                    self.emit_all(result_events(index, results[index]))
+            return results
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return self.collect_results(pool, function, arguments_list, task_options, result_events)
+
+    def collect_results(self, executor, function, arguments_list, task_options, result_events):
+        """Submit a task function for each arguments tuple, then collect the results as they are done
+
+        :return: The function results, in the same order as the arguments list
+        :rtype: list
+
+        See Analyzer.map_tasks for the parameters.
+        """
+        futures = dict((executor.submit(_run_instrumented, function, arguments, task_options), index) for index, arguments in enumerate(arguments_list))
+        results = [None] * len(arguments_list)
+        for future in as_completed(futures):
+            index = futures[future]
+            results[index] = self.get_instrumented_result(future.result())
+            if result_events is not None:
+                self.emit_all(result_events(index, results[index]))
+        return results
+
+    def emit(self, event):
+        """Pass a result event to the listeners
+
+        :param event: The result event, its "event" key is the event type
+        :type event: dict
+        """
+        event['input_file_path'] = self.input_file_path
+        for listener in self.listeners:
+            listener(event)
+
+    def emit_all(self, events):
+        """Pass result events to the listeners, in order
+
+        :param events: The result events
+        :type events: dict[]
+        """
+        for event in events:
+            self.emit(event)
+
+    def iter_process(self, *args, **kwargs):
+        """Run an analysis in a background thread, yielding its result events as soon as they are done
+
+        The events wait in a bounded queue: the analysis waits while the consumer is late, so that the memory stays bounded.
+        When the consumer stops iterating, the analysis goes on without emitting to the generator.
+
+        :return: The result events, the last one is the "analysis" event with the whole analysis
+        :rtype: generator
+        :raises Exception: the exception raised by the analysis, after its events
+
+        See the process method of the analyzer for the parameters.
+        """
+        events = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        closed = threading.Event()
+        errors = []
+
+        def put(event):
+            while not closed.is_set():
+                try:
+                    events.put(event, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def run():
+            try:
+                self.process(*args, **kwargs)
+            except BaseException as error:
+                errors.append(error)
+            finally:
+                self.listeners.remove(put)
+                put(None)
+
+        self.listeners.append(put)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+        try:
+            while True:
+                event = events.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            closed.set()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+    def get_instrumented_result(self, instrumented_result):
+        """Record the task statistics collected with a task function result
+
+        :param instrumented_result: The function result and the statistics of its tasks
+        :type instrumented_result: tuple
+        :return: The function result
+        """
+        result, statistics_list = instrumented_result
+        for task_statistics in statistics_list:
+            self.record_task_statistics(task_statistics)
+        return result
+
+    def record_task_statistics(self, task_statistics):
+        """Record the statistics of a task and pass them to the hooks
+
+        :param task_statistics: The task statistics
+        :type task_statistics: dict
+        """
+        self.task_statistics.append(task_statistics)
+        for hook in self.hooks:
+            hook(task_statistics)
+
+    def execute_task(self, task):
+        """Execute a task in the analyzer process, recording its statistics
+
+        :param task: The task
+        :type task: task_providers.Task
+        """
+        with collect_statistics(self.record_task_statistics):
+            task.execute()
+
+    def get_instrumentation(self, first_task_index=0):
+        """Get the statistics of the tasks of an analysis, with their totals per phase
+
+        :param first_task_index: Index of the first task of the analysis in the analyzer task statistics
+        :type first_task_index: int
+        :return: The totals per phase (tasks, attempts, times, bytes and maximum of the peak memory) and the statistics of every task
+        :rtype: dict
+        """
+        tasks = self.task_statistics[first_task_index:]
+        phases = {}
+        for task_statistics in tasks:
+            totals = phases.setdefault(task_statistics['phase'], {'tasks': 0, 'attempts': 0, 'wall_time': 0.0, 'user_time': None, 'system_time': None,
+                                                                  'max_rss': None, 'read_bytes': None, 'write_bytes': None})
+            totals['tasks'] += 1
+            for key in ['attempts', 'wall_time', 'user_time', 'system_time', 'read_bytes', 'write_bytes']:
+                if task_statistics[key] is not None:
+                    totals[key] = (totals[key] or 0) + task_statistics[key]
+            if task_statistics['max_rss'] is not None:
+                totals['max_rss'] = max(totals['max_rss'] or 0, task_statistics['max_rss'])
+
+        instrumentation = {}
+        instrumentation['phases'] = phases
+        instrumentation['tasks'] = tasks
+        return instrumentation
+
 
 class CrfAnalyzer(Analyzer):
     """This class defines a Per-Title Analyzer based on calculating the top bitrate wit CRF, then deducting the ladder"""
 
-    def process(self, number_of_parts, width, height, crf_value, idr_interval):
+    def __init__(self, input_file_path, encoding_ladder, probe_cache=None, result_store=None, scratch=None, runner=None, hooks=None):
+        """CrfAnalyzer initialization
+
+        :param input_file_path: The input video file path
+        :type input_file_path: str
+        :param encoding_ladder: An EncodingLadder object
+        :type encoding_ladder: per_title.EncodingLadder
+        :param probe_cache: A probe cache shared by the analyses ('None' value is a memory cache for this analyzer only)
+        :type probe_cache: cache_providers.ProbeCache
+        :param result_store: A persistent store of encoding and assessment results ('None' value is no store)
+        :type result_store: cache_providers.ResultStore
+        :param scratch: The scratch directory of the temporary files ('None' value is /dev/shm when it has enough free space, else the system temporary directory)
+        :type scratch: storage_providers.ScratchDirectory
+        :param runner: Runs the task subprocesses, with a deadline and retries ('None' value is no deadline and no retry)
+        :type runner: runner_providers.TaskRunner
+        :param hooks: Called in the analyzer process with the statistics of every task when it ends, failed or not
+        :type hooks: callable[]
+        """
+        Analyzer.__init__(self, input_file_path, encoding_ladder, probe_cache, result_store, scratch, runner, hooks)
+
+        # Packets of the full length CRF encodes, by (width, height, crf_value, idr_interval)
+        self.packets_cache = {}
+
+    def process(self, number_of_parts, width, height, crf_value, idr_interval, max_workers=None, executor=None, mode='parts', selected_parts=None, proxy=None):
         """Do the necessary crf encodings and assessments
 
         :param number_of_parts: Number of part/segment for the analysis
@@ -217,32 +1064,271 @@ class CrfAnalyzer(Analyzer):
         :type crf_value: int
         :param idr_interval: IDR interval in seconds
         :type idr_interval: int
+        :param max_workers: Number of parts encoded at the same time ('None' or 1 encodes the parts in series)
+        :type max_workers: int
+        :param executor: A concurrent.futures executor (thread or process pool) used to encode the parts
+        :type executor: concurrent.futures.Executor
+        :param mode: "parts" does a CRF encode for every part, "packets" does a single full length CRF encode and bins its packets into parts
+        :type mode: str
+        :param selected_parts: Only CRF encode this number of representative parts, selected by complexity with a scene change pre-analysis ('None' value encodes every part)
+        :type selected_parts: int
+        :param proxy: A fitted proxy model: the CRF encodes are done at its reduced resolution and frame rate, then mapped to full resolution estimates ('None' value encodes at full resolution)
+        :type proxy: calibration_providers.ProxyModel
         """
+        mode = self.check_process_parameters(number_of_parts, width, height, crf_value, idr_interval, mode, selected_parts, proxy)
+
+        first_task_index = len(self.task_statistics)
+
         # Start by probing the input video file
-        input_probe = Probe(self.input_file_path)
-        input_probe.execute()
+        input_probe = Probe(self.input_file_path, self.probe_cache, self.runner)
+        self.execute_task(input_probe)
 
-        crf_bitrate_list = []
         part_duration = input_probe.duration/number_of_parts
         idr_interval_frames =  idr_interval*input_probe.framerate
 
-        for i in range(0,number_of_parts):
-            part_start_time = i*part_duration
+        # The encodes of a proxy analysis are done at the reduced resolution and frame rate of the proxy model
+        encode_width, encode_height, encode_framerate = width, height, None
+        if proxy is not None:
+            encode_width, encode_height = proxy.get_proxy_definition(width, height)
+            encode_framerate = proxy.get_proxy_framerate(input_probe.framerate)
+            idr_interval_frames = max(int(round(idr_interval*encode_framerate)), 1)
+
+        if mode == 'packets':
+            # The full length encode is reused by every analysis with the same encoding parameters
+            packets_key = (encode_width, encode_height, crf_value, idr_interval, encode_framerate)
+            if packets_key not in self.packets_cache:
+                job = (self.input_file_path, encode_width, encode_height, crf_value, idr_interval_frames, input_probe.duration, encode_framerate)
+                self.packets_cache[packets_key] = self.map_tasks(_crf_encode_packets, [job], max_workers, executor)[0]
+            crf_bitrate_list = self.get_part_bitrates(self.packets_cache[packets_key], number_of_parts, part_duration)
+            if len(self.listeners) > 0:
+                self.emit_all([self.get_part_event(i*part_duration, part_duration, bitrate, proxy=proxy) for i, bitrate in enumerate(crf_bitrate_list)])
+
+        elif selected_parts is not None:
+            # Rank the parts by complexity with a cheap pre-analysis, then encode one representative part per stratum
+            job = (self.input_file_path, number_of_parts, part_duration)
+            complexities = self.map_tasks(_score_parts, [job], max_workers, executor, scratch=False)[0]
+            representative_parts = _select_representative_parts(complexities, selected_parts)
+
+            parts = []
+            for part_index, represented_parts in representative_parts:
+                part_start_time = part_index*part_duration
+                parts.append((self.input_file_path, encode_width, encode_height, crf_value, idr_interval_frames, part_start_time, part_duration, encode_framerate))
+            selected_bitrate_list = self.map_tasks(_crf_encode_part, parts, max_workers, executor,
+                                                   lambda index, bitrate: [self.get_part_event(parts[index][5], part_duration, bitrate, representative_parts[index][1], proxy)])
+            if proxy is not None:
+                selected_bitrate_list = [proxy.get_bitrate(bitrate) for bitrate in selected_bitrate_list]
+
+            # Every selected bitrate stands for the duration of its stratum
+            crf_bitrate_list = []
+            for (part_index, represented_parts), bitrate in zip(representative_parts, selected_bitrate_list):
+                crf_bitrate_list.extend([bitrate] * represented_parts)
+
+        else:
+            parts = []
+            for i in range(0,number_of_parts):
+                part_start_time = i*part_duration
+                parts.append((self.input_file_path, encode_width, encode_height, crf_value, idr_interval_frames, part_start_time, part_duration, encode_framerate))
+
+            # Encode and probe every part, bitrates are collected in part order
+            crf_bitrate_list = self.map_tasks(_crf_encode_part, parts, max_workers, executor,
+                                              lambda index, bitrate: [self.get_part_event(parts[index][5], part_duration, bitrate, proxy=proxy)])
+
+        if proxy is not None and selected_parts is None:
+            proxy_bitrate_list = crf_bitrate_list
+            crf_bitrate_list = [proxy.get_bitrate(bitrate) for bitrate in proxy_bitrate_list]
+
+        result = self.get_result(crf_bitrate_list, number_of_parts, part_duration, width, height, crf_value, idr_interval)
+        result['parameters']['mode'] = mode
+        if selected_parts is not None:
+            result['parameters']['selected_parts'] = selected_parts
+            result['complexity'] = {}
+            result['complexity']['part_complexities'] = complexities
+            result['complexity']['selected_parts'] = [{'part_index': part_index, 'represented_parts': represented_parts, 'bitrate': bitrate}
+                                                      for (part_index, represented_parts), bitrate in zip(representative_parts, selected_bitrate_list)]
+            result['complexity']['encoded_duration'] = len(representative_parts)*part_duration
+        if proxy is not None:
+            result['proxy'] = self.get_proxy_result(proxy, encode_width, encode_height, encode_framerate, result['bitrate'])
+            if selected_parts is None:
+                result['proxy']['part_proxy_bitrates'] = proxy_bitrate_list
+        result['instrumentation'] = self.get_instrumentation(first_task_index)
+        self.json['analyses'].append(result)
+
+        if len(self.listeners) > 0:
+            for profile_index, profile in enumerate(result['optimized_encoding_ladder']['encoding_profiles']):
+                self.emit({'event': 'profile', 'profile_index': profile_index, 'profile': profile})
+            self.emit({'event': 'analysis', 'analysis': result})
+
+    def check_process_parameters(self, number_of_parts, width, height, crf_value, idr_interval, mode, selected_parts, proxy):
+        """Check the parameters of an analysis
+
+        :return: The normalized mode
+        :rtype: str
+        :raises ValueError: the parameters are not consistent
+
+        See CrfAnalyzer.process for the parameters.
+        """
+        mode = str(mode).strip().lower()
+        if mode not in ['parts', 'packets']:
+            raise ValueError('Available modes are "parts" and "packets", does not include: {}'.format(mode))
+
+        if selected_parts is not None:
+            if mode != 'parts':
+                raise ValueError('The selected parts are only available in "parts" mode')
+            if selected_parts < 1 or selected_parts > number_of_parts:
+                raise ValueError('The number of selected parts must be between 1 and the number of parts: {}'.format(selected_parts))
 
-            # Do a CRF encode for the input file
-            crf_encode = CrfEncode(self.input_file_path, width, height, crf_value, idr_interval_frames, part_start_time, part_duration)
-            crf_encode.execute()
+        if proxy is not None:
+            if not proxy.is_fitted():
+                raise ValueError('The proxy model is not fitted')
+            proxy.check_parameters(_get_proxy_parameters(width, height, crf_value, idr_interval))
 
-            # Get the Bitrate from the CRF encoded file
-            crf_probe = Probe(crf_encode.output_file_path)
-            crf_probe.execute()
+        return mode
 
-            # Remove temporary CRF encoded file
-            os.remove(crf_encode.output_file_path)
+    def plan(self, number_of_parts, width, height, crf_value, idr_interval, mode='parts', selected_parts=None, proxy=None, throughput=None):
+        """Expand the parameters of an analysis into its job graph with the estimated costs, without encoding anything
 
-            # Set the crf bitrate
-            crf_bitrate_list.append(crf_probe.bitrate)
+        Only the input is probed (through the probe cache), for its duration and frame rate.
 
+        :param throughput: The CPU cost model of the tasks ('None' value is the default throughput)
+        :type throughput: plan_providers.ThroughputModel
+        :return: The plan, replayed later with Plan.run
+        :rtype: plan_providers.Plan
+
+        See CrfAnalyzer.process for the other parameters.
+        """
+        mode = self.check_process_parameters(number_of_parts, width, height, crf_value, idr_interval, mode, selected_parts, proxy)
+        parameters = {'number_of_parts': number_of_parts, 'width': width, 'height': height, 'crf_value': crf_value, 'idr_interval': idr_interval,
+                      'mode': mode, 'selected_parts': selected_parts, 'proxy': proxy}
+        plan = Plan(self, parameters, throughput)
+
+        input_probe = Probe(self.input_file_path, self.probe_cache, self.runner)
+        self.execute_task(input_probe)
+        probe_job = plan.add_job('Probe', [(Probe, 0, 0)])
+
+        part_duration = input_probe.duration/number_of_parts
+        encode_width, encode_height, encode_framerate = width, height, input_probe.framerate
+        if proxy is not None:
+            encode_width, encode_height = proxy.get_proxy_definition(width, height)
+            encode_framerate = proxy.get_proxy_framerate(input_probe.framerate)
+        pixels_per_second = encode_width*encode_height*encode_framerate
+
+        if mode == 'packets':
+            if (encode_width, encode_height, crf_value, idr_interval, encode_framerate if proxy is not None else None) not in self.packets_cache:
+                plan.add_job('_crf_encode_packets', [(CrfEncode, pixels_per_second*input_probe.duration, input_probe.duration), (PacketProbe, 0, 0)],
+                             encode_width*encode_height*input_probe.duration*CRF_ESTIMATED_BYTES_PER_PIXEL_SECOND, [probe_job])
+            return plan
+
+        depends_on = [probe_job]
+        encoded_parts = number_of_parts
+        if selected_parts is not None:
+            input_pixels = input_probe.width*input_probe.height*input_probe.framerate*input_probe.duration
+            depends_on = [plan.add_job('_score_parts', [(SceneScore, input_pixels, 0)], 0, [probe_job])]
+            encoded_parts = selected_parts
+
+        for i in range(encoded_parts):
+            plan.add_job('_crf_encode_part', [(CrfEncode, pixels_per_second*part_duration, part_duration), (Probe, 0, 0)],
+                         encode_width*encode_height*part_duration*CRF_ESTIMATED_BYTES_PER_PIXEL_SECOND, depends_on)
+        return plan
+
+    def calibrate(self, proxy, number_of_parts, width, height, crf_value, idr_interval, max_workers=None, executor=None):
+        """CRF encode every part of a training title at full resolution and as a proxy, then add the bitrates to the calibration samples of a proxy model
+
+        The model is fitted with ProxyModel.fit once the training titles are calibrated.
+
+        :param proxy: The proxy model
+        :type proxy: calibration_providers.ProxyModel
+        :return: The number of added calibration samples
+        :rtype: int
+
+        See CrfAnalyzer.process for the other parameters.
+        """
+        parameters = _get_proxy_parameters(width, height, crf_value, idr_interval)
+        proxy.check_parameters(parameters)
+
+        input_probe = Probe(self.input_file_path, self.probe_cache, self.runner)
+        self.execute_task(input_probe)
+
+        part_duration = input_probe.duration/number_of_parts
+        proxy_width, proxy_height = proxy.get_proxy_definition(width, height)
+        proxy_framerate = proxy.get_proxy_framerate(input_probe.framerate)
+
+        parts = []
+        for i in range(0, number_of_parts):
+            parts.append((self.input_file_path, width, height, crf_value, idr_interval*input_probe.framerate, i*part_duration, part_duration))
+        for i in range(0, number_of_parts):
+            parts.append((self.input_file_path, proxy_width, proxy_height, crf_value, max(int(round(idr_interval*proxy_framerate)), 1), i*part_duration, part_duration,
+                          proxy_framerate))
+
+        bitrates = self.map_tasks(_crf_encode_part, parts, max_workers, executor)
+        samples = len(proxy.samples)
+        proxy.add_samples(parameters, bitrates[number_of_parts:], bitrates[:number_of_parts])
+        return len(proxy.samples) - samples
+
+    def get_proxy_result(self, proxy, proxy_width, proxy_height, proxy_framerate, bitrate):
+        """Get the proxy encodes description and the 95% prediction intervals of the full resolution bitrate estimates
+
+        :param proxy: The fitted proxy model
+        :type proxy: calibration_providers.ProxyModel
+        :param proxy_width: Width of the proxy encodes
+        :type proxy_width: int
+        :param proxy_height: Height of the proxy encodes
+        :type proxy_height: int
+        :param proxy_framerate: Frame rate of the proxy encodes
+        :type proxy_framerate: float
+        :param bitrate: The optimal, average and peak bitrate estimates of the analysis
+        :type bitrate: dict
+        :return: json object describing the proxy analysis
+        :rtype: dict
+        """
+        proxy_result = {}
+        proxy_result['model'] = proxy.get_json()
+        proxy_result['width'] = proxy_width
+        proxy_result['height'] = proxy_height
+        proxy_result['framerate'] = proxy_framerate
+        proxy_result['bitrate_bounds'] = {}
+        for key in ['optimal', 'average', 'peak']:
+            proxy_result['bitrate_bounds'][key] = proxy.get_bounds(bitrate[key])
+        return proxy_result
+
+    def get_part_event(self, part_start_time, part_duration, bitrate, represented_parts=1, proxy=None):
+        """Get the result event of a CRF encoded part
+
+        :param part_start_time: Start time of the part (in seconds)
+        :type part_start_time: float
+        :param part_duration: Duration of the part (in seconds)
+        :type part_duration: float
+        :param bitrate: The bitrate of the CRF encoded part
+        :type bitrate: float
+        :param represented_parts: Number of parts represented by a selected part
+        :type represented_parts: int
+        :param proxy: The proxy model mapping the bitrate of a proxy encoded part ('None' value is a full resolution part)
+        :type proxy: calibration_providers.ProxyModel
+        :return: The "crf_part" event
+        :rtype: dict
+        """
+        event = {}
+        event['event'] = 'crf_part'
+        event['part_start_time'] = part_start_time
+        event['part_duration'] = part_duration
+        event['bitrate'] = bitrate
+        event['represented_parts'] = represented_parts
+        if proxy is not None:
+            event['proxy_bitrate'] = bitrate
+            event['bitrate'] = proxy.get_bitrate(bitrate)
+        return event
+
+    def get_result(self, crf_bitrate_list, number_of_parts, part_duration, width, height, crf_value, idr_interval):
+        """Calculate the optimal bitrate from the CRF bitrates of the parts, then decline the optimized encoding ladder
+
+        :param crf_bitrate_list: The CRF bitrate of every part, in part order
+        :type crf_bitrate_list: float[]
+        :param part_duration: Duration of every part (in seconds)
+        :type part_duration: float
+        :return: json object describing the analysis
+        :rtype: dict
+
+        See CrfAnalyzer.process for the other parameters.
+        """
         # Calculate the average bitrate for all CRF encodings
         self.average_bitrate = statistics.mean(crf_bitrate_list)
         self.peak_bitrate = max(crf_bitrate_list)
@@ -290,7 +1376,7 @@ class CrfAnalyzer(Analyzer):
         result['bitrate'] = {}
         result['bitrate']['optimal'] = self.optimal_bitrate
         result['bitrate']['average'] = self.average_bitrate
-        result['bitrate']['peak'] = self.average_bitrate
+        result['bitrate']['peak'] = self.peak_bitrate
         result['bitrate']['standard_deviation'] = self.standard_deviation
         result['optimized_encoding_ladder'] = {}
         result['optimized_encoding_ladder']['encoding_profiles'] = []
@@ -321,13 +1407,33 @@ class CrfAnalyzer(Analyzer):
 
         result['optimized_encoding_ladder']['overall_bitrate_ladder'] = overall_bitrate_optimal
         result['optimized_encoding_ladder']['overall_bitrate_savings'] = self.encoding_ladder.get_overall_bitrate() - overall_bitrate_optimal
-        self.json['analyses'].append(result)
+        return result
+
+    def get_part_bitrates(self, packets, number_of_parts, part_duration):
+        """Bin the packets of a full length encode into parts and calculate the bitrate of each part
+
+        :param packets: The (pts_time, size) of every packet, sorted by presentation time
+        :type packets: tuple[]
+        :param number_of_parts: Number of part/segment for the analysis
+        :type number_of_parts: int
+        :param part_duration: Duration of every part (in seconds)
+        :type part_duration: float
+        :return: The bitrate of every part, in part order
+        :rtype: float[]
+        """
+        part_sizes = [0] * number_of_parts
+        start_time = packets[0][0] if len(packets) > 0 else 0
+        for pts_time, size in packets:
+            part_index = min(int((pts_time - start_time)/part_duration), number_of_parts - 1)
+            part_sizes[part_index] += size
+        return [part_size*8/part_duration for part_size in part_sizes]
 
 
 class MetricAnalyzer(Analyzer):
     """This class defines a Per-Title Analyzer based on VQ Metric and Multiple bitrate encodes"""
 
-    def process(self, metric, bitrate_steps, idr_interval):
+    def process(self, metric, bitrate_steps, idr_interval, max_workers=None, executor=None, search='linear', max_encodes=None, batch=None, fused=False, reference_cache=False,
+                sample_windows=None, window_duration=None, frame_step=None, keep_frames=False, ladder='greedy'):
         """Do the necessary encodings and quality metric assessments
 
         :param metric: Supporting "ssim" or "psnr"
@@ -336,18 +1442,206 @@ class MetricAnalyzer(Analyzer):
         :type bitrate_steps: int
         :param idr_interval: IDR interval in seconds
         :type idr_interval: int
+        :param max_workers: Number of encodings and assessments processed at the same time ('None' or 1 processes them in series)
+        :type max_workers: int
+        :param executor: A concurrent.futures executor (thread or process pool) used to process the encodings and assessments
+        :type executor: concurrent.futures.Executor
+        :param search: "linear" encodes every bitrate step, "golden" searches the knee of each profile with a golden-section search, "sparse" encodes a few geometrically spaced bitrates of each profile
+        :type search: str
+        :param max_encodes: Maximum number of encodings per profile for the "golden" search ('None' is a budget based on the bitrate grid size), or number of encodings per profile for the "sparse" search ('None' is 4)
+        :type max_encodes: int
+        :param batch: Decode the input once for a batch of "linear" or "sparse" encodings: "profile" batches all the bitrates of a profile, "step" batches the same bitrate step of all profiles ('None' encodes every point on its own)
+        :type batch: str
+        :param fused: Pipe every encoded stream into its metric assessment instead of writing a temporary file (not available for batches)
+        :type fused: bool
+        :param reference_cache: Decode the reference once into a raw yuv420p file in the scratch directory, used by every metric assessment of the analysis (not available with a SpoolExecutor)
+        :type reference_cache: bool
+        :param sample_windows: Only encode and assess this number of windows, evenly spread over the input ('None' value is the whole input, not available for batches)
+        :type sample_windows: int
+        :param window_duration: Duration of every sampled window (in seconds)
+        :type window_duration: float
+        :param frame_step: Only assess every Nth frame ('None' value assesses every frame)
+        :type frame_step: int
+        :param keep_frames: Add the list of the per frame metric values to the frame statistics of every encoding
+        :type keep_frames: bool
+        :param ladder: "greedy" selects the optimal bitrate of each profile on its own, "hull" fits a rate-distortion curve per profile and selects the rungs on the convex hull of all the curves
+        :type ladder: str
         """
+        search, batch, ladder = self.check_process_parameters(search, max_encodes, batch, fused, sample_windows, window_duration, ladder)
+        if reference_cache is True and isinstance(executor, SpoolExecutor):
+            raise ValueError('The reference cache is written to the scratch directory of this host, the workers of a SpoolExecutor cannot read it')
+
+        first_task_index = len(self.task_statistics)
 
         # Start by probing the input video file
-        input_probe = Probe(self.input_file_path)
-        input_probe.execute()
+        input_probe = Probe(self.input_file_path, self.probe_cache, self.runner)
+        self.execute_task(input_probe)
 
-        part_start_time = 0
-        part_duration = input_probe.duration
         idr_interval_frames =  idr_interval*input_probe.framerate
         metric = str(metric).strip().lower()
+        windows = self.get_windows(input_probe, sample_windows, window_duration)
+
+        json_ouput = self.get_result(metric, bitrate_steps, idr_interval, input_probe, windows, frame_step, search, batch, fused, reference_cache)
+        json_ouput['parameters']['ladder'] = ladder
+        profile_grids = self.get_profile_grids(bitrate_steps, search, max_encodes)
+
+        if reference_cache is True:
+            # The raw reference is held in the scratch directory until the end of the analysis
+            reference_size = input_probe.width*input_probe.height*1.5*input_probe.framerate*input_probe.duration
+            with self.scratch.reserve(reference_size, pinned=True) as reference_directory:
+                raw_decode = RawDecode(self.input_file_path, reference_directory, self.runner)
+                self.execute_task(raw_decode)
+                profile_results = self.assess_profiles(profile_grids, input_probe, metric, idr_interval_frames, windows, frame_step, keep_frames,
+                                                       search, max_encodes, batch, fused, raw_decode.output_file_path, input_probe.framerate,
+                                                       max_workers, executor, ladder)
+        else:
+            profile_results = self.assess_profiles(profile_grids, input_probe, metric, idr_interval_frames, windows, frame_step, keep_frames,
+                                                   search, max_encodes, batch, fused, None, None, max_workers, executor, ladder)
 
-        # Adding results to json
+        self.add_profile_results(json_ouput, profile_grids, profile_results, search)
+        if ladder == 'hull':
+            self.add_hull_ladder(json_ouput, profile_results)
+        json_ouput['instrumentation'] = self.get_instrumentation(first_task_index)
+        self.json['analyses'].append(json_ouput)
+
+        if ladder == 'hull' and len(self.listeners) > 0:
+            # The profile decisions streamed during the analysis were the pre-hull ones
+            for profile_index, profile in enumerate(json_ouput['optimized_encoding_ladder']['encoding_profiles']):
+                self.emit(self.get_profile_event(profile_index, profile))
+        self.emit({'event': 'analysis', 'analysis': json_ouput})
+
+    def check_process_parameters(self, search, max_encodes, batch, fused, sample_windows, window_duration, ladder):
+        """Check the parameters of an analysis
+
+        :return: The normalized search, batch and ladder
+        :rtype: tuple
+        :raises ValueError: the parameters are not consistent
+
+        See MetricAnalyzer.process for the parameters.
+        """
+        search = str(search).strip().lower()
+        if search not in ['linear', 'golden', 'sparse']:
+            raise ValueError('Available searches are "linear", "golden" and "sparse", does not include: {}'.format(search))
+
+        if search == 'sparse' and max_encodes is not None and int(max_encodes) < 2:
+            raise ValueError('The "sparse" search needs at least 2 encodings per profile')
+
+        ladder = str(ladder).strip().lower()
+        if ladder not in ['greedy', 'hull']:
+            raise ValueError('Available ladders are "greedy" and "hull", does not include: {}'.format(ladder))
+
+        if batch is not None:
+            batch = str(batch).strip().lower()
+            if batch not in ['profile', 'step']:
+                raise ValueError('Available batches are "profile" and "step", does not include: {}'.format(batch))
+            if search == 'golden':
+                raise ValueError('Batched encodings are only available for the "linear" and "sparse" searches')
+            if fused is True:
+                raise ValueError('Batched encodings cannot be fused with their metric assessments')
+            if sample_windows is not None:
+                raise ValueError('Batched encodings cannot be sampled in windows')
+
+        if sample_windows is not None and (int(sample_windows) < 1 or window_duration is None or window_duration <= 0):
+            raise ValueError('Sampled windows need a positive number of windows and window duration')
+
+        return search, batch, ladder
+
+    def plan(self, metric, bitrate_steps, idr_interval, search='linear', max_encodes=None, batch=None, fused=False, reference_cache=False,
+             sample_windows=None, window_duration=None, frame_step=None, keep_frames=False, ladder='greedy', throughput=None):
+        """Expand the parameters of an analysis into its job graph with the estimated costs, without encoding anything
+
+        Only the input is probed (through the probe cache), for its duration, definition and frame rate. The "golden" searches are planned with their whole encoding budget.
+
+        :param throughput: The CPU cost model of the tasks ('None' value is the default throughput)
+        :type throughput: plan_providers.ThroughputModel
+        :return: The plan, replayed later with Plan.run
+        :rtype: plan_providers.Plan
+
+        See MetricAnalyzer.process for the other parameters.
+        """
+        search, batch, ladder = self.check_process_parameters(search, max_encodes, batch, fused, sample_windows, window_duration, ladder)
+        parameters = {'metric': metric, 'bitrate_steps': bitrate_steps, 'idr_interval': idr_interval, 'search': search, 'max_encodes': max_encodes, 'batch': batch,
+                      'fused': fused, 'reference_cache': reference_cache, 'sample_windows': sample_windows, 'window_duration': window_duration,
+                      'frame_step': frame_step, 'keep_frames': keep_frames, 'ladder': ladder}
+        plan = Plan(self, parameters, throughput)
+
+        input_probe = Probe(self.input_file_path, self.probe_cache, self.runner)
+        self.execute_task(input_probe)
+        depends_on = [plan.add_job('Probe', [(Probe, 0, 0)])]
+
+        windows = self.get_windows(input_probe, sample_windows, window_duration)
+        profile_grids = self.get_profile_grids(bitrate_steps, search, max_encodes)
+        encoding_profiles = self.encoding_ladder.encoding_profile_list
+
+        # The metric assessments are done at the reference definition, on every frame_step frame
+        reference_pixels_per_second = input_probe.width*input_probe.height*input_probe.framerate
+        metric_pixels_per_second = reference_pixels_per_second/max(frame_step or 1, 1)
+
+        if reference_cache is True:
+            reference_size = input_probe.width*input_probe.height*1.5*input_probe.framerate*input_probe.duration
+            depends_on = [plan.add_job('RawDecode', [(RawDecode, reference_pixels_per_second*input_probe.duration, 0)], reference_size, depends_on, pinned=True)]
+
+        def get_point_tasks(encoding_profile, duration):
+            encode_pixels = encoding_profile.width*encoding_profile.height*input_probe.framerate*duration
+            if fused is True:
+                return [(CbrEncodeMetric, encode_pixels + metric_pixels_per_second*duration, duration)]
+            return [(CbrEncode, encode_pixels, duration), (Metric, metric_pixels_per_second*duration, 0)]
+
+        if search == 'golden':
+            for encoding_profile, bitrates in zip(encoding_profiles, profile_grids):
+                encodes = min(self.get_search_budget(bitrates, max_encodes), len(bitrates))
+                tasks = []
+                for part_start_time, part_duration in windows:
+                    tasks.extend(get_point_tasks(encoding_profile, part_duration))
+                scratch_bytes = 0 if fused is True else max(bitrates)*max(window[1] for window in windows)/8
+                plan.add_job('_golden_section_search', tasks*encodes, scratch_bytes, depends_on)
+
+        elif batch is not None:
+            part_start_time, part_duration = windows[0]
+            for points in self.get_batches(profile_grids, batch):
+                renditions = [(encoding_profiles[profile_index], profile_grids[profile_index][bitrate_index]) for profile_index, bitrate_index in points]
+                encode_pixels = sum(encoding_profile.width*encoding_profile.height for encoding_profile, bitrate in renditions)*input_probe.framerate*part_duration
+                tasks = [(MultiCbrEncode, encode_pixels, part_duration*len(renditions), len(renditions))]
+                tasks += [(Metric, metric_pixels_per_second*part_duration, 0)]*len(renditions)
+                plan.add_job('_multi_cbr_encode_and_assess', tasks, sum(bitrate for encoding_profile, bitrate in renditions)*part_duration/8, depends_on)
+
+        else:
+            for encoding_profile, bitrates in zip(encoding_profiles, profile_grids):
+                for bitrate in bitrates:
+                    for part_start_time, part_duration in windows:
+                        scratch_bytes = 0 if fused is True else bitrate*part_duration/8
+                        plan.add_job('_cbr_encode_and_assess', get_point_tasks(encoding_profile, part_duration), scratch_bytes, depends_on)
+
+        return plan
+
+    def get_windows(self, input_probe, sample_windows=None, window_duration=None):
+        """Spread the sampled windows at the center of equal slices of the input
+
+        :param input_probe: The input video file probe
+        :type input_probe: task_providers.Probe
+        :return: The (start time, duration) of the sampled windows (in seconds)
+        :rtype: tuple[]
+
+        See MetricAnalyzer.process for the other parameters.
+        """
+        windows = [(0, input_probe.duration)]
+        if sample_windows is not None and int(sample_windows)*window_duration < input_probe.duration:
+            slice_duration = input_probe.duration/int(sample_windows)
+            windows = [(i*slice_duration + (slice_duration - window_duration)/2, window_duration) for i in range(int(sample_windows))]
+        return windows
+
+    def get_result(self, metric, bitrate_steps, idr_interval, input_probe, windows, frame_step, search, batch, fused, reference_cache):
+        """Get the json object of an analysis, with its parameters and an empty optimized encoding ladder
+
+        :param input_probe: The input video file probe
+        :type input_probe: task_providers.Probe
+        :param windows: The (start time, duration) of the sampled windows of every encoding (in seconds)
+        :type windows: tuple[]
+        :return: json object describing the analysis
+        :rtype: dict
+
+        See MetricAnalyzer.process for the other parameters.
+        """
         json_ouput = {}
         json_ouput['processing_date'] = str(datetime.datetime.now())
         json_ouput['parameters'] = {}
@@ -356,62 +1650,416 @@ class MetricAnalyzer(Analyzer):
         json_ouput['parameters']['bitrate_steps'] = bitrate_steps
         json_ouput['parameters']['idr_interval'] = idr_interval
         json_ouput['parameters']['number_of_parts'] = 1
-        json_ouput['parameters']['part_duration'] = part_duration
+        json_ouput['parameters']['part_duration'] = input_probe.duration
         json_ouput['optimized_encoding_ladder'] = {}
         json_ouput['optimized_encoding_ladder']['encoding_profiles'] = []
 
-        for encoding_profile in self.encoding_ladder.encoding_profile_list:
+        json_ouput['parameters']['search'] = search
+        json_ouput['parameters']['batch'] = batch
+        json_ouput['parameters']['fused'] = fused
+        json_ouput['parameters']['reference_cache'] = reference_cache
+        json_ouput['parameters']['sampling'] = {}
+        json_ouput['parameters']['sampling']['windows'] = len(windows)
+        json_ouput['parameters']['sampling']['window_duration'] = windows[0][1]
+        json_ouput['parameters']['sampling']['frame_step'] = frame_step
+        json_ouput['parameters']['sampling']['coverage'] = sum(window[1] for window in windows)/input_probe.duration/max(frame_step or 1, 1)
+        return json_ouput
 
-            profile = {}
-            profile['width'] = encoding_profile.width
-            profile['height'] = encoding_profile.height
-            profile['cbr_encodings'] = []
-            profile['optimal_bitrate'] = None
+    def get_profile_grids(self, bitrate_steps, search='linear', max_encodes=None):
+        """Build the bitrate grid of each profile, from its min to its max bitrate
 
-            last_metric_value = 0
-            last_quality_step_ratio = 0
+        :param bitrate_steps: Bitrate gap between every encoding
+        :type bitrate_steps: int
+        :param search: "sparse" only keeps a few geometrically spaced bitrates, rounded to the bitrate steps
+        :type search: str
+        :param max_encodes: Number of bitrates of a "sparse" grid ('None' value is 4)
+        :type max_encodes: int
+        :return: The bitrate grid of each profile, in the encoding ladder order
+        :rtype: int[][]
+        """
+        profile_grids = []
+        for encoding_profile in self.encoding_ladder.encoding_profile_list:
+            bitrates = list(range(encoding_profile.bitrate_min, (encoding_profile.bitrate_max + bitrate_steps), bitrate_steps))
+            if search == 'sparse':
+                encodes = int(max_encodes or SPARSE_ENCODES)
+                # The geometric spacing is undefined from a null bitrate min, it then starts at the first bitrate step
+                low = bitrates[0] if bitrates[0] > 0 else (min(bitrate_steps, bitrates[-1]) or 1)
+                ratio = bitrates[-1]/low
+                bitrates = sorted(set(low + int(round((low*ratio**(i/(encodes - 1)) - low)/bitrate_steps))*bitrate_steps
+                                      for i in range(encodes)))
+            profile_grids.append(bitrates)
+        return profile_grids
+
+    def add_profile_results(self, json_ouput, profile_grids, profile_results, search):
+        """Select the optimal bitrate of each profile once all its points are assessed
+
+        :param json_ouput: json object describing the analysis
+        :type json_ouput: dict
+        :param profile_grids: The bitrate grid of each profile, in the encoding ladder order
+        :type profile_grids: int[][]
+        :param profile_results: For each profile, the (bitrate, assessment) pairs sorted by bitrate and the knee bitrate of a "golden" search
+        :type profile_results: tuple[]
+        :param search: "linear" or "golden"
+        :type search: str
+        """
+        for encoding_profile, bitrates, profile_result in zip(self.encoding_ladder.encoding_profile_list, profile_grids, profile_results):
+            json_ouput['optimized_encoding_ladder']['encoding_profiles'].append(self.get_search_profile_result(encoding_profile, bitrates, profile_result, search))
+
+    def get_search_profile_result(self, encoding_profile, bitrates, profile_result, search):
+        """Select the optimal bitrate of a profile, the knee bitrate for a "golden" search and for a "sparse" search of more than 2 bitrates
+
+        The quality step ratios of a "sparse" search fall with the growing steps of its geometric grid, so the greedy selection is replaced by the knee.
+
+        :param encoding_profile: The assessed encoding profile
+        :type encoding_profile: per_title.EncodingProfile
+        :param bitrates: The bitrate grid of the profile
+        :type bitrates: int[]
+        :param profile_result: The (bitrate, assessment) pairs sorted by bitrate and the knee bitrate of a "golden" search
+        :type profile_result: tuple
+        :param search: "linear", "golden" or "sparse"
+        :type search: str
+        :return: json object describing the profile encodings and its optimal bitrate
+        :rtype: dict
+        """
+        sampled, knee_bitrate = profile_result
+        profile = self.get_profile_result(encoding_profile, sampled)
 
-            for bitrate in range(encoding_profile.bitrate_min, (encoding_profile.bitrate_max + bitrate_steps), bitrate_steps):
+        if search == 'sparse' and len(sampled) > 2:
+            profile['optimal_bitrate'] = _get_knee_bitrate(sampled)
+            profile['bitrate_savings'] = encoding_profile.bitrate_default - profile['optimal_bitrate']
 
-                # Do a CRF encode for the input file
-                cbr_encode = CbrEncode(self.input_file_path, encoding_profile.width, encoding_profile.height, bitrate, idr_interval_frames, part_start_time, part_duration)
-                cbr_encode.execute()
+        if search == 'golden':
+            profile['optimal_bitrate'] = knee_bitrate
+            profile['bitrate_savings'] = encoding_profile.bitrate_default - knee_bitrate
+            profile['encodes'] = len(sampled)
+            profile['encodes_saved'] = len(bitrates) - len(sampled)
 
-                # Get the Bitrate from the CRF encoded file
-                metric_assessment = Metric(metric, cbr_encode.output_file_path, self.input_file_path, input_probe.width, input_probe.height)
-                metric_assessment.execute()
+        return profile
 
-                # Remove temporary CRF encoded file
-                os.remove(cbr_encode.output_file_path)
+    def add_hull_ladder(self, json_ouput, profile_results):
+        """Fit a rate-distortion curve on the assessed points of every profile, then select the ladder rungs on the convex hull of the curves
 
-                if last_metric_value is 0 :
-                    # for first value, you cannot calculate acurate jump in quality from nothing
-                    last_metric_value = metric_assessment.output_value
-                    profile['optimal_bitrate'] = bitrate
-                    quality_step_ratio = (metric_assessment.output_value)/bitrate # frist step from null to the starting bitrate
-                else:
-                    quality_step_ratio = (metric_assessment.output_value - last_metric_value)/bitrate_steps
+        The optimal bitrate of every profile is replaced by its rung, a profile which is not on the hull is removed unless it is required.
 
-                if quality_step_ratio >= (last_quality_step_ratio/2):
-                    profile['optimal_bitrate'] = bitrate
+        :param json_ouput: json object describing the analysis, with its profile results
+        :type json_ouput: dict
+        :param profile_results: For each profile, the (bitrate, assessment) pairs sorted by bitrate and the knee bitrate of a "golden" search
+        :type profile_results: tuple[]
+        """
+        encoding_profiles = self.encoding_ladder.encoding_profile_list
+        profile_points = [[(bitrate, assessment['metric_value']) for bitrate, assessment in sampled] for sampled, knee_bitrate in profile_results]
+        curves = fit_log_curves(profile_points)
 
-                #if 'ssim' in metric:
-                #    if metric_assessment.output_value >= (last_metric_value + 0.01):
-                #        profile['optimal_bitrate'] = bitrate
-                #elif 'psnr' in metric:
-                #    if metric_assessment.output_value > last_metric_value:
-                #        profile['optimal_bitrate'] = bitrate
+        bitrate_ranges = [(points[0][0], points[-1][0]) for points in profile_points]
+        hull = get_convex_hull(curves, bitrate_ranges, get_hull_grid(bitrate_ranges))
+        rungs = get_hull_ladder(curves, hull, encoding_profiles)
 
-                last_metric_value = metric_assessment.output_value
-                last_quality_step_ratio = quality_step_ratio
+        overall_bitrate_optimal = 0
+        for encoding_profile, profile, curve, rung in zip(encoding_profiles, json_ouput['optimized_encoding_ladder']['encoding_profiles'], curves, rungs):
+            profile['rd_curve'] = None
+            if curve is not None:
+                profile['rd_curve'] = {'model': 'log', 'intercept': curve[0], 'slope': curve[1], 'residual_error': curve[2]}
+
+            if rung is None:
+                profile['optimal_bitrate'] = None
+                profile['bitrate_savings'] = encoding_profile.bitrate_default
+                profile['hull_range'] = None
+                profile['removed'] = True
+                continue
+
+            profile['optimal_bitrate'], profile['hull_range'] = rung
+            profile['bitrate_savings'] = encoding_profile.bitrate_default - profile['optimal_bitrate']
+            profile['removed'] = False
+            overall_bitrate_optimal += profile['optimal_bitrate']
+
+        json_ouput['optimized_encoding_ladder']['convex_hull'] = [list(point) for point in hull]
+        json_ouput['optimized_encoding_ladder']['overall_bitrate_ladder'] = overall_bitrate_optimal
+        json_ouput['optimized_encoding_ladder']['overall_bitrate_savings'] = self.encoding_ladder.get_overall_bitrate() - overall_bitrate_optimal
+
+    def get_grid_events(self, profile_grids, windows, ladder='greedy', search='linear'):
+        """Track the assessed points of a grid, to emit every point and every profile as soon as they are done
+
+        :param profile_grids: The bitrate grid of each profile, in the encoding ladder order
+        :type profile_grids: int[][]
+        :param windows: The (start time, duration) of the sampled windows of every encoding (in seconds)
+        :type windows: tuple[]
+        :param ladder: "hull" flags the profile events as pre-hull decisions
+        :type ladder: str
+        :param search: "linear" or "sparse", the search of the grid
+        :type search: str
+        :return: Called with the profile, bitrate and window indexes and the assessment of a point, returns its "cbr_encoding" event and the "profile" event of a done profile
+        :rtype: callable
+        """
+        profile_assessments = [{} for bitrates in profile_grids]
+
+        def add_point(profile_index, bitrate_index, window_index, assessment):
+            encoding_profile = self.encoding_ladder.encoding_profile_list[profile_index]
+            bitrates = profile_grids[profile_index]
+            events = [self.get_encoding_event(encoding_profile, bitrates[bitrate_index], assessment, windows[window_index])]
+
+            assessments = profile_assessments[profile_index]
+            assessments[(bitrate_index, window_index)] = assessment
+            if len(assessments) == len(bitrates)*len(windows):
+                sampled = []
+                for i, bitrate in enumerate(bitrates):
+                    sampled.append((bitrate, _aggregate_window_assessments([assessments[(i, j)] for j in range(len(windows))])))
+                profile = self.get_search_profile_result(encoding_profile, bitrates, (sampled, None), search)
+                events.append(self.get_profile_event(profile_index, profile, ladder == 'hull'))
+                # The assessments of a done profile are not needed anymore
+                assessments.clear()
+            return events
+
+        return add_point
+
+    def get_profile_event(self, profile_index, profile, pre_hull=False):
+        """Get the result event of a profile decision
+
+        :param profile_index: Index of the profile in the encoding ladder
+        :type profile_index: int
+        :param profile: json object describing the profile encodings and its optimal bitrate
+        :type profile: dict
+        :param pre_hull: The optimal bitrate is the greedy one of a "hull" ladder analysis, replaced by the hull rung in the "profile" events emitted before the "analysis" event
+        :type pre_hull: bool
+        :return: The "profile" event
+        :rtype: dict
+        """
+        event = {'event': 'profile', 'profile_index': profile_index, 'profile': profile}
+        if pre_hull is True:
+            event['pre_hull'] = True
+        return event
+
+    def get_encoding_event(self, encoding_profile, bitrate, assessment, window=None):
+        """Get the result event of an assessed encoding
+
+        :param encoding_profile: The encoding profile
+        :type encoding_profile: per_title.EncodingProfile
+        :param bitrate: The encoding bitrate
+        :type bitrate: int
+        :param assessment: The assessment of the encoding
+        :type assessment: dict
+        :param window: The (start time, duration) of a sampled window (in seconds, 'None' value is the assessment of all the windows)
+        :type window: tuple
+        :return: The "cbr_encoding" event
+        :rtype: dict
+        """
+        event = {}
+        event['event'] = 'cbr_encoding'
+        event['width'] = encoding_profile.width
+        event['height'] = encoding_profile.height
+        event['bitrate'] = bitrate
+        if window is not None:
+            event['part_start_time'], event['part_duration'] = window
+        event['assessment'] = assessment
+        return event
+
+    def assess_profiles(self, profile_grids, input_probe, metric, idr_interval_frames, windows, frame_step, keep_frames, search, max_encodes, batch, fused,
+                        ref_file_path, ref_framerate, max_workers, executor, ladder='greedy'):
+        """Do the encodings and quality metric assessments of every profile
+
+        :param profile_grids: The bitrate grid of each profile, in the encoding ladder order
+        :type profile_grids: int[][]
+        :param input_probe: The input video file probe
+        :type input_probe: task_providers.Probe
+        :param windows: The (start time, duration) of the sampled windows of every encoding (in seconds)
+        :type windows: tuple[]
+        :param ref_file_path: The metric reference video file path ('None' value is the input file)
+        :type ref_file_path: str
+        :param ref_framerate: Frame rate of a raw yuv420p reference video ('None' value is a reference video in any container format)
+        :type ref_framerate: int
+        :return: For each profile, the (bitrate, assessment) pairs sorted by bitrate and the knee bitrate of a "golden" search
+        :rtype: tuple[]
+
+        See MetricAnalyzer.process for the other parameters.
+        """
+        if search == 'golden':
+            # Each profile search is sequential, but the profiles are searched at the same time
+            searches = []
+            for encoding_profile, bitrates in zip(self.encoding_ladder.encoding_profile_list, profile_grids):
+                searches.append((bitrates, self.get_search_budget(bitrates, max_encodes), self.input_file_path, encoding_profile.width, encoding_profile.height,
+                                 idr_interval_frames, windows, metric, input_probe.width, input_probe.height, fused,
+                                 ref_file_path, ref_framerate, frame_step, input_probe.framerate, keep_frames))
+            def search_events(profile_index, profile_result):
+                encoding_profile = self.encoding_ladder.encoding_profile_list[profile_index]
+                events = [self.get_encoding_event(encoding_profile, bitrate, assessment) for bitrate, assessment in profile_result[0]]
+                profile = self.get_search_profile_result(encoding_profile, profile_grids[profile_index], profile_result, search)
+                events.append(self.get_profile_event(profile_index, profile, ladder == 'hull'))
+                return events
+
+            profile_results = self.map_tasks(_golden_section_search, searches, max_workers, executor, search_events)
+
+        elif batch is not None:
+            part_start_time, part_duration = windows[0]
+
+            # Group the grid points so that each batch decodes the input only once
+            batches = self.get_batches(profile_grids, batch)
+
+            jobs = []
+            for points in batches:
+                renditions = []
+                for profile_index, bitrate_index in points:
+                    encoding_profile = self.encoding_ladder.encoding_profile_list[profile_index]
+                    renditions.append((encoding_profile.width, encoding_profile.height, profile_grids[profile_index][bitrate_index]))
+                jobs.append((self.input_file_path, renditions, idr_interval_frames, part_start_time, part_duration,
+                             metric, input_probe.width, input_probe.height, ref_file_path, ref_framerate, frame_step, input_probe.framerate, keep_frames))
+
+            add_point = self.get_grid_events(profile_grids, windows[:1], ladder, search)
+
+            def batch_events(batch_index, assessments):
+                events = []
+                for (profile_index, bitrate_index), assessment in zip(batches[batch_index], assessments):
+                    events.extend(add_point(profile_index, bitrate_index, 0, assessment))
+                return events
+
+            batch_assessments = self.map_tasks(_multi_cbr_encode_and_assess, jobs, max_workers, executor, batch_events)
+
+            # Dispatch the batch assessments back to their profile and bitrate
+            point_assessments = {}
+            for points, assessments in zip(batches, batch_assessments):
+                for point, assessment in zip(points, assessments):
+                    point_assessments[point] = assessment
+
+            profile_results = []
+            for profile_index, bitrates in enumerate(profile_grids):
+                sampled = [(bitrate, point_assessments[(profile_index, bitrate_index)]) for bitrate_index, bitrate in enumerate(bitrates)]
+                profile_results.append((sampled, None))
+
+        else:
+            # Schedule the whole profile x bitrate x window grid as independent encodings and assessments
+            grid = self.get_linear_grid(profile_grids, input_probe, metric, idr_interval_frames, windows, frame_step, keep_frames, fused,
+                                        ref_file_path, ref_framerate)
+            add_point = self.get_grid_events(profile_grids, windows, ladder, search)
+            points = [(profile_index, bitrate_index, window_index) for profile_index, bitrates in enumerate(profile_grids)
+                      for bitrate_index in range(len(bitrates)) for window_index in range(len(windows))]
+            window_assessments = self.map_tasks(_cbr_encode_and_assess, grid, max_workers, executor,
+                                                lambda index, assessment: add_point(*(points[index] + (assessment,))))
+            profile_results = self.get_linear_profile_results(profile_grids, windows, window_assessments)
+
+        return profile_results
+
+    def get_search_budget(self, bitrates, max_encodes):
+        """Get the encoding budget of the "golden" search of a profile
+
+        :param bitrates: The bitrate grid of the profile
+        :type bitrates: int[]
+        :param max_encodes: Maximum number of encodings per profile ('None' is a budget based on the bitrate grid size)
+        :type max_encodes: int
+        :return: The maximum number of encodings, at least 3
+        :rtype: int
+        """
+        search_budget = max_encodes
+        if search_budget is None:
+            search_budget = int(math.ceil(math.log(max(len(bitrates), 2), GOLDEN_RATIO))) + 3
+        return max(search_budget, 3)
+
+    def get_batches(self, profile_grids, batch):
+        """Group the grid points of a batched "linear" or "sparse" search
+
+        :param profile_grids: The bitrate grid of each profile, in the encoding ladder order
+        :type profile_grids: int[][]
+        :param batch: "profile" batches all the bitrates of a profile, "step" batches the same bitrate step of all profiles
+        :type batch: str
+        :return: The (profile index, bitrate index) points of every batch
+        :rtype: tuple[][]
+        """
+        batches = []
+        if batch == 'profile':
+            for profile_index, bitrates in enumerate(profile_grids):
+                batches.append([(profile_index, bitrate_index) for bitrate_index in range(len(bitrates))])
+        else:
+            for bitrate_index in range(max(len(bitrates) for bitrates in profile_grids)):
+                batches.append([(profile_index, bitrate_index) for profile_index, bitrates in enumerate(profile_grids) if bitrate_index < len(bitrates)])
+        return batches
 
-                encoding = {}
-                encoding['bitrate'] = bitrate
-                encoding['metric_value'] = metric_assessment.output_value
-                encoding['quality_step_ratio'] = quality_step_ratio
-                profile['cbr_encodings'].append(encoding)
+    def get_linear_grid(self, profile_grids, input_probe, metric, idr_interval_frames, windows, frame_step, keep_frames, fused, ref_file_path, ref_framerate):
+        """Get the _cbr_encode_and_assess arguments of every profile x bitrate x window point of a "linear" search
 
-            profile['bitrate_savings'] = encoding_profile.bitrate_default - profile['optimal_bitrate']
-            json_ouput['optimized_encoding_ladder']['encoding_profiles'].append(profile)
+        :return: The arguments tuple of every point, profile by profile, bitrate by bitrate
+        :rtype: tuple[]
 
-        self.json['analyses'].append(json_ouput)
+        See MetricAnalyzer.assess_profiles for the parameters.
+        """
+        grid = []
+        for encoding_profile, bitrates in zip(self.encoding_ladder.encoding_profile_list, profile_grids):
+            for bitrate in bitrates:
+                for part_start_time, part_duration in windows:
+                    grid.append((self.input_file_path, encoding_profile.width, encoding_profile.height, bitrate, idr_interval_frames,
+                                 part_start_time, part_duration, metric, input_probe.width, input_probe.height, fused,
+                                 ref_file_path, ref_framerate, frame_step, input_probe.framerate, keep_frames))
+        return grid
+
+    def get_linear_profile_results(self, profile_grids, windows, window_assessments):
+        """Aggregate the window assessments of a "linear" search back to their profile and bitrate
+
+        :param profile_grids: The bitrate grid of each profile, in the encoding ladder order
+        :type profile_grids: int[][]
+        :param windows: The (start time, duration) of the sampled windows of every encoding (in seconds)
+        :type windows: tuple[]
+        :param window_assessments: The assessment of every point, in the MetricAnalyzer.get_linear_grid order
+        :type window_assessments: dict[]
+        :return: For each profile, the (bitrate, assessment) pairs sorted by bitrate and no knee bitrate
+        :rtype: tuple[]
+        """
+        profile_results = []
+        grid_index = 0
+        for bitrates in profile_grids:
+            sampled = []
+            for bitrate in bitrates:
+                sampled.append((bitrate, _aggregate_window_assessments(window_assessments[grid_index:grid_index + len(windows)])))
+                grid_index += len(windows)
+            profile_results.append((sampled, None))
+        return profile_results
+
+    def get_profile_result(self, encoding_profile, sampled):
+        """Select the optimal bitrate of a profile from its assessed bitrates
+
+        :param encoding_profile: The assessed encoding profile
+        :type encoding_profile: per_title.EncodingProfile
+        :param sampled: The (bitrate, assessment) pairs of the profile, sorted by bitrate
+        :type sampled: tuple[]
+        :return: json object describing the profile encodings and its optimal bitrate
+        :rtype: dict
+        """
+        profile = {}
+        profile['width'] = encoding_profile.width
+        profile['height'] = encoding_profile.height
+        profile['cbr_encodings'] = []
+        profile['optimal_bitrate'] = None
+
+        last_bitrate = 0
+        last_metric_value = 0
+        last_quality_step_ratio = 0
+
+        for bitrate, assessment in sampled:
+
+            metric_value = assessment['metric_value']
+
+            if last_metric_value == 0 :
+                # for first value, you cannot calculate acurate jump in quality from nothing
+                last_metric_value = metric_value
+                profile['optimal_bitrate'] = bitrate
+                quality_step_ratio = (metric_value)/bitrate # frist step from null to the starting bitrate
+            else:
+                quality_step_ratio = (metric_value - last_metric_value)/(bitrate - last_bitrate)
+
+            if quality_step_ratio >= (last_quality_step_ratio/2):
+                profile['optimal_bitrate'] = bitrate
+
+            #if 'ssim' in metric:
+            #    if metric_value >= (last_metric_value + 0.01):
+            #        profile['optimal_bitrate'] = bitrate
+            #elif 'psnr' in metric:
+            #    if metric_value > last_metric_value:
+            #        profile['optimal_bitrate'] = bitrate
+
+            last_bitrate = bitrate
+            last_metric_value = metric_value
+            last_quality_step_ratio = quality_step_ratio
+
+            encoding = dict(assessment)
+            encoding['bitrate'] = bitrate
+            encoding['metric_value'] = metric_value
+            encoding['quality_step_ratio'] = quality_step_ratio
+            profile['cbr_encodings'].append(encoding)
+
+        profile['bitrate_savings'] = encoding_profile.bitrate_default - profile['optimal_bitrate']
+        return profile
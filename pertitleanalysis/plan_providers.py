@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+# Pixels processed per CPU second by every task, by task name (the pixels of a task are counted by the analyzers plan methods)
+DEFAULT_PIXELS_PER_SECOND = {'Probe': None, 'PacketProbe': None, 'SceneScore': 100e6, 'CrfEncode': 30e6, 'CbrEncode': 25e6, 'MultiCbrEncode': 25e6,
+                             'RawDecode': 150e6, 'Metric': 40e6, 'CbrEncodeMetric': 15e6}
+
+
+class ThroughputModel(object):
+    """This class defines the CPU cost model of the tasks: a fixed overhead per subprocess, plus the processed pixels over a per task throughput"""
+
+    def __init__(self, pixels_per_second=None, subprocess_overhead=0.05):
+        """ThroughputModel initialization
+
+        :param pixels_per_second: Pixels processed per CPU second, by task name ('None' value is a default throughput, updated by ThroughputModel.calibrate)
+        :type pixels_per_second: dict
+        :param subprocess_overhead: CPU time of a subprocess start and of a pixel free task (in seconds)
+        :type subprocess_overhead: float
+        """
+        self.pixels_per_second = dict(DEFAULT_PIXELS_PER_SECOND)
+        self.pixels_per_second.update(pixels_per_second or {})
+        self.subprocess_overhead = subprocess_overhead
+
+    def __str__(self):
+        """Display the throughput model informations
+
+        :return: human readable string describing the throughput of every task
+        :rtype: str
+        """
+        rates = ', '.join('{}={:.3g}'.format(task, rate) for task, rate in sorted(self.pixels_per_second.items()) if rate is not None)
+        return "Pixels per CPU second: {}, subprocess overhead={}s".format(rates, self.subprocess_overhead)
+
+    def get_json(self):
+        """Return object details in json, to build the same model with ThroughputModel(**json)
+
+        :return: json object describing the throughput model
+        :rtype: dict
+        """
+        return {'pixels_per_second': dict(self.pixels_per_second), 'subprocess_overhead': self.subprocess_overhead}
+
+    def get_cpu_seconds(self, task, pixels):
+        """Estimate the CPU time of a task
+
+        :param task: The task class
+        :type task: type
+        :param pixels: The pixels processed by the task
+        :type pixels: float
+        :return: The estimated CPU time (in seconds)
+        :rtype: float
+        """
+        cpu_seconds = self.subprocess_overhead*task.subprocess_count
+        rate = self.pixels_per_second.get(task.__name__)
+        if rate is not None and rate > 0:
+            cpu_seconds += pixels/rate
+        return cpu_seconds
+
+    def calibrate(self, plan, task_statistics):
+        """Measure the throughput of every task from a run of a plan
+
+        A task throughput is only updated when every planned task of this name was run (no result store hit) and its measured CPU time is above the subprocess overhead.
+
+        :param plan: The plan of the run
+        :type plan: plan_providers.Plan
+        :param task_statistics: The statistics of the tasks of the run, like the "tasks" of the analysis instrumentation
+        :type task_statistics: dict[]
+        :return: The names of the updated tasks
+        :rtype: str[]
+        """
+        planned = {}
+        for job in plan.jobs:
+            for task in job['tasks']:
+                count, pixels, subprocesses = planned.get(task['task'], (0, 0, 0))
+                planned[task['task']] = (count + 1, pixels + task['pixels'], subprocesses + task['subprocesses'])
+
+        measured = {}
+        for statistics in task_statistics:
+            if statistics['user_time'] is None or statistics['system_time'] is None:
+                continue
+            count, cpu_seconds = measured.get(statistics['task'], (0, 0.0))
+            measured[statistics['task']] = (count + 1, cpu_seconds + statistics['user_time'] + statistics['system_time'])
+
+        updated_tasks = []
+        for task, (count, pixels, subprocesses) in planned.items():
+            if task not in measured or measured[task][0] != count or pixels <= 0:
+                continue
+            cpu_seconds = measured[task][1] - self.subprocess_overhead*subprocesses
+            if cpu_seconds > 0:
+                self.pixels_per_second[task] = pixels/cpu_seconds
+                updated_tasks.append(task)
+        return sorted(updated_tasks)
+
+
+class Plan(object):
+    """This class defines the estimated job graph of an analysis, expanded from its parameters without running it
+
+    The jobs only describe the tasks and their costs, to check or calibrate a run. Running the plan replays the analyzer process call
+    with the planned parameters, which expands the same jobs again.
+    """
+
+    def __init__(self, analyzer, parameters, throughput=None):
+        """Plan initialization
+
+        :param analyzer: The analyzer running the plan
+        :type analyzer: per_title_analysis.Analyzer
+        :param parameters: The keyword arguments of the analyzer process call, without the workers and the executor
+        :type parameters: dict
+        :param throughput: The CPU cost model of the tasks ('None' value is the default throughput)
+        :type throughput: plan_providers.ThroughputModel
+        """
+        if throughput is None:
+            throughput = ThroughputModel()
+
+        self.analyzer = analyzer
+        self.parameters = parameters
+        self.throughput = throughput
+
+        # Job descriptions in submission order, a job only depends on jobs before it
+        self.jobs = []
+
+    def __str__(self):
+        """Display the plan informations
+
+        :return: human readable string describing the plan totals
+        :rtype: str
+        """
+        totals = self.get_totals()
+        return "Plan of {} jobs, {} subprocesses, {:.1f} CPU seconds, {:.1f} encoded seconds, {} scratch bytes per job at most, {} pinned scratch bytes".format(
+            totals['jobs'], totals['subprocesses'], totals['cpu_seconds'], totals['encoded_seconds'], totals['max_job_scratch_bytes'], totals['pinned_scratch_bytes'])
+
+    def add_job(self, function, tasks, scratch_bytes=0, depends_on=None, pinned=False):
+        """Add a job: a task function call running tasks
+
+        :param function: The task function name, like "_crf_encode_part"
+        :type function: str
+        :param tasks: The (task class, processed pixels, encoded duration in seconds) of every task of the job, with the thread slots of the task
+                      (the thread counts it reserves in a governor budget, like MultiCbrEncode.get_thread_slots) as an optional fourth value
+        :type tasks: tuple[]
+        :param scratch_bytes: Scratch space reserved by the job (in bytes)
+        :type scratch_bytes: float
+        :param depends_on: Indexes of the jobs which must be done before this job ('None' value is no dependency)
+        :type depends_on: int[]
+        :param pinned: The scratch space is held until the end of the analysis
+        :type pinned: bool
+        :return: The job index
+        :rtype: int
+        """
+        job = {}
+        job['job_index'] = len(self.jobs)
+        job['function'] = function
+        job['depends_on'] = list(depends_on or [])
+        job['tasks'] = []
+        for task_values in tasks:
+            task, pixels, encoded_duration = task_values[:3]
+            thread_slots = task_values[3] if len(task_values) > 3 else task.subprocess_count
+            job['tasks'].append({'task': task.__name__, 'phase': task.phase, 'pixels': pixels, 'encoded_duration': encoded_duration,
+                                 'subprocesses': task.subprocess_count, 'thread_slots': thread_slots if task.threaded is True else 0,
+                                 'cpu_seconds': self.throughput.get_cpu_seconds(task, pixels)})
+        job['subprocesses'] = sum(task['subprocesses'] for task in job['tasks'])
+        job['thread_slots'] = max([task['thread_slots'] for task in job['tasks']] or [0])
+        job['cpu_seconds'] = sum(task['cpu_seconds'] for task in job['tasks'])
+        job['encoded_seconds'] = sum(task['encoded_duration'] for task in job['tasks'])
+        job['scratch_bytes'] = int(scratch_bytes)
+        job['pinned'] = pinned
+        self.jobs.append(job)
+        return job['job_index']
+
+    def get_totals(self):
+        """Sum the estimated costs of the jobs
+
+        :return: The number of jobs and subprocesses, the CPU and encoded seconds (with the CPU seconds per phase), the most thread slots of a job,
+                 the largest scratch space of a job and the pinned scratch space
+        :rtype: dict
+        """
+        totals = {}
+        totals['jobs'] = len(self.jobs)
+        totals['subprocesses'] = sum(job['subprocesses'] for job in self.jobs)
+        totals['cpu_seconds'] = sum(job['cpu_seconds'] for job in self.jobs)
+        totals['encoded_seconds'] = sum(job['encoded_seconds'] for job in self.jobs)
+        totals['max_job_thread_slots'] = max([job['thread_slots'] for job in self.jobs] or [0])
+        totals['max_job_scratch_bytes'] = max([job['scratch_bytes'] for job in self.jobs if job['pinned'] is False] or [0])
+        totals['pinned_scratch_bytes'] = sum(job['scratch_bytes'] for job in self.jobs if job['pinned'] is True)
+        totals['phase_cpu_seconds'] = {}
+        for job in self.jobs:
+            for task in job['tasks']:
+                totals['phase_cpu_seconds'][task['phase']] = totals['phase_cpu_seconds'].get(task['phase'], 0) + task['cpu_seconds']
+        return totals
+
+    def get_scratch_bytes(self, max_workers=1):
+        """Estimate the peak scratch space of a run: the pinned space plus the largest jobs running at the same time
+
+        :param max_workers: Number of jobs run at the same time
+        :type max_workers: int
+        :return: The peak scratch space (in bytes)
+        :rtype: int
+        """
+        job_scratch_bytes = sorted((job['scratch_bytes'] for job in self.jobs if job['pinned'] is False), reverse=True)
+        return sum(job_scratch_bytes[:max(int(max_workers or 1), 1)]) + self.get_totals()['pinned_scratch_bytes']
+
+    def check(self, max_cpu_seconds=None, max_scratch_bytes=None, max_workers=1):
+        """Reject a plan more expensive than the limits
+
+        :param max_cpu_seconds: Maximum estimated CPU time ('None' value is no limit)
+        :type max_cpu_seconds: float
+        :param max_scratch_bytes: Maximum estimated peak scratch space, for max_workers jobs at the same time ('None' value is no limit)
+        :type max_scratch_bytes: int
+        :param max_workers: Number of jobs run at the same time
+        :type max_workers: int
+        :raises ValueError: the plan exceeds a limit
+        """
+        totals = self.get_totals()
+        if max_cpu_seconds is not None and totals['cpu_seconds'] > max_cpu_seconds:
+            raise ValueError('The plan needs {:.1f} CPU seconds, more than the limit of {}'.format(totals['cpu_seconds'], max_cpu_seconds))
+        scratch_bytes = self.get_scratch_bytes(max_workers)
+        if max_scratch_bytes is not None and scratch_bytes > max_scratch_bytes:
+            raise ValueError('The plan needs {} scratch bytes, more than the limit of {}'.format(scratch_bytes, max_scratch_bytes))
+
+    def get_json(self):
+        """Return object details in json
+
+        :return: json object describing the plan parameters, jobs, totals and throughput model
+        :rtype: dict
+        """
+        plan = {}
+        plan['input_file_path'] = self.analyzer.input_file_path
+        plan['method'] = type(self.analyzer).__name__
+        plan['parameters'] = dict((key, value.get_json() if hasattr(value, 'get_json') else value) for key, value in self.parameters.items())
+        plan['throughput'] = self.throughput.get_json()
+        plan['totals'] = self.get_totals()
+        plan['jobs'] = self.jobs
+        return plan
+
+    def run(self, max_workers=None, executor=None):
+        """Run the planned analysis: a replay of the analyzer process call with the planned parameters, the jobs are not used
+
+        The analyzer expands the jobs again from the parameters, so a plan is only as current as the input and the result store
+        (a result store hit skips a planned task).
+
+        :param max_workers: Size of the thread pool created when no executor is given ('None' or 1 runs in series)
+        :type max_workers: int
+        :param executor: A concurrent.futures executor (thread, process or spool pool) running the tasks of the analysis
+        :type executor: concurrent.futures.Executor
+        :return: json object describing the analysis
+        :rtype: dict
+        """
+        self.analyzer.process(max_workers=max_workers, executor=executor, **self.parameters)
+        return self.analyzer.json['analyses'][-1]
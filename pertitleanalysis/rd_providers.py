@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of bitrates (geometrically spaced) where the curves are compared to build the convex hull
+HULL_GRID_POINTS = 64
+
+
+def fit_log_curves(profile_points):
+    """Fit a rate-distortion curve metric_value = intercept + slope*ln(bitrate) on the assessed points of every profile, all the profiles at once
+
+    :param profile_points: The (bitrate, metric_value) points of every profile
+    :type profile_points: tuple[][]
+    :return: The (intercept, slope, residual_error) of every profile curve, 'None' value for a profile with less than 2 distinct bitrates
+    :rtype: tuple[]
+    """
+    curves = [None] * len(profile_points)
+    if len(profile_points) == 0:
+        return curves
+
+    if numpy is not None:
+        # Points padded to the same count, the padding has a null weight
+        max_points = max(max(len(points) for points in profile_points), 1)
+        log_bitrates = numpy.zeros((len(profile_points), max_points))
+        values = numpy.zeros((len(profile_points), max_points))
+        weights = numpy.zeros((len(profile_points), max_points))
+        for i, points in enumerate(profile_points):
+            for j, (bitrate, metric_value) in enumerate(points):
+                log_bitrates[i, j] = math.log(bitrate)
+                values[i, j] = metric_value
+                weights[i, j] = 1
+
+        counts = weights.sum(axis=1)
+        safe_counts = numpy.maximum(counts, 1)
+        mean_log_bitrates = (weights*log_bitrates).sum(axis=1)/safe_counts
+        mean_values = (weights*values).sum(axis=1)/safe_counts
+        centered_log_bitrates = weights*(log_bitrates - mean_log_bitrates[:, None])
+        sum_squares = (centered_log_bitrates**2).sum(axis=1)
+        fitted = (counts >= 2) & (sum_squares > 0)
+
+        slopes = (centered_log_bitrates*(values - mean_values[:, None])).sum(axis=1)/numpy.where(fitted, sum_squares, 1)
+        intercepts = mean_values - slopes*mean_log_bitrates
+        residuals = weights*(values - intercepts[:, None] - slopes[:, None]*log_bitrates)
+        residual_errors = numpy.sqrt((residuals**2).sum(axis=1)/safe_counts)
+
+        for i in numpy.flatnonzero(fitted):
+            curves[i] = (float(intercepts[i]), float(slopes[i]), float(residual_errors[i]))
+        return curves
+
+    for i, points in enumerate(profile_points):
+        if len(points) < 2:
+            continue
+        log_bitrates = [math.log(bitrate) for bitrate, metric_value in points]
+        values = [metric_value for bitrate, metric_value in points]
+        mean_log_bitrate = math.fsum(log_bitrates)/len(points)
+        mean_value = math.fsum(values)/len(points)
+        sum_squares = math.fsum((x - mean_log_bitrate)**2 for x in log_bitrates)
+        if sum_squares == 0:
+            continue
+        slope = math.fsum((x - mean_log_bitrate)*(y - mean_value) for x, y in zip(log_bitrates, values))/sum_squares
+        intercept = mean_value - slope*mean_log_bitrate
+        residual_error = math.sqrt(math.fsum((y - intercept - slope*x)**2 for x, y in zip(log_bitrates, values))/len(points))
+        curves[i] = (intercept, slope, residual_error)
+    return curves
+
+
+def get_hull_grid(bitrate_ranges, points=HULL_GRID_POINTS):
+    """Get geometrically spaced bitrates covering the bitrate ranges of every profile
+
+    :param bitrate_ranges: The (bitrate min, bitrate max) of every profile
+    :type bitrate_ranges: tuple[]
+    :param points: Number of bitrates
+    :type points: int
+    :return: The sorted bitrates
+    :rtype: float[]
+    """
+    low = max(min(bitrate_min for bitrate_min, bitrate_max in bitrate_ranges), 1)
+    high = max(max(bitrate_max for bitrate_min, bitrate_max in bitrate_ranges), low)
+    if points < 2 or high == low:
+        return [low]
+    return [low*(high/low)**(i/(points - 1)) for i in range(points)]
+
+
+def get_convex_hull(curves, bitrate_ranges, bitrates):
+    """Get the rate-distortion convex hull of the profile curves: the best profile at every bitrate, then the upper concave envelope of these points
+
+    A log curve does not saturate, so every curve is only evaluated inside the bitrate range of its assessed points.
+
+    :param curves: The (intercept, slope, residual_error) of every profile curve, 'None' value for no curve
+    :type curves: tuple[]
+    :param bitrate_ranges: The (lowest, highest) assessed bitrate of every profile
+    :type bitrate_ranges: tuple[]
+    :param bitrates: The sorted bitrates where the curves are compared
+    :type bitrates: float[]
+    :return: The (bitrate, metric_value, profile index) points of the hull, sorted by bitrate
+    :rtype: tuple[]
+    """
+    if numpy is not None:
+        grid = numpy.asarray(bitrates, dtype=numpy.float64)
+        intercepts = numpy.array([curve[0] if curve is not None else 0.0 for curve in curves])
+        slopes = numpy.array([curve[1] if curve is not None else 0.0 for curve in curves])
+        lows = numpy.array([low for low, high in bitrate_ranges], dtype=numpy.float64)
+        highs = numpy.array([high for low, high in bitrate_ranges], dtype=numpy.float64)
+        valid = numpy.array([curve is not None for curve in curves])
+
+        values = intercepts[:, None] + slopes[:, None]*numpy.log(grid)[None, :]
+        inside = valid[:, None] & (grid[None, :] >= lows[:, None]) & (grid[None, :] <= highs[:, None])
+        values = numpy.where(inside, values, -numpy.inf)
+        best_profiles = values.argmax(axis=0)
+        best_values = values[best_profiles, numpy.arange(len(grid))]
+        candidates = [(float(grid[j]), float(best_values[j]), int(best_profiles[j])) for j in range(len(grid)) if numpy.isfinite(best_values[j])]
+    else:
+        candidates = []
+        for bitrate in bitrates:
+            best = None
+            for profile_index, (curve, (low, high)) in enumerate(zip(curves, bitrate_ranges)):
+                if curve is None or bitrate < low or bitrate > high:
+                    continue
+                metric_value = curve[0] + curve[1]*math.log(bitrate)
+                if best is None or metric_value > best[1]:
+                    best = (bitrate, metric_value, profile_index)
+            if best is not None:
+                candidates.append(best)
+
+    # Upper hull with a monotone chain, a point under the segment of its neighbours is not on the hull
+    hull = []
+    for point in candidates:
+        while len(hull) >= 2 and (hull[-1][0] - hull[-2][0])*(point[1] - hull[-2][1]) - (hull[-1][1] - hull[-2][1])*(point[0] - hull[-2][0]) >= 0:
+            hull.pop()
+        hull.append(point)
+    return hull
+
+
+def get_hull_ladder(curves, hull, encoding_profiles):
+    """Pick a ladder rung bitrate for every profile from the convex hull
+
+    A profile on the hull gets the bitrate where the next profile takes over. The top profile of the hull gets the knee of its curve,
+    where its slope falls under the average slope of the hull. The rungs are bounded by the bitrate min and max of their profile.
+    A profile which is not on the hull is removed, unless it is required: it then gets the geometric mean of the rungs of the next lower
+    and next higher definitions (its bitrate min or max when there is none), so that the ladder bitrates still grow with the definitions.
+
+    :param curves: The (intercept, slope, residual_error) of every profile curve, 'None' value for no curve
+    :type curves: tuple[]
+    :param hull: The (bitrate, metric_value, profile index) points of the hull, sorted by bitrate
+    :type hull: tuple[]
+    :param encoding_profiles: The encoding profiles, in the curves order
+    :type encoding_profiles: per_title.EncodingProfile[]
+    :return: The (rung bitrate, hull bitrate range) of every profile, 'None' value for a removed profile and for the hull range of a required profile off the hull
+    :rtype: tuple[]
+    """
+    hull_ranges = {}
+    for bitrate, metric_value, profile_index in hull:
+        low, high = hull_ranges.get(profile_index, (bitrate, bitrate))
+        hull_ranges[profile_index] = (min(low, bitrate), max(high, bitrate))
+
+    top_profile_index = hull[-1][2] if len(hull) > 0 else None
+    hull_slope = None
+    if len(hull) >= 2 and hull[-1][0] > hull[0][0]:
+        hull_slope = (hull[-1][1] - hull[0][1])/(hull[-1][0] - hull[0][0])
+
+    rungs = [None] * len(encoding_profiles)
+    off_hull_profile_indexes = []
+    for profile_index, encoding_profile in enumerate(encoding_profiles):
+        hull_range = hull_ranges.get(profile_index)
+        if hull_range is None:
+            if encoding_profile.required is True:
+                off_hull_profile_indexes.append(profile_index)
+            continue
+
+        bitrate = hull_range[1]
+        if profile_index == top_profile_index and hull_slope is not None and hull_slope > 0 and curves[profile_index][1] > 0:
+            # The slope of the log curve is slope/bitrate
+            bitrate = min(max(curves[profile_index][1]/hull_slope, hull_range[0]), hull_range[1])
+
+        bitrate = int(min(max(bitrate, encoding_profile.bitrate_min), encoding_profile.bitrate_max))
+        rungs[profile_index] = (bitrate, [hull_range[0], hull_range[1]])
+
+    # The required profiles off the hull are placed from the lowest definition, so that each one sees the previous ones as neighbours
+    for profile_index in sorted(off_hull_profile_indexes, key=lambda index: encoding_profiles[index].width*encoding_profiles[index].height):
+        encoding_profile = encoding_profiles[profile_index]
+        pixels = encoding_profile.width*encoding_profile.height
+        lower_bitrates = [rung[0] for index, rung in enumerate(rungs) if rung is not None and encoding_profiles[index].width*encoding_profiles[index].height < pixels]
+        upper_bitrates = [rung[0] for index, rung in enumerate(rungs) if rung is not None and encoding_profiles[index].width*encoding_profiles[index].height > pixels]
+        low = max(lower_bitrates) if len(lower_bitrates) > 0 else encoding_profile.bitrate_min
+        high = min(upper_bitrates) if len(upper_bitrates) > 0 else encoding_profile.bitrate_max
+        bitrate = math.sqrt(max(low, 1)*max(high, low, 1))
+        rungs[profile_index] = (int(min(max(bitrate, encoding_profile.bitrate_min), encoding_profile.bitrate_max)), None)
+    return rungs
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+import os
+import threading
+from contextlib import contextmanager
+
+# CPU quota files of the cgroup v2 and v1 hierarchies
+CGROUP_V2_CPU_MAX = '/sys/fs/cgroup/cpu.max'
+CGROUP_V1_CPU_QUOTA = '/sys/fs/cgroup/cpu/cpu.cfs_quota_us'
+CGROUP_V1_CPU_PERIOD = '/sys/fs/cgroup/cpu/cpu.cfs_period_us'
+
+
+def get_cgroup_cpu_quota():
+    """Get the CPU quota of the cgroup of the process (like a container CPU limit)
+
+    :return: The quota in CPUs, 'None' value is no quota
+    :rtype: float
+    """
+    try:
+        with open(CGROUP_V2_CPU_MAX, 'r') as cpu_max_file:
+            quota, period = cpu_max_file.read().split()[:2]
+        if quota == 'max':
+            return None
+        return int(quota)/int(period)
+    except (IOError, OSError, ValueError):
+        pass
+
+    try:
+        with open(CGROUP_V1_CPU_QUOTA, 'r') as quota_file:
+            quota = int(quota_file.read())
+        with open(CGROUP_V1_CPU_PERIOD, 'r') as period_file:
+            period = int(period_file.read())
+        if quota <= 0 or period <= 0:
+            return None
+        return quota/period
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def get_cpu_count():
+    """Get the number of CPUs the process can use: its CPU affinity, bounded by the cgroup CPU quota
+
+    :return: The number of CPUs, at least 1
+    :rtype: int
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cpu_count = len(os.sched_getaffinity(0))
+    else:
+        cpu_count = os.cpu_count() or 1
+
+    quota = get_cgroup_cpu_quota()
+    if quota is not None:
+        # Rounded down, so that the tasks are not throttled by the quota
+        cpu_count = min(cpu_count, int(quota))
+
+    return max(cpu_count, 1)
+
+
+class ThreadGovernor(object):
+    """This class defines a CPU thread budget: every ffmpeg process is given a thread count, and only starts when the budget has room for it"""
+
+    def __init__(self, cpus=None, threads_per_task='narrow'):
+        """ThreadGovernor initialization
+
+        :param cpus: The thread budget ('None' value is the CPUs of the process, bounded by the cgroup CPU quota)
+        :type cpus: int
+        :param threads_per_task: "narrow" runs many single thread processes (best throughput), "wide" runs one process using every CPU (best latency), or a thread count
+        :type threads_per_task: str or int
+        """
+        if cpus is None:
+            cpus = get_cpu_count()
+        if int(cpus) < 1:
+            raise ValueError('The ThreadGovernor.cpus value must be positive')
+        self.cpus = int(cpus)
+
+        if threads_per_task == 'narrow':
+            threads_per_task = 1
+        elif threads_per_task == 'wide':
+            threads_per_task = self.cpus
+        elif int(threads_per_task) < 1:
+            raise ValueError('Available threads per task are "narrow", "wide" or a positive thread count, does not include: {}'.format(threads_per_task))
+        self.threads_per_task = min(int(threads_per_task), self.cpus)
+
+        self.reserved_threads = 0
+        self.condition = threading.Condition()
+
+    def __str__(self):
+        """Display the governor informations
+
+        :return: human readable string describing the thread budget usage
+        :rtype: str
+        """
+        return "{} threads per task, reserved threads={}, cpus={}".format(self.threads_per_task, self.reserved_threads, self.cpus)
+
+    def __getstate__(self):
+        """Pickle the governor for process pools, the budget is then limited per process"""
+        state = self.__dict__.copy()
+        del state['condition']
+        state['reserved_threads'] = 0
+        return state
+
+    def __setstate__(self, state):
+        """Unpickle the governor"""
+        self.__dict__.update(state)
+        self.condition = threading.Condition()
+
+    def get_max_tasks(self):
+        """Get the number of single process tasks running at the same time within the budget, a good max_workers value
+
+        :return: The number of tasks
+        :rtype: int
+        """
+        return max(self.cpus//self.threads_per_task, 1)
+
+    def acquire(self, threads, wait=True):
+        """Reserve threads of the budget, waiting while the budget is used by other tasks
+
+        A reservation larger than the budget waits for the whole budget.
+
+        :param threads: The thread count of the task subprocesses
+        :type threads: int
+        :param wait: Wait for the budget (False for the asyncio tasks, which poll without blocking the event loop)
+        :type wait: bool
+        :return: The threads are reserved, to be released with ThreadGovernor.release
+        :rtype: bool
+        """
+        threads = min(threads, self.cpus)
+        with self.condition:
+            while self.reserved_threads + threads > self.cpus:
+                if wait is False:
+                    return False
+                self.condition.wait()
+            self.reserved_threads += threads
+        return True
+
+    def release(self, threads):
+        """Release threads reserved by ThreadGovernor.acquire
+
+        :param threads: The thread count of the task subprocesses
+        :type threads: int
+        """
+        threads = min(threads, self.cpus)
+        with self.condition:
+            self.reserved_threads -= threads
+            self.condition.notify_all()
+
+    @contextmanager
+    def reserve(self, threads):
+        """Reserve threads of the budget while a task runs, waiting while the budget is used by other tasks
+
+        :param threads: The thread count of the task subprocesses
+        :type threads: int
+
+        See ThreadGovernor.acquire for the waiting rules.
+        """
+        self.acquire(threads)
+        try:
+            yield
+        finally:
+            self.release(threads)
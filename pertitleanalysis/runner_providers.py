@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import signal
+import threading
+import subprocess
+from contextlib import contextmanager
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = None
+
+# Size of the stderr end kept in the task errors (in bytes)
+STDERR_TAIL_SIZE = 2048
+
+# Unit of the rusage max resident set size (in bytes) and of the block input/output counts
+MAX_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+IO_BLOCK_SIZE = 512
+
+# The task statistics callback of the current collector: per asyncio task and per thread with contextvars (Python 3.7+), else per thread
+if ContextVar is not None:
+    _statistics_collector = ContextVar('statistics_collector', default=None)
+else:
+    _statistics_collector = threading.local()
+
+
+class TaskError(Exception):
+    """This class defines a failed task, with the exit code and the end of the stderr of its subprocess"""
+
+    def __init__(self, message, command=None, returncode=None, stderr=None):
+        """TaskError initialization
+
+        :param message: What failed
+        :type message: str
+        :param command: Arguments array of the failed subprocess ('None' value is no subprocess)
+        :type command: str[]
+        :param returncode: Exit code of the failed subprocess ('None' value is not exited)
+        :type returncode: int
+        :param stderr: The stderr output of the failed subprocess, only its end is kept
+        :type stderr: bytes
+        """
+        self.command = command
+        self.returncode = returncode
+        self.stderr_tail = (stderr or b'')[-STDERR_TAIL_SIZE:].decode('utf-8', 'replace')
+
+        details = message
+        if returncode is not None:
+            details += ', exit code {}'.format(returncode)
+        if command is not None:
+            details += ': {}'.format(' '.join(command))
+        if self.stderr_tail:
+            details += '\n' + self.stderr_tail
+        Exception.__init__(self, details)
+
+
+class TaskTimeoutError(TaskError):
+    """This class defines a task killed after its deadline"""
+
+
+class TaskOutputError(TaskError):
+    """This class defines a task whose output could not be parsed"""
+
+
+@contextmanager
+def collect_statistics(callback):
+    """Collect the statistics of the tasks run in the current thread (or asyncio task) until the end of the context
+
+    The thread pool threads do not inherit the collector, their task functions collect their own statistics.
+
+    :param callback: Called with the statistics of every task when it ends, failed or not
+    :type callback: callable
+    """
+    if ContextVar is not None:
+        token = _statistics_collector.set(callback)
+        try:
+            yield
+        finally:
+            _statistics_collector.reset(token)
+    else:
+        previous_callback = getattr(_statistics_collector, 'callback', None)
+        _statistics_collector.callback = callback
+        try:
+            yield
+        finally:
+            _statistics_collector.callback = previous_callback
+
+
+def record_statistics(statistics):
+    """Pass the statistics of a task to the current collector, if any
+
+    :param statistics: The task statistics
+    :type statistics: dict
+    """
+    if ContextVar is not None:
+        callback = _statistics_collector.get()
+    else:
+        callback = getattr(_statistics_collector, 'callback', None)
+    if callback is not None:
+        callback(statistics)
+
+
+def get_task_statistics(task):
+    """Get empty statistics for a task
+
+    :param task: The task
+    :type task: task_providers.Task
+    :return: The task name and phase, its attempts, wall time and subprocesses resource usage ('None' values are not measured)
+    :rtype: dict
+    """
+    statistics = {}
+    statistics['task'] = type(task).__name__
+    statistics['phase'] = task.phase
+    statistics['attempts'] = 0
+    statistics['wall_time'] = 0.0
+    statistics['user_time'] = None
+    statistics['system_time'] = None
+    statistics['max_rss'] = None
+    statistics['read_bytes'] = None
+    statistics['write_bytes'] = None
+    return statistics
+
+
+def add_resource_usage(statistics, rusage):
+    """Add the resource usage of a subprocess to task statistics
+
+    :param statistics: The task statistics
+    :type statistics: dict
+    :param rusage: The subprocess resource usage ('None' value is not measured)
+    :type rusage: resource.struct_rusage
+    """
+    if rusage is None:
+        return
+    statistics['user_time'] = (statistics['user_time'] or 0) + rusage.ru_utime
+    statistics['system_time'] = (statistics['system_time'] or 0) + rusage.ru_stime
+    statistics['max_rss'] = max(statistics['max_rss'] or 0, rusage.ru_maxrss*MAX_RSS_UNIT)
+    statistics['read_bytes'] = (statistics['read_bytes'] or 0) + rusage.ru_inblock*IO_BLOCK_SIZE
+    statistics['write_bytes'] = (statistics['write_bytes'] or 0) + rusage.ru_oublock*IO_BLOCK_SIZE
+
+
+def wait_process(proc):
+    """Wait for a subprocess to exit and get its own resource usage
+
+    :param proc: The subprocess
+    :type proc: subprocess.Popen
+    :return: The subprocess resource usage ('None' value is not available on this platform)
+    :rtype: resource.struct_rusage
+    """
+    if not hasattr(os, 'wait4') or proc.returncode is not None:
+        proc.wait()
+        return None
+
+    try:
+        _, status, rusage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        # Already reaped
+        proc.wait()
+        return None
+
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return rusage
+
+
+def kill_process_group(proc):
+    """Kill a subprocess started in its own session, with all its children
+
+    :param proc: The subprocess
+    :type proc: subprocess.Popen or asyncio.subprocess.Process
+    """
+    # An exited subprocess.Popen is not polled, so that it is still reaped with its resource usage
+    if proc.returncode is not None:
+        return
+    try:
+        if os.name == 'posix':
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except OSError:
+        # Already exited
+        pass
+
+
+class TaskRunner(object):
+    """This class defines how the subprocess of a task is run: deadline, bounded retries with backoff and process group kill"""
+
+    def __init__(self, timeout=None, retries=0, backoff=1.0, max_backoff=30.0, governor=None):
+        """TaskRunner initialization
+
+        :param timeout: Deadline of every subprocess attempt (in seconds, 'None' value is no deadline)
+        :type timeout: float
+        :param retries: Number of new attempts after a failed or timed out attempt
+        :type retries: int
+        :param backoff: Wait before the first new attempt, doubled for every next one (in seconds)
+        :type backoff: float
+        :param max_backoff: Maximum wait before a new attempt (in seconds)
+        :type max_backoff: float
+        :param governor: Assigns the thread count of the encoding, decoding and assessment processes, and starts them only within its thread budget ('None' value lets ffmpeg choose)
+        :type governor: resource_providers.ThreadGovernor
+        """
+        if timeout is not None and timeout <= 0:
+            raise ValueError('The TaskRunner.timeout value must be positive')
+        if int(retries) < 0:
+            raise ValueError('The TaskRunner.retries value cannot be negative')
+
+        self.timeout = timeout
+        self.retries = int(retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.governor = governor
+
+    def __str__(self):
+        """Display the task runner informations
+
+        :return: human readable string describing the task runner configuration
+        :rtype: str
+        """
+        return "timeout={}, retries={}, backoff={}, max_backoff={}, governor=({})".format(self.timeout, self.retries, self.backoff, self.max_backoff, self.governor)
+
+    def get_threads(self):
+        """Get the thread count of every subprocess of a threaded task
+
+        :return: The thread count, 'None' value lets ffmpeg choose
+        :rtype: int
+        """
+        if self.governor is None:
+            return None
+        return self.governor.threads_per_task
+
+    def get_backoff(self, attempt):
+        """Get the wait before a new attempt
+
+        :param attempt: Number of the new attempt (1 is the first retry)
+        :type attempt: int
+        :return: The wait (in seconds)
+        :rtype: float
+        """
+        return min(self.backoff*2**(attempt - 1), self.max_backoff)
+
+    def run(self, task, command, stdout_line_handler=None):
+        """Run the subprocess of a task, retrying the failed and timed out attempts
+
+        :param task: The task running the subprocess, its subprocess_pid, subprocess_out and subprocess_err are set
+        :type task: task_providers.Task
+        :param command: Arguments array for the subprocess task
+        :type command: str[]
+        :param stdout_line_handler: Called with every stdout line while the task runs, the stdout is then not kept ('None' value keeps the whole stdout)
+        :type stdout_line_handler: callable
+        """
+        self.retry(task, lambda: self.run_once(task, command, stdout_line_handler))
+
+    def retry(self, task, attempt_function):
+        """Call an attempt function until it succeeds or the retries are exhausted, then record the task statistics
+
+        :param task: The task, prepared before every new attempt, its statistics are set
+        :type task: task_providers.Task
+        :param attempt_function: Runs one attempt, adding its resource usage to the task statistics and raising a TaskError on failure
+        :type attempt_function: callable
+        :raises TaskError: the last attempt failed
+        """
+        task.statistics = get_task_statistics(task)
+        start_time = time.time()
+        try:
+            return self.retry_attempts(task, attempt_function)
+        finally:
+            task.statistics['wall_time'] = time.time() - start_time
+            record_statistics(task.statistics)
+
+    def retry_attempts(self, task, attempt_function):
+        """Call an attempt function until it succeeds or the retries are exhausted
+
+        :param task: The task, prepared before every new attempt
+        :type task: task_providers.Task
+        :param attempt_function: Runs one attempt, raising a TaskError on failure
+        :type attempt_function: callable
+        :raises TaskError: the last attempt failed
+        """
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.get_backoff(attempt))
+                task.prepare_retry()
+            task.statistics['attempts'] += 1
+            try:
+                return self.run_attempt(task, attempt_function)
+            except TaskError:
+                if attempt == self.retries:
+                    raise
+
+    def run_attempt(self, task, attempt_function):
+        """Call an attempt function once the governor has room for the threads of the task
+
+        See TaskRunner.retry_attempts for the parameters.
+        """
+        threads = task.get_reserved_threads()
+        if self.governor is None or threads is None:
+            return attempt_function()
+        with self.governor.reserve(threads):
+            return attempt_function()
+
+    def start_deadline(self, timed_out, procs):
+        """Start a timer killing the subprocesses at the deadline
+
+        :param timed_out: Set when the deadline is reached
+        :type timed_out: threading.Event
+        :param procs: The subprocesses of the attempt
+        :type procs: subprocess.Popen[]
+        :return: The timer, to be cancelled when the subprocesses exit
+        :rtype: threading.Timer
+        """
+        def kill():
+            timed_out.set()
+            for proc in procs:
+                kill_process_group(proc)
+
+        timer = threading.Timer(self.timeout, kill)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def run_once(self, task, command, stdout_line_handler=None):
+        """Run the subprocess of a task once
+
+        :raises TaskTimeoutError: the subprocess was killed after the deadline
+        :raises TaskError: the subprocess exited with an error
+
+        See TaskRunner.run for the parameters.
+        """
+        proc = subprocess.Popen(command, stderr=subprocess.PIPE, stdout=subprocess.PIPE, start_new_session=(os.name == 'posix'))
+        task.subprocess_pid = proc.pid
+
+        timed_out = threading.Event()
+        timer = None
+        if self.timeout is not None:
+            timer = self.start_deadline(timed_out, [proc])
+
+        try:
+            # Drain the stderr while the stdout is read or streamed
+            subprocess_err = []
+            stderr_reader = threading.Thread(target=lambda: subprocess_err.append(proc.stderr.read()))
+            stderr_reader.start()
+            if stdout_line_handler is None:
+                task.subprocess_out = proc.stdout.read()
+            else:
+                for line in proc.stdout:
+                    stdout_line_handler(line)
+            stderr_reader.join()
+            task.subprocess_err = subprocess_err[0]
+        except BaseException:
+            # Interrupted or failing line handler: do not leave the subprocess running
+            kill_process_group(proc)
+            raise
+        finally:
+            proc.stdout.close()
+            add_resource_usage(task.statistics, wait_process(proc))
+            if timer is not None:
+                timer.cancel()
+
+        if timed_out.is_set():
+            raise TaskTimeoutError('Task timed out after {} seconds'.format(self.timeout), command, proc.returncode, task.subprocess_err)
+        if proc.returncode != 0:
+            raise TaskError('Task failed', command, proc.returncode, task.subprocess_err)
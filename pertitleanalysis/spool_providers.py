@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import uuid
+import pickle
+import socket
+import threading
+import itertools
+from concurrent.futures import Executor, Future
+
+# Spool subdirectories: jobs waiting for a worker, jobs run by a worker and results waiting for their coordinator
+PENDING_DIRECTORY = 'pending'
+CLAIMED_DIRECTORY = 'claimed'
+RESULTS_DIRECTORY = 'results'
+
+
+def get_spool_directories(spool_directory):
+    """Create the subdirectories of a spool directory
+
+    :param spool_directory: The spool directory, on a storage shared by the coordinators and the workers
+    :type spool_directory: str
+    :return: The pending, claimed and results directories
+    :rtype: tuple
+    """
+    directories = tuple(os.path.join(spool_directory, name) for name in [PENDING_DIRECTORY, CLAIMED_DIRECTORY, RESULTS_DIRECTORY])
+    for directory in directories:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    return directories
+
+
+def write_spool_file(file_path, value):
+    """Write a pickled value to a spool file, renamed into place once complete
+
+    :param file_path: The spool file path
+    :type file_path: str
+    :param value: The value, it must be picklable
+    :type value: object
+    """
+    temporary_file_path = os.path.join(os.path.dirname(file_path), '.' + os.path.basename(file_path) + '.tmp')
+    with open(temporary_file_path, 'wb') as spool_file:
+        pickle.dump(value, spool_file, pickle.HIGHEST_PROTOCOL)
+        spool_file.flush()
+        os.fsync(spool_file.fileno())
+    os.rename(temporary_file_path, file_path)
+
+
+def read_spool_file(file_path):
+    """Read a pickled value from a spool file
+
+    :param file_path: The spool file path
+    :type file_path: str
+    :return: The value
+    :rtype: object
+    """
+    with open(file_path, 'rb') as spool_file:
+        return pickle.load(spool_file)
+
+
+class SpoolExecutor(Executor):
+    """This class defines an executor handing the task functions out to workers on other hosts, through a spool directory on shared storage
+
+    The jobs and results are pickled files: the spool directory must only be writable by trusted hosts.
+    The input, reference and result store files must be available to the workers at the same paths.
+    The workers write their temporary files to their own scratch directory, so a reference cache (held by the coordinator) cannot be used.
+    """
+
+    def __init__(self, spool_directory, lease_timeout=60.0, max_attempts=3, poll_interval=0.2):
+        """SpoolExecutor initialization
+
+        :param spool_directory: The spool directory, on a storage shared by the coordinators and the workers
+        :type spool_directory: str
+        :param lease_timeout: A claimed job is requeued when its worker heartbeat is older (in seconds)
+        :type lease_timeout: float
+        :param max_attempts: Number of workers a job is handed out to before failing, when the workers are lost
+        :type max_attempts: int
+        :param poll_interval: Wait between two scans of the results and of the claimed jobs (in seconds)
+        :type poll_interval: float
+        """
+        if lease_timeout <= 0:
+            raise ValueError('The SpoolExecutor.lease_timeout value must be positive')
+        if int(max_attempts) < 1:
+            raise ValueError('The SpoolExecutor.max_attempts value must be positive')
+
+        self.spool_directory = spool_directory
+        self.pending_directory, self.claimed_directory, self.results_directory = get_spool_directories(spool_directory)
+        self.lease_timeout = lease_timeout
+        self.max_attempts = int(max_attempts)
+        self.poll_interval = poll_interval
+
+        # The job names start with the coordinator id, so that many coordinators can share the spool
+        self.coordinator_id = uuid.uuid4().hex[:12]
+        self.job_numbers = itertools.count()
+
+        # Futures and handed out attempts of the jobs without result, by job id
+        self.futures = {}
+        self.attempts = {}
+        self.lock = threading.Lock()
+        self.is_shutdown = False
+        self.poller = None
+
+    def __str__(self):
+        """Display the executor informations
+
+        :return: human readable string describing the spool and the jobs without result
+        :rtype: str
+        """
+        with self.lock:
+            return "{} (coordinator {}), {} jobs without result".format(self.spool_directory, self.coordinator_id, len(self.futures))
+
+    def submit(self, function, *args, **kwargs):
+        """Spool a task function call, run by the first free worker
+
+        :param function: A picklable task function (module level)
+        :type function: callable
+        :return: The future of the task function result
+        :rtype: concurrent.futures.Future
+        """
+        # Ordered by submission, for the first in first out order of the workers
+        job_id = '{:020d}_{}_{:08d}'.format(int(time.time()*1000000), self.coordinator_id, next(self.job_numbers))
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        with self.lock:
+            if self.is_shutdown is True:
+                raise RuntimeError('Cannot submit a job after the executor shutdown')
+            self.futures[job_id] = future
+            self.attempts[job_id] = 1
+            if self.poller is None:
+                self.poller = threading.Thread(target=self.poll)
+                self.poller.daemon = True
+                self.poller.start()
+
+        write_spool_file(os.path.join(self.pending_directory, job_id + '.job'), (function, args, kwargs))
+        return future
+
+    def poll(self):
+        """Collect the results and requeue the jobs of the lost workers, until the shutdown"""
+        while True:
+            with self.lock:
+                if self.is_shutdown is True and len(self.futures) == 0:
+                    return
+            self.collect_results()
+            self.requeue_lost_jobs()
+            time.sleep(self.poll_interval)
+
+    def collect_results(self):
+        """Resolve the futures of the returned results"""
+        for file_name in sorted(os.listdir(self.results_directory)):
+            job_id = file_name[:-len('.result')]
+            if not file_name.endswith('.result') or self.coordinator_id not in job_id:
+                continue
+
+            result_file_path = os.path.join(self.results_directory, file_name)
+            try:
+                is_error, value = read_spool_file(result_file_path)
+            except Exception as error:
+                is_error, value = True, RuntimeError('Cannot read the result of the job {}: {}'.format(job_id, error))
+            os.remove(result_file_path)
+
+            with self.lock:
+                # A requeued job can be returned twice, by a slow worker and by its new worker
+                future = self.futures.pop(job_id, None)
+                self.attempts.pop(job_id, None)
+            if future is None:
+                continue
+            if is_error is True:
+                future.set_exception(value)
+            else:
+                future.set_result(value)
+
+    def requeue_lost_jobs(self):
+        """Hand the jobs without worker heartbeat out again, or fail them after the max attempts"""
+        now = time.time()
+        for file_name in os.listdir(self.claimed_directory):
+            job_id = file_name.split('.', 1)[0]
+            if not file_name.endswith('.job') or self.coordinator_id not in job_id:
+                continue
+
+            claimed_file_path = os.path.join(self.claimed_directory, file_name)
+            try:
+                if now - os.stat(claimed_file_path).st_mtime <= self.lease_timeout:
+                    continue
+            except OSError:
+                # Done in the meantime
+                continue
+
+            with self.lock:
+                if job_id not in self.futures:
+                    continue
+                self.attempts[job_id] += 1
+                failed = self.attempts[job_id] > self.max_attempts
+                future = self.futures.pop(job_id) if failed else None
+
+            try:
+                if failed:
+                    os.remove(claimed_file_path)
+                else:
+                    os.rename(claimed_file_path, os.path.join(self.pending_directory, job_id + '.job'))
+            except OSError:
+                # Done in the meantime
+                pass
+
+            if failed:
+                future.set_exception(RuntimeError('The job {} was lost by {} workers'.format(job_id, self.max_attempts)))
+
+    def shutdown(self, wait=True):
+        """Stop collecting results once every job has its result
+
+        :param wait: Wait for the results of all the jobs
+        :type wait: bool
+        """
+        with self.lock:
+            self.is_shutdown = True
+            poller = self.poller
+        if wait is True and poller is not None:
+            poller.join()
+
+
+class SpoolWorker(object):
+    """This class defines a worker running the jobs of a spool directory, with a heartbeat so that its jobs are requeued if it is lost"""
+
+    def __init__(self, spool_directory, worker_id=None, heartbeat_interval=10.0, poll_interval=0.5):
+        """SpoolWorker initialization
+
+        :param spool_directory: The spool directory, on a storage shared by the coordinators and the workers
+        :type spool_directory: str
+        :param worker_id: Name of the worker in the claimed jobs ('None' value is the host name and the process id)
+        :type worker_id: str
+        :param heartbeat_interval: Wait between two heartbeats of the running job, shorter than the coordinators lease timeout (in seconds)
+        :type heartbeat_interval: float
+        :param poll_interval: Wait between two scans of the pending jobs when there is none (in seconds)
+        :type poll_interval: float
+        """
+        if worker_id is None:
+            worker_id = '{}-{}'.format(socket.gethostname(), os.getpid())
+
+        self.spool_directory = spool_directory
+        self.pending_directory, self.claimed_directory, self.results_directory = get_spool_directories(spool_directory)
+        self.worker_id = worker_id.replace('.', '-')
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.done_jobs = 0
+
+    def __str__(self):
+        """Display the worker informations
+
+        :return: human readable string describing the worker
+        :rtype: str
+        """
+        return "Worker {} of {}, {} done jobs".format(self.worker_id, self.spool_directory, self.done_jobs)
+
+    def claim_job(self):
+        """Claim the oldest pending job, by renaming it to the claimed jobs
+
+        :return: The job id and the claimed job file path, 'None' if there is no pending job
+        :rtype: tuple
+        """
+        for file_name in sorted(os.listdir(self.pending_directory)):
+            if not file_name.endswith('.job') or file_name.startswith('.'):
+                continue
+            job_id = file_name[:-len('.job')]
+            pending_file_path = os.path.join(self.pending_directory, file_name)
+            claimed_file_path = os.path.join(self.claimed_directory, '{}.{}.job'.format(job_id, self.worker_id))
+            try:
+                # The first heartbeat, before the rename: the lease of a job which waited in the pending jobs starts at its claim
+                os.utime(pending_file_path, None)
+                os.rename(pending_file_path, claimed_file_path)
+            except OSError:
+                # Claimed by another worker
+                continue
+            return job_id, claimed_file_path
+        return None
+
+    def run_job(self, job_id, claimed_file_path):
+        """Run a claimed job and write its result, the claimed job file is touched while it runs
+
+        :param job_id: The job id
+        :type job_id: str
+        :param claimed_file_path: The claimed job file path
+        :type claimed_file_path: str
+        """
+        stopped = threading.Event()
+
+        def heartbeat():
+            while not stopped.wait(self.heartbeat_interval):
+                try:
+                    os.utime(claimed_file_path, None)
+                except OSError:
+                    # Requeued by the coordinator
+                    return
+
+        heartbeat_thread = threading.Thread(target=heartbeat)
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+        try:
+            try:
+                function, args, kwargs = read_spool_file(claimed_file_path)
+                result = (False, function(*args, **kwargs))
+            except Exception as error:
+                result = (True, error)
+            try:
+                pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                result = (True, RuntimeError(repr(result[1])))
+            write_spool_file(os.path.join(self.results_directory, job_id + '.result'), result)
+        finally:
+            stopped.set()
+            heartbeat_thread.join()
+
+        try:
+            os.remove(claimed_file_path)
+        except OSError:
+            # Requeued by the coordinator, the result is still collected once
+            pass
+        self.done_jobs += 1
+
+    def run(self, max_jobs=None, idle_timeout=None):
+        """Run the pending jobs, one at a time
+
+        :param max_jobs: Stop after this number of jobs ('None' value is no limit)
+        :type max_jobs: int
+        :param idle_timeout: Stop after waiting this long without pending job (in seconds, 'None' value is no limit)
+        :type idle_timeout: float
+        """
+        idle_since = time.time()
+        while max_jobs is None or self.done_jobs < max_jobs:
+            claimed_job = self.claim_job()
+            if claimed_job is None:
+                if idle_timeout is not None and time.time() - idle_since >= idle_timeout:
+                    return
+                time.sleep(self.poll_interval)
+                continue
+            self.run_job(*claimed_job)
+            idle_since = time.time()
+
+
+def main(argv=None):
+    """Run a spool worker from the command line: python -m pertitleanalysis worker <spool_directory>
+
+    :param argv: The command line arguments, without the program name ('None' value is sys.argv)
+    :type argv: str[]
+    :return: The exit status of the worker, 130 when it is interrupted
+    :rtype: int
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='pertitleanalysis worker', description='Run the per-title analysis jobs of a spool directory')
+    parser.add_argument('spool_directory', help='the spool directory, on a storage shared with the coordinators')
+    parser.add_argument('--worker-id', help='name of the worker (default: host name and process id)')
+    parser.add_argument('--heartbeat-interval', type=float, default=10.0, help='wait between two heartbeats of the running job (in seconds)')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='wait between two scans of the pending jobs (in seconds)')
+    parser.add_argument('--max-jobs', type=int, help='stop after this number of jobs')
+    parser.add_argument('--idle-timeout', type=float, help='stop after waiting this long without pending job (in seconds)')
+    arguments = parser.parse_args(argv)
+
+    worker = SpoolWorker(arguments.spool_directory, arguments.worker_id, arguments.heartbeat_interval, arguments.poll_interval)
+    status = 0
+    try:
+        worker.run(arguments.max_jobs, arguments.idle_timeout)
+    except KeyboardInterrupt:
+        status = 130
+    sys.stderr.write(str(worker) + '\n')
+    return status
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import os
+import errno
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+class ScratchDirectory(object):
+    """This class defines a scratch directory for the temporary files of the analyses"""
+
+    def __init__(self, directory=None, min_free_space=2*1024*1024*1024, max_in_flight_size=None, fast_directories=None):
+        """ScratchDirectory initialization
+
+        :param directory: The scratch directory ('None' value is the first fast directory with enough free space, falling back to the system temporary directory)
+        :type directory: str
+        :param min_free_space: Free space needed to use a fast directory (in bytes)
+        :type min_free_space: int
+        :param max_in_flight_size: Maximum size reserved by the temporary files at the same time (in bytes, 'None' value is no limit)
+        :type max_in_flight_size: int
+        :param fast_directories: Memory backed directories to try first ('None' value is /dev/shm)
+        :type fast_directories: str[]
+        """
+        if fast_directories is None:
+            fast_directories = ['/dev/shm']
+
+        fallback_directory = None
+        if directory is None:
+            directory = tempfile.gettempdir()
+            for fast_directory in fast_directories:
+                if os.path.isdir(fast_directory) and os.access(fast_directory, os.W_OK) \
+                        and shutil.disk_usage(fast_directory).free >= min_free_space:
+                    fallback_directory = directory
+                    directory = fast_directory
+                    break
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.directory = directory
+        self.fallback_directory = fallback_directory
+        self.max_in_flight_size = max_in_flight_size
+
+        self.in_flight_size = 0
+        self.pinned_size = 0
+
+        # Size reserved in every directory, not written yet in the worst case
+        self.directory_sizes = {}
+        self.condition = threading.Condition()
+
+    def __str__(self):
+        """Display the scratch directory informations
+
+        :return: human readable string describing the scratch directory usage
+        :rtype: str
+        """
+        return "{}, in flight size={}, max in flight size={}".format(self.directory, self.in_flight_size, self.max_in_flight_size)
+
+    def __getstate__(self):
+        """Pickle the scratch directory for process pools, the in flight size is then limited per process"""
+        state = self.__dict__.copy()
+        del state['condition']
+        state['in_flight_size'] = 0
+        state['pinned_size'] = 0
+        state['directory_sizes'] = {}
+        return state
+
+    def __setstate__(self, state):
+        """Unpickle the scratch directory, on a host without the scratch directory (like a spool worker) the system temporary directory is used"""
+        self.__dict__.update(state)
+        self.condition = threading.Condition()
+        if self.fallback_directory is not None and not os.path.isdir(self.fallback_directory):
+            self.fallback_directory = None
+        if not os.path.isdir(self.directory):
+            self.directory = self.fallback_directory or tempfile.gettempdir()
+            self.fallback_directory = None
+
+    @contextmanager
+    def reserve(self, size, pinned=False):
+        """Reserve space for temporary files, waiting while the max in flight size is reached
+
+        A reservation larger than the remaining space is only granted when there is no other unpinned reservation.
+        Pinned reservations are meant to be held for a whole analysis (like a reference cache), they never wait.
+        The reserved directory and all its files are removed on exit, even when a task failed.
+        A reservation larger than the free space of the scratch directory goes to the fallback directory, if any.
+
+        :param size: Estimated size of the temporary files (in bytes)
+        :type size: int
+        :param pinned: The reservation is held by an analysis, not by a task
+        :type pinned: bool
+        :return: A private directory for the temporary files
+        :rtype: str
+        :raises OSError: the free space of the scratch and fallback directories is smaller than the reservation
+        """
+        directory = self.acquire(size, pinned)
+        with self.hold(directory, size, pinned) as reserved_directory:
+            yield reserved_directory
+
+    def acquire(self, size, pinned=False, wait=True):
+        """Reserve space for temporary files, see ScratchDirectory.reserve
+
+        :param size: Estimated size of the temporary files (in bytes)
+        :type size: int
+        :param pinned: The reservation is held by an analysis, not by a task
+        :type pinned: bool
+        :param wait: Wait while the max in flight size is reached, else return 'None' value at once
+        :type wait: bool
+        :return: The directory of the reservation, to be held with ScratchDirectory.hold, 'None' value when the max in flight size is reached without wait
+        :rtype: str
+        :raises OSError: the free space of the scratch and fallback directories is smaller than the reservation
+        """
+        size = max(int(size), 0)
+        with self.condition:
+            if self.max_in_flight_size is not None and pinned is False:
+                while self.in_flight_size > self.pinned_size and self.in_flight_size + size > self.max_in_flight_size:
+                    if wait is False:
+                        return None
+                    self.condition.wait()
+            directory = self.get_reservation_directory(size)
+            self.in_flight_size += size
+            self.directory_sizes[directory] = self.directory_sizes.get(directory, 0) + size
+            if pinned is True:
+                self.pinned_size += size
+        return directory
+
+    def release(self, directory, size, pinned=False):
+        """Release space reserved by ScratchDirectory.acquire
+
+        :param directory: The directory of the reservation
+        :type directory: str
+        :param size: Estimated size of the temporary files (in bytes)
+        :type size: int
+        :param pinned: The reservation is held by an analysis, not by a task
+        :type pinned: bool
+        """
+        size = max(int(size), 0)
+        with self.condition:
+            self.in_flight_size -= size
+            self.directory_sizes[directory] -= size
+            if pinned is True:
+                self.pinned_size -= size
+            self.condition.notify_all()
+
+    @contextmanager
+    def hold(self, directory, size, pinned=False):
+        """Hold space reserved by ScratchDirectory.acquire, it is released on exit
+
+        See ScratchDirectory.release for the parameters.
+
+        :return: A private directory for the temporary files, removed with all its files on exit
+        :rtype: str
+        """
+        try:
+            reserved_directory = tempfile.mkdtemp(prefix='pertitleanalysis_', dir=directory)
+            try:
+                yield reserved_directory
+            finally:
+                shutil.rmtree(reserved_directory, ignore_errors=True)
+        finally:
+            self.release(directory, size, pinned)
+
+    def get_reservation_directory(self, size):
+        """Get the directory of a reservation, the scratch directory when its free space (minus the other reservations) is enough, else the fallback directory
+
+        :param size: Estimated size of the temporary files (in bytes)
+        :type size: int
+        :return: The directory of the reservation
+        :rtype: str
+        :raises OSError: no directory has enough free space
+        """
+        directories = [directory for directory in [self.directory, self.fallback_directory] if directory is not None]
+        for directory in directories:
+            if size <= shutil.disk_usage(directory).free - self.directory_sizes.get(directory, 0):
+                return directory
+        raise OSError(errno.ENOSPC, 'Cannot reserve {} bytes of scratch space in {}'.format(size, ' or '.join(directories)))
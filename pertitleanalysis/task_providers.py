@@ -3,52 +3,202 @@
 import os
 import json
 import subprocess
+import threading
 import uuid
 
+from .metric_providers import FrameMetrics
+from .runner_providers import TaskRunner, TaskError, TaskTimeoutError, TaskOutputError, kill_process_group, \
+    wait_process, add_resource_usage
+
+
+def get_encoder_version():
+    """Get the version of the installed FFmpeg
+
+    :return: The first line of the ffmpeg version output
+    :rtype: str
+    """
+    proc = subprocess.Popen(['ffmpeg', '-version'], stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+    out, err = proc.communicate()
+    return out.decode('utf-8', 'replace').split('\n')[0].strip()
+
+
+def parse_metric_value(metric_output):
+    """Parse the average metric value from the FFmpeg ssim or psnr filter logs
+
+    :param metric_output: The FFmpeg stderr output
+    :type metric_output: bytes
+    :return: The average metric value, 'None' if not found
+    :rtype: float
+    """
+    # The summary is logged at the end, only the lines of the metric filter are decoded
+    for line in reversed(metric_output.splitlines()):
+        if b'Parsed_ssim' in line:
+            return float(line.split(b'All:')[1].split(b'(')[0].strip())
+        elif b'Parsed_psnr' in line:
+            return float(line.split(b'average:')[1].split(b'min:')[0].strip())
+    return None
+
+
+def get_reference_input_options(ref_width, ref_height, ref_framerate=None):
+    """Get the FFmpeg input options of a metric reference video
+
+    :param ref_width: Width of the reference video
+    :type ref_width: int
+    :param ref_height: Height of the reference video
+    :type ref_height: int
+    :param ref_framerate: Frame rate of a raw yuv420p reference video ('None' value is a reference video in any container format)
+    :type ref_framerate: int
+    :return: The input options, to be placed before the reference input
+    :rtype: str[]
+    """
+    if ref_framerate is None:
+        return []
+    return ['-f', 'rawvideo', '-pix_fmt', 'yuv420p', '-s', str(ref_width)+'x'+str(ref_height), '-r', str(ref_framerate)]
+
+
+def get_metric_filter_graph(metric, ref_width, ref_height, frame_step=None, stats_file=None):
+    """Get the FFmpeg filter graph assessing the first input against the reference second input
+
+    :param metric: Supporting "ssim" or "psnr"
+    :type metric: string
+    :param ref_width: Width of the reference video
+    :type ref_width: int
+    :param ref_height: Height of the reference video
+    :type ref_height: int
+    :param frame_step: Only assess every Nth frame ('None' value assesses every frame)
+    :type frame_step: int
+    :param stats_file: Per frame stats file of the metric filter ('None' value is no stats file)
+    :type stats_file: str
+    :return: The metric filter graph
+    :rtype: str
+    """
+    scaled = '[0]scale='+str(ref_width)+':'+str(ref_height)
+    if frame_step is not None and frame_step > 1:
+        frame_selection = 'select=not(mod(n\\,'+str(frame_step)+'))'
+        filter_graph = scaled+','+frame_selection+'[scaled];[1]'+frame_selection+'[reference];[scaled][reference]'+str(metric)
+    else:
+        filter_graph = scaled+'[scaled];[scaled][1]'+str(metric)
+    if stats_file is not None:
+        filter_graph += '=stats_file='+stats_file
+    return filter_graph
+
+
 class Task(object):
     """This class defines a processing task"""
 
-    def __init__(self, input_file_path):
+    # Analysis phase of the task, for the resource usage totals
+    phase = None
+
+    # The task is given a thread count by the governor of its runner, for each of its subprocesses
+    threaded = False
+    subprocess_count = 1
+
+    def __init__(self, input_file_path, runner=None):
         """Task initialization
 
         :param input_file_path: The input video file path
         :type input_file_path: str
+        :param runner: Runs the task subprocess ('None' value is no deadline and no retry)
+        :type runner: runner_providers.TaskRunner
         """
         if os.path.isfile(input_file_path) is True:
             self.input_file_path = input_file_path
         else:
             raise ValueError('Cannot access the file: {}'.format(input_file_path))
 
+        if runner is None:
+            runner = TaskRunner()
+        self.runner = runner
+
+        self.threads = None
+        if self.threaded is True:
+            self.threads = self.runner.get_threads()
+
         self.subprocess_pid = None
         self.subprocess_out = None
         self.subprocess_err = None
 
-    def execute(self, command):
+    def get_temporary_file_path(self, output_directory=None, extension='.mp4'):
+        """Generate a temporary file name for the task output
+
+        :param output_directory: Directory of the temporary file ('None' value is the input file directory)
+        :type output_directory: str
+        :param extension: Extension of the temporary file
+        :type extension: str
+        :return: A unique file path, named after the input file
+        :rtype: str
+        """
+        if output_directory is None:
+            output_directory = os.path.dirname(self.input_file_path)
+        return os.path.join(output_directory, os.path.splitext(os.path.basename(self.input_file_path))[0] + "_"+uuid.uuid4().hex+extension)
+
+    def get_thread_options(self, option='-threads'):
+        """Get a thread count option of the task command, the thread count is assigned by the governor of the task runner
+
+        :param option: "-threads" (decoder option before an input, encoder option before an output), "-filter_threads" (global option of the simple -vf graphs)
+                       or "-filter_complex_threads" (global option of the -lavfi and -filter_complex graphs)
+        :type option: str
+        :return: The option and its value, no option when the runner has no governor
+        :rtype: str[]
+        """
+        if self.threads is None:
+            return []
+        return [option, str(self.threads)]
+
+    def get_thread_slots(self):
+        """Get the number of thread counts the task runs at the same time: one for each of its subprocesses
+
+        :return: The number of thread counts
+        :rtype: int
+        """
+        return self.subprocess_count
+
+    def get_reserved_threads(self):
+        """Get the threads reserved in the governor budget while the task runs
+
+        :return: The thread count times the thread slots, 'None' value when the runner has no governor
+        :rtype: int
+        """
+        if self.threads is None:
+            return None
+        return self.threads*self.get_thread_slots()
+
+    def execute(self, command, stdout_line_handler=None):
         """Launch a subprocess task
 
         :param command: Arguments array for the subprocess task
         :type command: str[]
+        :param stdout_line_handler: Called with every stdout line while the task runs, the stdout is then not kept ('None' value keeps the whole stdout)
+        :type stdout_line_handler: callable
+        :raises runner_providers.TaskError: the subprocess failed or timed out on every attempt
         """
-        proc = subprocess.Popen(command, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-        self.subprocess_pid = proc.pid
+        self.runner.run(self, command, stdout_line_handler)
 
-        try:
-            self.subprocess_out, self.subprocess_err = proc.communicate()
-        except:
-            print(self.subprocess_err)
-            # TODO: error management
+    def prepare_retry(self):
+        """Reset the output parsed by a failed attempt, before a new attempt"""
+        pass
 
 
 class Probe(Task):
     """This class defines a Probing task"""
 
-    def __init__(self, input_file_path):
+    phase = 'probe'
+
+    PROBED_ATTRIBUTES = ['width', 'height', 'bitrate', 'duration', 'video_codec', 'framerate']
+
+    def __init__(self, input_file_path, cache=None, runner=None):
         """Probe initialization
 
         :param input_file_path: The input video file path
         :type input_file_path: str
+        :param cache: A probe cache looked up before launching FFprobe ('None' value is no cache)
+        :type cache: cache_providers.ProbeCache
+        :param runner: Runs the task subprocess ('None' value is no deadline and no retry)
+        :type runner: runner_providers.TaskRunner
         """
-        Task.__init__(self, input_file_path)
+        Task.__init__(self, input_file_path, runner)
+
+        self.cache = cache
 
         self.width = None
         self.height = None
@@ -59,14 +209,43 @@ class Probe(Task):
 
     def execute(self):
         """Using FFprobe to get input video file informations"""
-        command = ['ffprobe',
+        if self.load_cached() is True:
+            return
+
+        Task.execute(self, self.get_command())
+        self.parse_output()
+
+    def load_cached(self):
+        """Set the probed attributes from the probe cache
+
+        :return: True if the file was in the cache
+        :rtype: bool
+        """
+        if self.cache is not None:
+            values = self.cache.get(self.input_file_path)
+            if values is not None:
+                for attribute in self.PROBED_ATTRIBUTES:
+                    setattr(self, attribute, values[attribute])
+                return True
+        return False
+
+    def get_command(self):
+        """Get the FFprobe command
+
+        :return: Arguments array for the subprocess task
+        :rtype: str[]
+        """
+        return ['ffprobe',
                 '-hide_banner',
                 '-i', self.input_file_path,
                 '-show_format', '-show_streams',
                 '-print_format', 'json']
-        Task.execute(self, command)
 
-        # Parse output data
+    def parse_output(self):
+        """Parse the FFprobe output, then cache the probed attributes
+
+        :raises runner_providers.TaskOutputError: the output has no video stream informations
+        """
         try:
             response = self.subprocess_out
             data = json.loads(response.decode('utf-8'))
@@ -78,15 +257,117 @@ class Probe(Task):
                     self.duration = float(stream['duration'])
                     self.video_codec = stream['codec_name']
                     self.framerate = int(stream['r_frame_rate'].replace('/1',''))
-        except:
-             # TODO: error management
-             pass
+        except (ValueError, KeyError, TypeError) as error:
+            raise TaskOutputError('Cannot parse the probing output of {} ({})'.format(self.input_file_path, error), stderr=self.subprocess_err)
+
+        if self.width is None:
+            raise TaskOutputError('No video stream in {}'.format(self.input_file_path), stderr=self.subprocess_err)
+
+        if self.cache is not None:
+            self.cache.set(self.input_file_path, dict((attribute, getattr(self, attribute)) for attribute in self.PROBED_ATTRIBUTES))
+
+
+class PacketProbe(Task):
+    """This class defines a video packets probing task"""
+
+    phase = 'probe'
+
+    def __init__(self, input_file_path, runner=None):
+        """PacketProbe initialization
+
+        :param input_file_path: The input video file path
+        :type input_file_path: str
+        :param runner: Runs the task subprocess ('None' value is no deadline and no retry)
+        :type runner: runner_providers.TaskRunner
+        """
+        Task.__init__(self, input_file_path, runner)
+
+        self.packets = None
+
+    def execute(self):
+        """Using FFprobe to get the presentation time (in seconds) and size (in bytes) of every video packet"""
+        command = ['ffprobe',
+                '-hide_banner', '-loglevel', 'error',
+                '-i', self.input_file_path,
+                '-select_streams', 'v:0',
+                '-show_entries', 'packet=pts_time,size',
+                '-print_format', 'csv=print_section=0']
+        Task.execute(self, command)
+
+        # Parse output data
+        try:
+            self.packets = []
+            for line in self.subprocess_out.splitlines():
+                fields = line.split(b',')
+                if len(fields) < 2 or fields[0] == b'N/A':
+                    continue
+                self.packets.append((float(fields[0]), int(fields[1])))
+        except ValueError as error:
+            raise TaskOutputError('Cannot parse the packets of {} ({})'.format(self.input_file_path, error), stderr=self.subprocess_err)
+
+
+class SceneScore(Task):
+    """This class defines a scene change scoring task, a cheap complexity estimate of the video frames"""
+
+    phase = 'probe'
+    threaded = True
+
+    def __init__(self, input_file_path, analysis_width=320, runner=None):
+        """SceneScore initialization
+
+        :param input_file_path: The input video file path
+        :type input_file_path: str
+        :param analysis_width: Width of the downscaled frames compared by the scene detection
+        :type analysis_width: int
+        :param runner: Runs the task subprocess ('None' value is no deadline and no retry)
+        :type runner: runner_providers.TaskRunner
+        """
+        Task.__init__(self, input_file_path, runner)
+
+        self.analysis_width = analysis_width
+        self.scores = None
+
+    def add_line(self, line):
+        """Parse a line of the FFmpeg metadata filter output
+
+        :param line: A metadata line, like b"frame:1    pts:1024    pts_time:0.04" or b"lavfi.scene_score=0.012"
+        :type line: bytes
+        """
+        if line.startswith(b'frame:'):
+            position = line.find(b'pts_time:')
+            if position >= 0:
+                self.pts_time = float(line[position + len(b'pts_time:'):].split(None, 1)[0])
+        elif line.startswith(b'lavfi.scene_score=') and self.pts_time is not None:
+            self.scores.append((self.pts_time, float(line[len(b'lavfi.scene_score='):])))
+            self.pts_time = None
+
+    def execute(self):
+        """Using FFmpeg to get the presentation time (in seconds) and scene change score (from 0 to 1) of every video frame"""
+        command = ['ffmpeg',
+                '-hide_banner', '-nostats']
+        command += self.get_thread_options('-filter_threads') + self.get_thread_options()
+        command += [
+                '-i', self.input_file_path,
+                '-an', '-sn',
+                '-vf', 'scale={}:-2,select=gte(scene\\,0),metadata=print:file=-'.format(self.analysis_width),
+                '-f', 'null', '-']
+
+        self.prepare_retry()
+        Task.execute(self, command, self.add_line)
+
+    def prepare_retry(self):
+        """Reset the parsed scores"""
+        self.scores = []
+        self.pts_time = None
 
 
 class CrfEncode(Task):
     """This class defines a CRF encoding task"""
 
-    def __init__(self, input_file_path, width, height, crf_value, idr_interval, part_start_time, part_duration):
+    phase = 'encode'
+    threaded = True
+
+    def __init__(self, input_file_path, width, height, crf_value, idr_interval, part_start_time, part_duration, output_directory=None, runner=None, framerate=None):
         """CrfEncode initialization
 
         :param input_file_path: The input video file path
@@ -103,30 +384,39 @@ class CrfEncode(Task):
         :type part_start_time: float
         :param part_duration: Encode duration (in seconds)
         :type part_duration: float
+        :param output_directory: Directory of the temporary output file ('None' value is the input file directory)
+        :type output_directory: str
+        :param runner: Runs the task subprocess ('None' value is no deadline and no retry)
+        :type runner: runner_providers.TaskRunner
+        :param framerate: Output frame rate, dropping frames of the input ('None' value is the input frame rate)
+        :type framerate: float
         """
-        Task.__init__(self, input_file_path)
+        Task.__init__(self, input_file_path, runner)
 
         self.definition = str(width)+'x'+str(height)
         self.crf_value = crf_value
         self.idr_interval = idr_interval
         self.part_start_time = part_start_time
         self.part_duration = part_duration
+        self.framerate = framerate
 
         # Generate a temporary file name for the task output
-        self.output_file_path = os.path.join(os.path.dirname(self.input_file_path),
-                                             os.path.splitext(os.path.basename(self.input_file_path))[0] + "_"+uuid.uuid4().hex+".mp4")
-        print(self.output_file_path)
-        print(self.part_start_time)
-        print(self.input_file_path)
-        print(self.part_duration)
-        print(self.crf_value)
-        print(self.definition)
-        print(self.idr_interval)                                 
+        self.output_file_path = self.get_temporary_file_path(output_directory)
 
     def execute(self):
         """Using FFmpeg to CRF Encode a file or part of a file"""
+        Task.execute(self, self.get_command())
+
+    def get_command(self):
+        """Get the FFmpeg CRF encoding command
+
+        :return: Arguments array for the subprocess task
+        :rtype: str[]
+        """
         command = ['ffmpeg',
-                '-hide_banner', '-loglevel', 'quiet', '-nostats',
+                '-hide_banner', '-loglevel', 'quiet', '-nostats']
+        command += self.get_thread_options('-filter_threads') + self.get_thread_options()
+        command += [
                 '-ss', str(self.part_start_time),
                 '-i', self.input_file_path,
                 '-t', str(self.part_duration),
@@ -135,15 +425,21 @@ class CrfEncode(Task):
                 '-crf', str(self.crf_value),
                 '-pix_fmt', 'yuv420p',
                 '-s', self.definition,
-                '-x264opts', 'keyint=' + str(self.idr_interval),
-                '-y', self.output_file_path]
-        Task.execute(self, command)
+                '-x264opts', 'keyint=' + str(self.idr_interval)]
+        if self.framerate is not None:
+            command += ['-r', str(self.framerate)]
+        command += self.get_thread_options()
+        command += ['-y', self.output_file_path]
+        return command
 
 
 class CbrEncode(Task):
     """This class defines a CBR encoding task"""
 
-    def __init__(self, input_file_path, width, height, cbr_value, idr_interval, part_start_time, part_duration):
+    phase = 'encode'
+    threaded = True
+
+    def __init__(self, input_file_path, width, height, cbr_value, idr_interval, part_start_time, part_duration, output_directory=None, runner=None):
         """CrfEncode initialization
 
         :param input_file_path: The input video file path
@@ -160,8 +456,12 @@ class CbrEncode(Task):
         :type part_start_time: float
         :param part_duration: Encode duration (in seconds)
         :type part_duration: float
+        :param output_directory: Directory of the temporary output file ('None' value is the input file directory)
+        :type output_directory: str
+        :param runner: Runs the task subprocess ('None' value is no deadline and no retry)
+        :type runner: runner_providers.TaskRunner
         """
-        Task.__init__(self, input_file_path)
+        Task.__init__(self, input_file_path, runner)
 
         self.definition = str(width)+'x'+str(height)
         self.cbr_value = cbr_value
@@ -170,13 +470,22 @@ class CbrEncode(Task):
         self.part_duration = part_duration
 
         # Generate a temporary file name for the task output
-        self.output_file_path = os.path.join(os.path.dirname(self.input_file_path),
-                                             os.path.splitext(os.path.basename(self.input_file_path))[0] + "_"+uuid.uuid4().hex+".mp4")
+        self.output_file_path = self.get_temporary_file_path(output_directory)
 
     def execute(self):
         """Using FFmpeg to CRF Encode a file or part of a file"""
+        Task.execute(self, self.get_command())
+
+    def get_command(self):
+        """Get the FFmpeg CBR encoding command
+
+        :return: Arguments array for the subprocess task
+        :rtype: str[]
+        """
         command = ['ffmpeg',
-                '-hide_banner', '-loglevel', 'quiet', '-nostats',
+                '-hide_banner', '-loglevel', 'quiet', '-nostats']
+        command += self.get_thread_options('-filter_threads') + self.get_thread_options()
+        command += [
                 '-ss', str(self.part_start_time),
                 '-i', self.input_file_path,
                 '-t', str(self.part_duration),
@@ -185,7 +494,117 @@ class CbrEncode(Task):
                 '-b:v', str(self.cbr_value),
                 '-pix_fmt', 'yuv420p',
                 '-s', self.definition,
-                '-x264opts', 'keyint=' + str(self.idr_interval),
+                '-x264opts', 'keyint=' + str(self.idr_interval)]
+        command += self.get_thread_options()
+        command += ['-y', self.output_file_path]
+        return command
+
+
+class MultiCbrEncode(Task):
+    """This class defines a CBR encoding task decoding the input once for multiple renditions"""
+
+    phase = 'encode'
+    threaded = True
+
+    def __init__(self, input_file_path, renditions, idr_interval, part_start_time, part_duration, output_directory=None, runner=None):
+        """MultiCbrEncode initialization
+
+        :param input_file_path: The input video file path
+        :type input_file_path: str
+        :param renditions: The (width, height, cbr_value) of every rendition to encode
+        :type renditions: tuple[]
+        :param idr_interval: IDR Interval in frames ('None' value is no fix IDR interval needed)
+        :type idr_interval: int
+        :param part_start_time: Encode seek start time (in seconds)
+        :type part_start_time: float
+        :param part_duration: Encode duration (in seconds)
+        :type part_duration: float
+        :param output_directory: Directory of the temporary output file ('None' value is the input file directory)
+        :type output_directory: str
+        :param runner: Runs the task subprocess ('None' value is no deadline and no retry)
+        :type runner: runner_providers.TaskRunner
+        """
+        Task.__init__(self, input_file_path, runner)
+
+        if len(renditions) == 0:
+            raise ValueError('At least one rendition is required')
+
+        self.renditions = renditions
+        self.idr_interval = idr_interval
+        self.part_start_time = part_start_time
+        self.part_duration = part_duration
+
+        # Generate a temporary file name for each rendition output
+        self.output_file_paths = []
+        for _ in self.renditions:
+            self.output_file_paths.append(self.get_temporary_file_path(output_directory))
+
+    def get_thread_slots(self):
+        """Get the number of thread counts the task runs at the same time: one libx264 encoder for each rendition
+
+        :return: The number of thread counts
+        :rtype: int
+        """
+        return len(self.renditions)
+
+    def execute(self):
+        """Using FFmpeg to decode once and CBR Encode every rendition through a split/scale filter graph"""
+        filter_graph = '[0:v:0]yadif=deint=interlaced,split=' + str(len(self.renditions))
+        filter_graph += ''.join('[split' + str(i) + ']' for i in range(len(self.renditions)))
+        for i, (width, height, cbr_value) in enumerate(self.renditions):
+            filter_graph += ';[split' + str(i) + ']scale=' + str(width) + ':' + str(height) + '[out' + str(i) + ']'
+
+        command = ['ffmpeg',
+                '-hide_banner', '-loglevel', 'quiet', '-nostats']
+        command += self.get_thread_options('-filter_complex_threads') + self.get_thread_options()
+        command += [
+                '-ss', str(self.part_start_time),
+                '-i', self.input_file_path,
+                '-filter_complex', filter_graph]
+        for i, (width, height, cbr_value) in enumerate(self.renditions):
+            command += ['-map', '[out' + str(i) + ']',
+                        '-t', str(self.part_duration),
+                        '-c:v', 'libx264',
+                        '-an',
+                        '-b:v', str(cbr_value),
+                        '-pix_fmt', 'yuv420p',
+                        '-x264opts', 'keyint=' + str(self.idr_interval)]
+            command += self.get_thread_options()
+            command += ['-y', self.output_file_paths[i]]
+        Task.execute(self, command)
+
+
+class RawDecode(Task):
+    """This class defines a raw video decoding task"""
+
+    phase = 'decode'
+    threaded = True
+
+    def __init__(self, input_file_path, output_directory=None, runner=None):
+        """RawDecode initialization
+
+        :param input_file_path: The input video file path
+        :type input_file_path: str
+        :param output_directory: Directory of the raw output file ('None' value is the input file directory)
+        :type output_directory: str
+        :param runner: Runs the task subprocess ('None' value is no deadline and no retry)
+        :type runner: runner_providers.TaskRunner
+        """
+        Task.__init__(self, input_file_path, runner)
+
+        # Generate a temporary file name for the task output
+        self.output_file_path = self.get_temporary_file_path(output_directory, '.yuv')
+
+    def execute(self):
+        """Using FFmpeg to decode the video into a raw yuv420p file"""
+        command = ['ffmpeg',
+                '-hide_banner', '-loglevel', 'quiet', '-nostats']
+        command += self.get_thread_options('-filter_threads') + self.get_thread_options()
+        command += [
+                '-i', self.input_file_path,
+                '-an',
+                '-pix_fmt', 'yuv420p',
+                '-f', 'rawvideo',
                 '-y', self.output_file_path]
         Task.execute(self, command)
 
@@ -193,7 +612,10 @@ class CbrEncode(Task):
 class Metric(Task):
     """This class defines a Probing task"""
 
-    def __init__(self, metric, input_file_path, ref_file_path, ref_width, ref_height):
+    phase = 'metric'
+    threaded = True
+
+    def __init__(self, metric, input_file_path, ref_file_path, ref_width, ref_height, ref_framerate=None, ref_start_time=None, ref_duration=None, frame_step=None, runner=None):
         """Probe initialization
 
         :param metric: Supporting "ssim" or "psnr"
@@ -202,14 +624,30 @@ class Metric(Task):
         :type input_file_path: str
         :param ref_file_path: The reference video file path
         :type ref_file_path: str
-
+        :param ref_width: Width of the reference video
+        :type ref_width: int
+        :param ref_height: Height of the reference video
+        :type ref_height: int
+        :param ref_framerate: Frame rate of a raw yuv420p reference video ('None' value is a reference video in any container format)
+        :type ref_framerate: int
+        :param ref_start_time: Reference seek start time, matching the analyzed video (in seconds, 'None' value is no seek)
+        :type ref_start_time: float
+        :param ref_duration: Reference duration, matching the analyzed video (in seconds, 'None' value is the whole reference)
+        :type ref_duration: float
+        :param frame_step: Only assess every Nth frame ('None' value assesses every frame)
+        :type frame_step: int
+        :param runner: Runs the task subprocess ('None' value is no deadline and no retry)
+        :type runner: runner_providers.TaskRunner
         """
-        Task.__init__(self, input_file_path)
+        Task.__init__(self, input_file_path, runner)
 
         if os.path.isfile(ref_file_path) is True:
             self.ref_file_path = ref_file_path
             self.ref_width = ref_width
             self.ref_height = ref_height
+            self.ref_framerate = ref_framerate
+            self.ref_start_time = ref_start_time
+            self.ref_duration = ref_duration
         else:
             raise ValueError('Cannot access the file: {}'.format(ref_file_path))
 
@@ -218,28 +656,236 @@ class Metric(Task):
         if self.metric not in available_metrics:
             raise ValueError('Available metrics are "ssim" and "psnr", does not include: {}'.format(metric))
 
+        self.frame_step = frame_step
         self.output_value = None
+        self.frame_metrics = FrameMetrics(self.metric)
 
     def execute(self):
-        """Using FFmpeg to process metric assessments"""
+        """Using FFmpeg to process metric assessments, the per frame stats are parsed while they are written"""
+        Task.execute(self, self.get_command(), self.frame_metrics.add_line)
+        self.parse_output()
+
+    def get_command(self):
+        """Get the FFmpeg metric assessment command, writing the per frame stats to stdout
+
+        :return: Arguments array for the subprocess task
+        :rtype: str[]
+        """
         command = ['ffmpeg',
-                '-hide_banner',
+                '-hide_banner']
+        command += self.get_thread_options('-filter_complex_threads') + self.get_thread_options()
+        command += [
+                '-i', self.input_file_path]
+        if self.ref_start_time is not None:
+            command += ['-ss', str(self.ref_start_time)]
+        if self.ref_duration is not None:
+            command += ['-t', str(self.ref_duration)]
+        command += get_reference_input_options(self.ref_width, self.ref_height, self.ref_framerate)
+        command += self.get_thread_options()
+        command += [
+                '-i', self.ref_file_path,
+                '-lavfi', get_metric_filter_graph(self.metric, self.ref_width, self.ref_height, self.frame_step, '-'),
+                '-f', 'null', '-']
+        return command
+
+    def prepare_retry(self):
+        """Reset the parsed per frame values"""
+        self.frame_metrics = FrameMetrics(self.metric)
+
+    def parse_output(self):
+        """Parse the average metric value from the FFmpeg logs
+
+        :raises runner_providers.TaskOutputError: the logs have no metric value
+        """
+        try:
+            self.output_value = parse_metric_value(self.subprocess_err)
+        except (ValueError, IndexError) as error:
+            raise TaskOutputError('Cannot parse the {} value of {} ({})'.format(self.metric, self.input_file_path, error), stderr=self.subprocess_err)
+        if self.output_value is None:
+            raise TaskOutputError('No {} value for {}'.format(self.metric, self.input_file_path), stderr=self.subprocess_err)
+
+
+class CbrEncodeMetric(Task):
+    """This class defines a CBR encoding task piped into a metric assessment task, without temporary file"""
+
+    phase = 'encode_metric'
+    threaded = True
+    subprocess_count = 2
+
+    def __init__(self, metric, input_file_path, width, height, cbr_value, idr_interval, part_start_time, part_duration, ref_width, ref_height,
+                 ref_file_path=None, ref_framerate=None, frame_step=None, runner=None):
+        """CbrEncodeMetric initialization
+
+        :param metric: Supporting "ssim" or "psnr"
+        :type metric: string
+        :param input_file_path: The input video file path, also used as the metric reference
+        :type input_file_path: str
+        :param width: Width of the CBR encode
+        :type width: int
+        :param height: Height of the CBR encode
+        :type height: int
+        :param cbr_value: The CBR Encoding value for ffmpeg
+        :type cbr_value: int
+        :param idr_interval: IDR Interval in frames ('None' value is no fix IDR interval needed)
+        :type idr_interval: int
+        :param part_start_time: Encode seek start time (in seconds)
+        :type part_start_time: float
+        :param part_duration: Encode duration (in seconds)
+        :type part_duration: float
+        :param ref_width: Width of the reference video
+        :type ref_width: int
+        :param ref_height: Height of the reference video
+        :type ref_height: int
+        :param ref_file_path: The reference video file path ('None' value is the input file)
+        :type ref_file_path: str
+        :param ref_framerate: Frame rate of a raw yuv420p reference video ('None' value is a reference video in any container format)
+        :type ref_framerate: int
+        :param frame_step: Only assess every Nth frame ('None' value assesses every frame)
+        :type frame_step: int
+        :param runner: Runs the task subprocess ('None' value is no deadline and no retry)
+        :type runner: runner_providers.TaskRunner
+        """
+        Task.__init__(self, input_file_path, runner)
+
+        if ref_file_path is None:
+            ref_file_path = input_file_path
+        if os.path.isfile(ref_file_path) is False:
+            raise ValueError('Cannot access the file: {}'.format(ref_file_path))
+
+        available_metrics = ['ssim', 'psnr']
+        self.metric = str(metric).strip().lower()
+        if self.metric not in available_metrics:
+            raise ValueError('Available metrics are "ssim" and "psnr", does not include: {}'.format(metric))
+
+        self.definition = str(width)+'x'+str(height)
+        self.cbr_value = cbr_value
+        self.idr_interval = idr_interval
+        self.part_start_time = part_start_time
+        self.part_duration = part_duration
+        self.ref_file_path = ref_file_path
+        self.ref_width = ref_width
+        self.ref_height = ref_height
+        self.ref_framerate = ref_framerate
+        self.frame_step = frame_step
+
+        self.output_value = None
+        self.frame_metrics = FrameMetrics(self.metric)
+        self.encoded_size = None
+        self.encoded_bitrate = None
+
+    def execute(self):
+        """Using FFmpeg to CBR Encode into a NUT stream, piped into a FFmpeg metric assessment of the input file, the per frame stats are parsed while they are written"""
+        encode_command = ['ffmpeg',
+                '-hide_banner', '-loglevel', 'quiet', '-nostats']
+        encode_command += self.get_thread_options('-filter_threads') + self.get_thread_options()
+        encode_command += [
+                '-ss', str(self.part_start_time),
                 '-i', self.input_file_path,
+                '-t', str(self.part_duration),
+                '-c:v', 'libx264',
+                '-an', '-deinterlace',
+                '-b:v', str(self.cbr_value),
+                '-pix_fmt', 'yuv420p',
+                '-s', self.definition,
+                '-x264opts', 'keyint=' + str(self.idr_interval)]
+        encode_command += self.get_thread_options()
+        encode_command += ['-f', 'nut', '-']
+        metric_command = ['ffmpeg',
+                '-hide_banner']
+        metric_command += self.get_thread_options('-filter_complex_threads') + self.get_thread_options()
+        metric_command += [
+                '-f', 'nut', '-i', '-',
+                '-ss', str(self.part_start_time),
+                '-t', str(self.part_duration)]
+        metric_command += get_reference_input_options(self.ref_width, self.ref_height, self.ref_framerate)
+        metric_command += self.get_thread_options()
+        metric_command += [
                 '-i', self.ref_file_path,
-                '-lavfi', '[0]scale='+str(self.ref_width)+':'+str(self.ref_height)+'[scaled];[scaled][1]'+str(self.metric)+'=stats_file=-',
+                '-lavfi', get_metric_filter_graph(self.metric, self.ref_width, self.ref_height, self.frame_step, '-'),
                 '-f', 'null', '-']
-        Task.execute(self, command)
+
+        self.runner.retry(self, lambda: self.run_pipeline(encode_command, metric_command))
 
         # Parse output data
         try:
-            data = self.subprocess_err.splitlines()
-            for line in data:
-                line = str(line)
-                if 'Parsed_ssim' in line:
-                    self.output_value = float(line.split('All:')[1].split('(')[0].strip())
-                elif 'Parsed_psnr' in line:
-                    self.output_value = float(line.split('average:')[1].split('min:')[0].strip())
-
-        except:
-            # TODO: error management
-            pass
+            self.output_value = parse_metric_value(self.subprocess_err)
+        except (ValueError, IndexError) as error:
+            raise TaskOutputError('Cannot parse the {} value of {} ({})'.format(self.metric, self.input_file_path, error), stderr=self.subprocess_err)
+        if self.output_value is None:
+            raise TaskOutputError('No {} value for {}'.format(self.metric, self.input_file_path), stderr=self.subprocess_err)
+
+    def prepare_retry(self):
+        """Reset the parsed per frame values"""
+        self.frame_metrics = FrameMetrics(self.metric)
+
+    def run_pipeline(self, encode_command, metric_command):
+        """Run the encode and metric subprocesses once, the encoded stream is pumped into the metric process
+
+        :param encode_command: Arguments array of the encode subprocess
+        :type encode_command: str[]
+        :param metric_command: Arguments array of the metric subprocess
+        :type metric_command: str[]
+        :raises runner_providers.TaskTimeoutError: the subprocesses were killed after the deadline
+        :raises runner_providers.TaskError: a subprocess exited with an error
+        """
+        start_new_session = (os.name == 'posix')
+        encode_proc = subprocess.Popen(encode_command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, start_new_session=start_new_session)
+        metric_proc = subprocess.Popen(metric_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=start_new_session)
+        self.subprocess_pid = metric_proc.pid
+
+        timed_out = threading.Event()
+        timer = None
+        if self.runner.timeout is not None:
+            timer = self.runner.start_deadline(timed_out, [encode_proc, metric_proc])
+
+        # Drain the metric logs and parse the per frame stats while the encoded stream is pumped into the metric process
+        metric_err = []
+        metric_err_reader = threading.Thread(target=lambda: metric_err.append(metric_proc.stderr.read()))
+        metric_err_reader.start()
+        metric_out_reader = threading.Thread(target=self.read_frame_metrics, args=(metric_proc.stdout,))
+        metric_out_reader.start()
+
+        encoded_size = 0
+        try:
+            for chunk in iter(lambda: encode_proc.stdout.read(1024*1024), b''):
+                encoded_size += len(chunk)
+                metric_proc.stdin.write(chunk)
+        except BrokenPipeError:
+            # The metric process exited early, its exit code is checked below
+            kill_process_group(encode_proc)
+        except BaseException:
+            # Interrupted: do not leave the subprocesses running
+            kill_process_group(encode_proc)
+            kill_process_group(metric_proc)
+            raise
+        finally:
+            try:
+                metric_proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            add_resource_usage(self.statistics, wait_process(encode_proc))
+            add_resource_usage(self.statistics, wait_process(metric_proc))
+            metric_err_reader.join()
+            metric_out_reader.join()
+            if timer is not None:
+                timer.cancel()
+
+        self.subprocess_err = metric_err[0] if len(metric_err) > 0 else b''
+        self.encoded_size = encoded_size
+        self.encoded_bitrate = encoded_size*8/self.part_duration
+
+        if timed_out.is_set():
+            raise TaskTimeoutError('Task timed out after {} seconds'.format(self.runner.timeout), metric_command, metric_proc.returncode, self.subprocess_err)
+        if metric_proc.returncode != 0:
+            raise TaskError('Task failed', metric_command, metric_proc.returncode, self.subprocess_err)
+        if encode_proc.returncode != 0:
+            raise TaskError('Task failed', encode_command, encode_proc.returncode)
+
+    def read_frame_metrics(self, stats_file):
+        """Parse the per frame stats of the metric process
+
+        :param stats_file: The metric process stdout
+        :type stats_file: file
+        """
+        for line in stats_file:
+            self.frame_metrics.add_line(line)
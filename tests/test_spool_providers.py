@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Test of the spool executor with several worker processes on localhost"""
+
+import os
+import sys
+import time
+import signal
+import subprocess
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pertitleanalysis.spool_providers import SpoolExecutor
+
+# Lease of the claimed jobs, the heartbeat of the workers and the run time of a job (in seconds)
+LEASE_TIMEOUT = 1.0
+HEARTBEAT_INTERVAL = 0.2
+JOB_DURATION = 1.5
+
+
+def log_run(log_file_path, name, state):
+    """Append a run state of a job to the log shared by the workers"""
+    with open(log_file_path, 'a') as log_file:
+        log_file.write('{} {} {}\n'.format(name, state, os.getpid()))
+
+
+def run_job(log_file_path, name):
+    """A job running longer than the lease, it relies on the heartbeat of its worker"""
+    log_run(log_file_path, name, 'start')
+    time.sleep(JOB_DURATION)
+    log_run(log_file_path, name, 'done')
+    return name
+
+
+def lose_worker(log_file_path, name):
+    """A job killing its first worker, as a lost host would"""
+    log_run(log_file_path, name, 'start')
+    if not os.path.exists(log_file_path + '.lost'):
+        open(log_file_path + '.lost', 'w').close()
+        os.kill(os.getpid(), signal.SIGKILL)
+    log_run(log_file_path, name, 'done')
+    return name
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGKILL'), reason='needs SIGKILL')
+def test_spool_workers(tmp_path):
+    spool_directory = str(tmp_path / 'spool')
+    log_file_path = str(tmp_path / 'runs.log')
+    executor = SpoolExecutor(spool_directory, lease_timeout=LEASE_TIMEOUT, max_attempts=2, poll_interval=0.05)
+
+    # The queue is older than the lease when the workers start
+    names = ['job{}'.format(i) for i in range(4)]
+    futures = [executor.submit(run_job, log_file_path, name) for name in names]
+    futures.append(executor.submit(lose_worker, log_file_path, 'lost'))
+    time.sleep(LEASE_TIMEOUT*1.5)
+
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.path.dirname(os.path.abspath(__file__)),
+                                                 environment.get('PYTHONPATH', '')])
+    workers = [subprocess.Popen([sys.executable, '-m', 'pertitleanalysis', 'worker', spool_directory, '--heartbeat-interval', str(HEARTBEAT_INTERVAL),
+                                 '--poll-interval', '0.05', '--idle-timeout', '2'], env=environment) for i in range(3)]
+    try:
+        assert [future.result(timeout=60) for future in futures] == names + ['lost']
+    finally:
+        executor.shutdown()
+        for worker in workers:
+            worker.wait(timeout=60)
+
+    with open(log_file_path) as log_file:
+        runs = [line.split() for line in log_file]
+    for name in names:
+        assert [state for run_name, state, pid in runs if run_name == name] == ['start', 'done']
+
+    # The lost job is handed out again, to another worker
+    lost_runs = [(state, pid) for run_name, state, pid in runs if run_name == 'lost']
+    assert [state for state, pid in lost_runs] == ['start', 'start', 'done']
+    assert lost_runs[0][1] != lost_runs[1][1]
+    assert sorted(worker.returncode for worker in workers) == [-signal.SIGKILL, 0, 0]
+    assert os.listdir(os.path.join(spool_directory, 'claimed')) == []